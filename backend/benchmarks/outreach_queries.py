@@ -0,0 +1,125 @@
+"""
+Query benchmark for the outreach hot paths, before and after the index migration.
+
+Seeds a throwaway SQLite database with PatientOutreach rows (1M by default),
+times the app's outreach queries at the baseline revision, upgrades to head
+and times them again.
+
+    cd backend && python -m benchmarks.outreach_queries [--rows 1000000]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from alembic import command
+from sqlalchemy import create_engine, text
+
+from database import alembic_config
+
+RUNS = 200
+SEGMENTS = ["one-and-done", "lapsed", "vip", "referrers", "cross-sell"]
+
+QUERIES = {
+    "pending for one run": (
+        "SELECT id, patient_id, contacted_at FROM patient_outreach "
+        "WHERE run_id = :run_id AND contacted_at IS NOT NULL AND returned_at IS NULL"
+    ),
+    "pending across runs": (
+        "SELECT count(*) FROM patient_outreach WHERE contacted_at IS NOT NULL AND returned_at IS NULL"
+    ),
+    "run + patient lookup": (
+        "SELECT id FROM patient_outreach WHERE run_id = :run_id AND patient_id = :patient_id"
+    ),
+    "patient across runs": (
+        "SELECT run_id, contacted_at FROM patient_outreach WHERE patient_id = :patient_id"
+    ),
+    "segment performance": (
+        "SELECT segment, count(*), sum(returned_at IS NOT NULL), sum(revenue_recovered) FROM patient_outreach "
+        "WHERE contacted_at IS NOT NULL AND segment IS NOT NULL GROUP BY segment"
+    ),
+    "run outreach list": (
+        "SELECT id, patient_id, segment, contacted_at, returned_at FROM patient_outreach WHERE run_id = :run_id"
+    ),
+}
+
+
+def _upgrade(url, revision):
+    config = alembic_config(url)
+    config.attributes["configure_logger"] = False
+    command.upgrade(config, revision)
+
+
+def seed(engine, rows, batch_size=50000):
+    rng = random.Random(42)
+    start = datetime(2025, 1, 1)
+    with engine.begin() as conn:
+        for offset in range(0, rows, batch_size):
+            batch = []
+            for i in range(offset, min(rows, offset + batch_size)):
+                contacted = start + timedelta(minutes=rng.randrange(365 * 24 * 60))
+                returned = contacted + timedelta(days=rng.randrange(1, 90)) if rng.random() < 0.3 else None
+                batch.append({
+                    "id": f"o{i}",
+                    "run_id": f"run-{rng.randrange(RUNS)}",
+                    "patient_id": f"p{rng.randrange(rows // 2)}",
+                    "segment": rng.choice(SEGMENTS),
+                    "contacted_at": contacted,
+                    "returned_at": returned,
+                    "revenue_recovered": rng.uniform(100, 2000) if returned else None,
+                    "outcome": "closed" if returned else "pending",
+                })
+            conn.execute(text(
+                "INSERT INTO patient_outreach (id, run_id, patient_id, segment, contacted_at, returned_at, "
+                "revenue_recovered, outcome) VALUES (:id, :run_id, :patient_id, :segment, :contacted_at, "
+                ":returned_at, :revenue_recovered, :outcome)"
+            ), batch)
+        conn.execute(text("ANALYZE"))
+
+
+def time_queries(engine, repeat):
+    params = {"run_id": "run-7", "patient_id": "p1234"}
+    timings = {}
+    with engine.connect() as conn:
+        for name, sql in QUERIES.items():
+            conn.execute(text(sql), params).fetchall()  # warm the page cache
+            started = time.perf_counter()
+            for _ in range(repeat):
+                conn.execute(text(sql), params).fetchall()
+            timings[name] = (time.perf_counter() - started) / repeat * 1000
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        _upgrade(url, "0001_baseline")
+        engine = create_engine(url, future=True)
+
+        started = time.perf_counter()
+        seed(engine, args.rows)
+        print(f"Seeded {args.rows:,} outreach rows in {time.perf_counter() - started:.1f}s")
+
+        before = time_queries(engine, args.repeat)
+        _upgrade(url, "head")
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+        after = time_queries(engine, args.repeat)
+        engine.dispose()
+
+    print(f"\n{'query':<24}{'baseline ms':>14}{'head ms':>12}{'speedup':>10}")
+    for name in QUERIES:
+        speedup = before[name] / after[name] if after[name] else float("inf")
+        print(f"{name:<24}{before[name]:>14.2f}{after[name]:>12.2f}{speedup:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
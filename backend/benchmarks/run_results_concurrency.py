@@ -0,0 +1,138 @@
+"""
+Concurrency benchmark for GET /api/v1/runs/{run_id}/results.
+
+Seeds a throwaway SQLite database (WAL, async engine) with completed runs and
+their artifacts, then drives the endpoint in-process with 50 parallel clients.
+With --writer a background thread keeps committing outreach rows through the
+sync engine, the mix where WAL and the busy timeout matter.
+
+    cd backend && python -m benchmarks.run_results_concurrency [--clients 50] [--requests 2000] [--writer]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+
+
+def _seed(tmp, runs):
+    from database import AnalysisRun, Dataset, SessionLocal, create_tables
+    from main import summarize_run_dataset
+    from services.run_artifacts import save_run_artifacts
+
+    create_tables()
+    patients_path = os.path.join(tmp, "patients.csv")
+    with open(patients_path, "w") as f:
+        f.write("patient_id,zip_code,procedure,revenue,visit_date\n")
+        for i in range(200):
+            f.write(f"p{i},{78701 + i % 20},botox,{250 + i % 7 * 50},2025-0{1 + i % 9}-15\n")
+    # Stored at run completion, like create_run does
+    dataset_summary = summarize_run_dataset(patients_path)
+
+    db = SessionLocal()
+    run_ids = []
+    for i in range(runs):
+        dataset_id, run_id = str(uuid.uuid4()), str(uuid.uuid4())
+        db.add(Dataset(id=dataset_id, patients_path=patients_path, practice_zip="78701"))
+        db.add(AnalysisRun(id=run_id, dataset_id=dataset_id, status="done", procedure="botox", patient_count=200))
+        save_run_artifacts(db, run_id, {
+            "top_segments": [{"zip": str(78701 + z), "cohort": "Premium Market", "match_score": 0.9 - z / 100,
+                              "expected_monthly_revenue": 1000 + z} for z in range(20)],
+            "dominant_profile": {"dominant_profile": {"combined": "Premium Market"}, "segment_patient_count": 200},
+            "strategic_insights": ["Focus on high-intent ZIPs"],
+            "dataset_summary": dataset_summary,
+        })
+        run_ids.append(run_id)
+    db.commit()
+    db.close()
+    return run_ids
+
+
+def _writer(stop, counter):
+    from database import PatientOutreach, SessionLocal
+
+    db = SessionLocal()
+    while not stop.is_set():
+        db.add(PatientOutreach(id=str(uuid.uuid4()), run_id="bench", patient_id=str(counter[0])))
+        db.commit()
+        counter[0] += 1
+    db.close()
+
+
+async def _drive(app, run_ids, clients, total):
+    import httpx
+
+    latencies, errors = [], 0
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(run_ids[i % len(run_ids)])
+
+    async def client(http):
+        nonlocal errors
+        while True:
+            try:
+                run_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            response = await http.get(f"/api/v1/runs/{run_id}/results")
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200 or response.json().get("status") != "done":
+                errors += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(http) for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+
+    from database import get_async_engine
+    await get_async_engine().dispose()
+    return elapsed, latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--writer", action="store_true", help="commit outreach rows concurrently")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Must be set before database / main are imported
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        with contextlib.redirect_stdout(io.StringIO()):
+            import main as app_module
+            run_ids = _seed(tmp, args.runs)
+
+        stop, written = threading.Event(), [0]
+        writer = threading.Thread(target=_writer, args=(stop, written), daemon=True)
+        if args.writer:
+            writer.start()
+        # The endpoint prints debug lines per request; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed, latencies, errors = asyncio.run(_drive(app_module.app, run_ids, args.clients, args.requests))
+        stop.set()
+        if args.writer:
+            writer.join()
+
+        from database import engine
+        engine.dispose()
+
+    latencies.sort()
+    print(f"{args.requests} requests, {args.clients} clients: {args.requests / elapsed:.0f} req/s")
+    print(f"latency p50 {statistics.median(latencies) * 1000:.1f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms, errors {errors}")
+    if args.writer:
+        print(f"writer committed {written[0]} outreach rows alongside")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,8 @@
 import os
 from datetime import datetime
 
-from sqlalchemy import create_engine, Column, String, Integer, Float, DateTime, Text, JSON
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import create_engine, event, Column, String, Integer, Float, Date, DateTime, Text, JSON, Index, LargeBinary
+from sqlalchemy.orm import sessionmaker, declarative_base, deferred
 from dotenv import load_dotenv
 
 # Load .env variables (safe if the file doesn't exist)
@@ -17,16 +17,85 @@ if not DATABASE_URL:
     # Fallback when DATABASE_URL is unset or empty
     DATABASE_URL = f"sqlite:///{DB_FILE}"
 
-# Echo off by default; enable if you want SQL logs
-engine_kwargs = {"future": True, "echo": False}
-if DATABASE_URL.startswith("sqlite"):
-    # Needed for SQLite with FastAPI in a single process
-    engine_kwargs["connect_args"] = {"check_same_thread": False}
+# Pool sizing (ignored for in-memory SQLite, which shares one connection)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# How long a SQLite writer waits on a locked database before raising
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
 
-engine = create_engine(DATABASE_URL, **engine_kwargs)
+
+def _is_memory_sqlite(url):
+    return url.startswith("sqlite") and (url.endswith("://") or ":memory:" in url or "mode=memory" in url)
+
+
+def async_database_url(url):
+    """Async driver URL for url: aiosqlite for SQLite, asyncpg for Postgres."""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    for prefix in ("postgres://", "postgresql://", "postgresql+psycopg2://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+def engine_options(url):
+    # Echo off by default; enable if you want SQL logs
+    options = {"echo": False}
+    if url.startswith("sqlite"):
+        # Needed for SQLite with FastAPI in a single process
+        options["connect_args"] = {"check_same_thread": False}
+        if _is_memory_sqlite(url):
+            return options
+    options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                   pool_timeout=DB_POOL_TIMEOUT, pool_pre_ping=True)
+    if not url.startswith("sqlite"):
+        options["pool_recycle"] = DB_POOL_RECYCLE
+    return options
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the single writer; NORMAL is durable in WAL mode
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+def configure_sqlite(engine):
+    """Apply the SQLite pragmas on every new connection of a file-backed engine."""
+    if engine.dialect.name == "sqlite" and not _is_memory_sqlite(str(engine.url)):
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+    return engine
+
+
+engine = configure_sqlite(create_engine(DATABASE_URL, **engine_options(DATABASE_URL)))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+_async_engine = None
+_async_sessionmaker = None
+
+
+def get_async_engine():
+    """Async engine for DATABASE_URL, created on first use (needs aiosqlite / asyncpg)."""
+    global _async_engine, _async_sessionmaker
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        url = async_database_url(DATABASE_URL)
+        _async_engine = create_async_engine(url, **engine_options(url))
+        configure_sqlite(_async_engine.sync_engine)
+        _async_sessionmaker = async_sessionmaker(_async_engine, autoflush=False, expire_on_commit=False)
+    return _async_engine
+
+
+def AsyncSessionLocal():
+    get_async_engine()
+    return _async_sessionmaker()
+
 # ---- Models ----
 class Dataset(Base):
     __tablename__ = "datasets"
@@ -44,6 +113,9 @@ class Dataset(Base):
 
 class AnalysisRun(Base):
     __tablename__ = "analysis_runs"
+    __table_args__ = (
+        Index("ix_analysis_runs_dataset_created", "dataset_id", "created_at"),
+    )
 
     id = Column(String, primary_key=True)
     dataset_id = Column(String, nullable=False)
@@ -52,19 +124,65 @@ class AnalysisRun(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
     error_message = Column(Text, nullable=True)
-    headline_metrics = Column(JSON, nullable=True)
-    top_segments = Column(JSON, nullable=True)
-    map_points = Column(JSON, nullable=True)
-    confidence_info = Column(JSON, nullable=True)
+    # Small JSON blobs, only loaded when accessed
+    headline_metrics = deferred(Column(JSON, nullable=True))
+    confidence_info = deferred(Column(JSON, nullable=True))
     procedure = Column(String, nullable=True)
     patient_count = Column(Integer, nullable=True)
-    dominant_profile = Column(JSON, nullable=True)
-    strategic_insights = Column(JSON, nullable=True)
-    filtered_dataset_path = Column(String, nullable=True) 
+    filtered_dataset_path = Column(String, nullable=True)
+    # Set when the run's patients are persisted to run_patients (None until then)
+    run_patient_count = Column(Integer, nullable=True)
+    run_patient_columns = Column(JSON, nullable=True)  # export columns the upload had data for
+    # top_segments, map_points, dominant_profile and strategic_insights live in
+    # AnalysisRunArtifact (see services/run_artifacts.py)
+
+
+class AnalysisRunArtifact(Base):
+    """Large per-run results, stored as compressed JSON so run queries stay light."""
+    __tablename__ = "analysis_run_artifacts"
+
+    run_id = Column(String, primary_key=True)
+    name = Column(String, primary_key=True)  # top_segments, map_points, dominant_profile, strategic_insights
+    encoding = Column(String, nullable=False, default="json+zlib")
+    payload = Column(LargeBinary, nullable=False)
+    raw_bytes = Column(Integer, nullable=True)  # uncompressed JSON size
+    digest = Column(String, nullable=True)  # sha256 of the uncompressed JSON, feeds run ETags
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class RunPatient(Base):
+    """Labeled, scored patients of a completed run, served by the patient export."""
+    __tablename__ = "run_patients"
+    __table_args__ = (
+        Index("ix_run_patients_run_score", "run_id", "value_score"),
+        Index("ix_run_patients_run_segment", "run_id", "behavioral_segment", "value_score"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    run_id = Column(String, nullable=False)
+    patient_id = Column(String, nullable=True)
+    zip_code = Column(String, nullable=True)
+    behavioral_segment = Column(String, nullable=True)
+    value_score = Column(Float, nullable=True)
+    cohort = Column(String, nullable=True)  # run's cohort label for the top 20%, else General
+    revenue = Column(Float, nullable=True)
+    visits_per_year = Column(Float, nullable=True)
+    # Normalized, SHA-256 hashed PII for customer-match uploads (raw PII is never stored here)
+    email_sha256 = Column(String, nullable=True)
+    phone_sha256 = Column(String, nullable=True)  # digits with country code (Facebook)
+    phone_e164_sha256 = Column(String, nullable=True)  # +E.164 (Google)
 
 
 class PatientOutreach(Base):
     __tablename__ = "patient_outreach"
+    __table_args__ = (
+        Index("ix_patient_outreach_run_patient", "run_id", "patient_id"),
+        # Pending returns: contacted_at set, returned_at NULL (per run, and across runs)
+        Index("ix_patient_outreach_run_pending", "run_id", "returned_at", "contacted_at"),
+        Index("ix_patient_outreach_pending", "returned_at", "contacted_at"),
+        Index("ix_patient_outreach_patient", "patient_id"),
+        Index("ix_patient_outreach_segment_rollup", "segment", "contacted_at", "returned_at", "revenue_recovered"),
+    )
     id = Column(String, primary_key=True)
     run_id = Column(String, nullable=False)
     patient_id = Column(String, nullable=False)
@@ -79,8 +197,28 @@ class PatientOutreach(Base):
     commission = Column(Float, nullable=True)
 
 
+class OutreachRollup(Base):
+    """Outreach counters per (run, segment, contact day, staleness bucket), kept in step with patient_outreach."""
+    __tablename__ = "outreach_rollups"
+
+    run_id = Column(String, primary_key=True)
+    segment = Column(String, primary_key=True)  # '' when the outreach row has no segment
+    day = Column(String, primary_key=True)  # YYYY-MM-DD of contacted_at, '' when not contacted
+    stale_bucket = Column(String, primary_key=True)  # 0-7 days ... 60+ days, '' when unknown
+    contacted = Column(Integer, nullable=False, default=0)
+    returned = Column(Integer, nullable=False, default=0)  # of the contacted rows
+    revenue = Column(Float, nullable=False, default=0.0)  # recovered revenue of the contacted rows
+    with_outcome = Column(Integer, nullable=False, default=0)
+    closed = Column(Integer, nullable=False, default=0)
+    outcome_revenue = Column(Float, nullable=False, default=0.0)  # revenue of the rows with an outcome
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
 class WinbackTemplate(Base):
     __tablename__ = "winback_templates"
+    __table_args__ = (
+        Index("ix_winback_templates_treatment_type", "treatment", "template_type", "created_at"),
+    )
     
     id = Column(String, primary_key=True)
     treatment = Column(String, nullable=False)
@@ -93,6 +231,9 @@ class WinbackTemplate(Base):
 
 class SMSCampaign(Base):
     __tablename__ = "sms_campaigns"
+    __table_args__ = (
+        Index("ix_sms_campaigns_run_created", "run_id", "created_at"),
+    )
     
     id = Column(String, primary_key=True)
     run_id = Column(String, nullable=True)
@@ -110,12 +251,25 @@ class SMSCampaign(Base):
     responses = Column(Integer, default=0)
     conversions = Column(Integer, default=0)
     
+    # Outbox state: queued -> sending -> done
+    status = Column(String, default="done")
+    
     created_at = Column(DateTime, default=datetime.utcnow)
     sent_at = Column(DateTime, nullable=True)
 
 
 class SMSMessage(Base):
+    """
+    One message per (campaign, recipient). Rows double as the send outbox:
+    inserted as "queued", claimed by a dispatcher ("sending"), then "sent"/"failed".
+    """
     __tablename__ = "sms_messages"
+    __table_args__ = (
+        Index("uq_sms_messages_campaign_recipient", "campaign_id", "recipient_key", unique=True),
+        Index("ix_sms_messages_status", "status"),
+        Index("ix_sms_messages_twilio_sid", "twilio_sid"),
+        Index("ix_sms_messages_campaign_status", "campaign_id", "status"),
+    )
     
     id = Column(String, primary_key=True)
     campaign_id = Column(String, nullable=False)
@@ -125,6 +279,8 @@ class SMSMessage(Base):
     patient_id = Column(String, nullable=True)
     patient_name = Column(String, nullable=True)
     phone_number = Column(String, nullable=False)
+    # patient_id, or the normalized phone when there is none; unique within a campaign
+    recipient_key = Column(String, nullable=True)
     
     message_body = Column(Text, nullable=False)
     
@@ -132,10 +288,47 @@ class SMSMessage(Base):
     error_code = Column(String, nullable=True)
     error_message = Column(Text, nullable=True)
     
+    attempts = Column(Integer, default=0)
+    dispatch_token = Column(String, nullable=True)
+    claimed_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # refreshed by the claiming worker while it sends
+    
     created_at = Column(DateTime, default=datetime.utcnow)
     sent_at = Column(DateTime, nullable=True)
     delivered_at = Column(DateTime, nullable=True)
 
+class ChurnScoreRun(Base):
+    """One row per analysis run whose churn scores have been persisted."""
+    __tablename__ = "churn_score_runs"
+
+    run_id = Column(String, primary_key=True)
+    reference_date = Column(Date, nullable=False)  # date the stored scores are current as of
+    procedure_intervals = Column(JSON, nullable=True)
+    patient_count = Column(Integer, default=0)
+    scored_at = Column(DateTime, default=datetime.utcnow)
+    rescored_at = Column(DateTime, nullable=True)
+
+
+class PatientChurnScore(Base):
+    __tablename__ = "patient_churn_scores"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    run_id = Column(String, nullable=False, index=True)
+    patient_id = Column(String, nullable=True)
+    procedure = Column(String, nullable=True)
+    last_visit = Column(DateTime, nullable=True)
+    visit_number = Column(Integer, nullable=True)
+
+    # Fixed at scoring time; only changes when visits are reloaded
+    expected_interval = Column(Float, nullable=False)
+
+    # Advanced by the daily rescoring job
+    days_since_visit = Column(Integer, nullable=False)
+    days_overdue = Column(Float, nullable=False)
+    overdue_ratio = Column(Float, nullable=False)
+    risk_level = Column(String, nullable=False)
+    risk_score = Column(Integer, nullable=False)
+
 # ---- Session helper ----
 def get_db():
     db = SessionLocal()
@@ -144,42 +337,32 @@ def get_db():
     finally:
         db.close()
 
-# ---- Create tables ----
-def create_tables():
-    Base.metadata.create_all(bind=engine)
 
-    # Auto-add missing columns
-    from sqlalchemy import inspect, text
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
 
-    inspector = inspect(engine)
+# ---- Schema migrations ----
+ALEMBIC_INI = os.path.join(os.path.dirname(__file__), "alembic.ini")
 
-    # Check patient_outreach table
-    existing_columns = [col['name'] for col in inspector.get_columns('patient_outreach')]
 
-    with engine.connect() as conn:
-        if 'segment' not in existing_columns:
-            conn.execute(text('ALTER TABLE patient_outreach ADD COLUMN segment VARCHAR'))
-            conn.commit()
-            print("[DB] Added segment column to patient_outreach")
-        if 'campaign_name' not in existing_columns:
-            conn.execute(text('ALTER TABLE patient_outreach ADD COLUMN campaign_name VARCHAR'))
-            conn.commit()
-            print("[DB] Added campaign_name column to patient_outreach")
+def alembic_config(url=None):
+    """Alembic config for this database (or url); migrations live in migrations/."""
+    from alembic.config import Config
 
-    # Check analysis_runs table
-    try:
-        existing_run_columns = [col['name'] for col in inspector.get_columns('analysis_runs')]
-        print(f"[DB] Existing analysis_runs columns: {existing_run_columns}")
-
-        with engine.connect() as conn:
-            if 'filtered_dataset_path' not in existing_run_columns:
-                print("[DB] Adding filtered_dataset_path column to analysis_runs")
-                conn.execute(text('ALTER TABLE analysis_runs ADD COLUMN filtered_dataset_path VARCHAR'))
-                conn.commit()
-                print("[DB] Successfully added filtered_dataset_path column to analysis_runs")
-            else:
-                print("[DB] filtered_dataset_path column already exists")
-    except Exception as e:
-        print(f"[DB ERROR] Failed to migrate analysis_runs table: {e}")
-        import traceback
-        traceback.print_exc()
+    config = Config(ALEMBIC_INI)
+    config.set_main_option("script_location", os.path.join(os.path.dirname(__file__), "migrations"))
+    if url:
+        config.set_main_option("sqlalchemy.url", url.replace("%", "%%"))
+    return config
+
+
+def create_tables():
+    """Bring the schema up to date by running alembic migrations to head."""
+    from alembic import command
+
+    config = alembic_config()
+    config.attributes["configure_logger"] = False
+    with engine.begin() as connection:
+        config.attributes["connection"] = connection
+        command.upgrade(config, "head")
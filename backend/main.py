@@ -8,7 +8,8 @@ import requests
 import uuid
 import json
 import io
-from typing import Optional, Dict, Any, Union
+import asyncio
+from typing import Optional, Dict, Any, Set, Union
 import statistics
 
 import numpy as np
@@ -28,6 +29,8 @@ import hashlib
 from routers import procedures as procedures_router
 
 from services.llm_service import llm_service
+from services.llm_client import close_async_client, stream_complete
+from services.llm_prompts import PromptLibrary
 from schemas.llm_context import SegmentContext, CampaignContext
 
 from schemas import *
@@ -48,10 +51,23 @@ from services.churn_scoring import calculate_churn_risk, get_churn_summary, anal
 from services.verticals import detect_vertical, get_vertical, get_prompt_context
 from services.patient_segments import calculate_patient_segments
 from services.service_analysis import analyze_services
+from services.visit_index import build_visit_index
 from services.validate import validate_algorithm_accuracy
-from database import get_db, Dataset, AnalysisRun, PatientOutreach, create_tables
+from database import get_db, get_async_db, Dataset, AnalysisRun, PatientOutreach, OutreachRollup, SessionLocal, create_tables
+from services.churn_store import persist_churn_scores, get_stored_churn_summary, rescore_all_churn_runs
+from services.outreach import mark_contacted, mark_returned, reconcile_outreach, set_outreach_outcome
+from services.run_artifacts import load_run_artifact, load_run_artifacts, save_run_artifacts
+from services.run_cache import RUN_CACHE_MAX_AGE, daily_variant, not_modified, run_cache_headers, run_etag
+from services.run_patients import (
+    RUN_PATIENT_TYPES, iter_run_patient_chunks, label_patients, persist_run_patients, persisted_patient_columns
+)
+from services.customer_match import PLATFORM_COLUMNS, shutdown_hash_pool
+from services.json_response import ORJSONResponse
+from services.response_middleware import CompressionMiddleware, RESPONSE_METRICS
+from services.exports import EXPORT_FORMATS, export_filename, export_media_type, stream_csv, stream_parquet
 
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from routers import patient_intel as patient_intel_router
 
 
@@ -65,6 +81,23 @@ class CampaignRequest(BaseModel):
     match_score: float
     procedure: Optional[str] = None
 
+class CampaignBatchRequest(BaseModel):
+    segments: list[CampaignRequest]
+    procedure: Optional[str] = None
+    vertical: Optional[str] = None
+
+class OutreachPatient(BaseModel):
+    patient_id: str
+    days_stale: Optional[int] = None
+    loan_amount: Optional[float] = None
+
+class OutreachContactRequest(BaseModel):
+    segment: Optional[str] = None
+    campaign_name: Optional[str] = None
+    patients: list[OutreachPatient]
+
+MAX_OUTREACH_PATIENTS = 50000
+
 class DatasetCreateResponse(BaseModel):
     dataset_id: str
     message: str
@@ -563,7 +596,7 @@ def normalize_demographics_dataframe(df):
     return df
 
 # ⬇️ PASTE THIS directly under build_strategic_insights_for_row(...) and above the closing helpers marker
-def generate_campaign_card(segment_data, procedure=None, logo_url=None):
+async def generate_campaign_card(segment_data, procedure=None, logo_url=None):
     # Extract all variables from segment_data first
     zip_code = segment_data.get('zip')
     cohort = segment_data.get('cohort', 'Budget Conscious')
@@ -611,7 +644,7 @@ def generate_campaign_card(segment_data, procedure=None, logo_url=None):
             practice_city="Your Area"
         )
         
-        fb_ad = llm_service.generate_facebook_ad(campaign_context)
+        fb_ad = await llm_service.generate_facebook_ad(campaign_context)
         ad_copy = fb_ad.get('primary_text', 'Premium aesthetic treatments available.')
         print(f"[LLM] Generated Facebook ad copy for {cohort}")
     except Exception as e:
@@ -927,7 +960,8 @@ def calculate_dynamic_cpa_target(avg_ticket: float, match_score: float, competit
 app = fastapi.FastAPI(
     title="Audience Mirror API",
     description="Advanced patient clustering using geographic, demographic, and psychographic analysis",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Setup rate limiting
@@ -949,10 +983,44 @@ except Exception as e:
 app.include_router(procedures_router.router)
 app.include_router(patient_intel_router.router)
 
+# Background loops started at startup; held here so they aren't garbage-collected
+_background_tasks: Set[asyncio.Task] = set()
+
 # Add this after your app = fastapi.FastAPI(...) section
 @app.on_event("startup")
 async def startup_event():
     create_tables()
+    for loop in (churn_rescore_loop(), run_outbox_dispatcher(), run_status_flusher()):
+        _background_tasks.add(asyncio.create_task(loop))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+    await close_async_client()
+    await asyncio.to_thread(flush_status_buffer)
+    shutdown_hash_pool()
+
+# How often the background job checks for stored churn scores that are behind today's date
+CHURN_RESCORE_CHECK_SECONDS = int(os.getenv("CHURN_RESCORE_CHECK_SECONDS", "3600"))
+
+def _rescore_stored_churn():
+    db = SessionLocal()
+    try:
+        return rescore_all_churn_runs(db)
+    finally:
+        db.close()
+
+async def churn_rescore_loop():
+    """Advance persisted churn scores as the date rolls over (no visit reload)."""
+    while True:
+        try:
+            await asyncio.to_thread(_rescore_stored_churn)
+        except Exception as e:
+            print(f"[CHURN STORE] Scheduled rescoring failed: {e}")
+        await asyncio.sleep(CHURN_RESCORE_CHECK_SECONDS)
 
 # CORS middleware - allow production domains and localhost
 app.add_middleware(
@@ -968,6 +1036,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# brotli/gzip for large payloads, with per-endpoint size and serialization metrics
+app.add_middleware(CompressionMiddleware)
+
 # Configuration
 BASE_DIR = os.path.dirname(__file__)
 DATA_DIR = os.path.join(BASE_DIR, "data")
@@ -1207,6 +1278,7 @@ async def create_run(
 
         # Now call the analysis
         result = execute_advanced_analysis(dataset_dict, request, df_grouped=df_grouped)
+        scored_patients = result.pop("scored_patients", None)
         
         # Clean NaN values for database
         def _clean_num(x, default=0.0):
@@ -1239,12 +1311,15 @@ async def create_run(
         analysis_run.status = "done"
         analysis_run.completed_at = datetime.utcnow()
         analysis_run.headline_metrics = result["headline_metrics"]
-        analysis_run.top_segments = result["top_segments"]
-        analysis_run.map_points = result["map_points"]
         analysis_run.confidence_info = result["confidence_info"]
         analysis_run.patient_count = result.get("patient_count", 0)
-        analysis_run.dominant_profile = result.get("dominant_profile", {})
-        analysis_run.strategic_insights = result.get("strategic_insights", [])
+        save_run_artifacts(db, run_id, {
+            "top_segments": result["top_segments"],
+            "map_points": result["map_points"],
+            "dominant_profile": result.get("dominant_profile", {}),
+            "strategic_insights": result.get("strategic_insights", []),
+            "dataset_summary": await asyncio.to_thread(summarize_run_dataset, filtered_dataset_path),
+        })
 
         # Store filtered dataset path if different from original
         if filtered_dataset_path != dataset.patients_path:
@@ -1259,6 +1334,16 @@ async def create_run(
         db.commit()
         print(f"[DB] Committed run {run_id} with status done")
         
+        # Persist the run's scored patients as the labeled table the exports stream from
+        try:
+            if scored_patients is not None:
+                await asyncio.to_thread(persist_scored_patients, run_id, scored_patients,
+                                        _cohort_label(result.get("dominant_profile")))
+            else:
+                await asyncio.to_thread(materialize_run_patients, run_id)
+        except Exception as e:
+            print(f"[EXPORT] Could not persist labeled patients for run {run_id}: {e}")
+        
         # Auto-reconcile any contacted patients who returned
         print(f"[DEBUG] About to reconcile for run_id: {run_id}")
         reconcile_outreach_returns(db, run_id, df_grouped)
@@ -1275,8 +1360,8 @@ async def create_run(
 @app.post("/api/v1/exports")
 async def create_export_urls(request: ExportCreateRequest, db: Session = Depends(get_db)):
     """Generate export URLs for different platforms"""
-    analysis_run = db.query(AnalysisRun).filter(AnalysisRun.id == request.run_id).first()
-    if not analysis_run or analysis_run.status != "done":
+    status = db.query(AnalysisRun.status).filter(AnalysisRun.id == request.run_id).scalar()
+    if status != "done":
         raise HTTPException(status_code=404, detail="Run not found or not completed")
 
     base_url = f"/api/v1/exports/{request.run_id}"
@@ -1284,7 +1369,9 @@ async def create_export_urls(request: ExportCreateRequest, db: Session = Depends
     return {
         "facebook_url": f"{base_url}?format=facebook&top_n={request.top_n}",
         "google_url": f"{base_url}?format=google&top_n={request.top_n}",
-        "full_report_url": f"{base_url}?format=full&top_n={request.top_n}"
+        "full_report_url": f"{base_url}?format=full&top_n={request.top_n}",
+        "facebook_customer_match_url": f"/api/v1/runs/{request.run_id}/export-customer-match?platform=facebook",
+        "google_customer_match_url": f"/api/v1/runs/{request.run_id}/export-customer-match?platform=google"
     }
 
 def g(obj, path, default=None):
@@ -1296,16 +1383,20 @@ def g(obj, path, default=None):
     return cur
 
 @app.get("/api/v1/exports/{run_id}")
-async def download_export(run_id: str, format: str = "full", top_n: int = 10, db: Session = Depends(get_db)):
+async def download_export(request: fastapi.Request, run_id: str, format: str = "full", top_n: int = 10,
+                          gzip: bool = False, db: Session = Depends(get_db)):
     """Stream CSV exports for different advertising platforms"""
     
-    # Get from database instead of memory
-    analysis_run = db.query(AnalysisRun).filter(AnalysisRun.id == run_id).first()
-    if not analysis_run or analysis_run.status != "done":
+    # Completed runs only; run_etag is None for anything else
+    etag = run_etag(db, run_id, ["top_segments"], "export", format, top_n, gzip)
+    if etag is None:
         raise HTTPException(status_code=404, detail="Run results not found")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
     
     # Get top segments for export
-    top_segments = analysis_run.top_segments[:top_n]
+    top_segments = load_run_artifact(db, run_id, "top_segments", [])[:top_n]
 
     # Generate appropriate CSV format
     if format == "facebook":
@@ -1336,28 +1427,106 @@ async def download_export(run_id: str, format: str = "full", top_n: int = 10, db
         } for segment in top_segments]
         filename = f"audience_analysis_{run_id}.csv"
 
-    # Convert to CSV
-    df = pd.DataFrame(data)
-    csv_buffer = io.StringIO()
-    df.to_csv(csv_buffer, index=False)
-    csv_buffer.seek(0)
+    # Stream as CSV straight from the rows
+    columns = list(data[0]) if data else []
+    rows = [tuple(row.values()) for row in data]
+    if gzip:
+        filename += ".gz"
 
     return StreamingResponse(
-        io.BytesIO(csv_buffer.getvalue().encode()),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+        stream_csv([rows], columns, gzip=gzip),
+        media_type=export_media_type("csv", gzip),
+        headers={"Content-Disposition": f"attachment; filename={filename}", **run_cache_headers(etag)}
     )
     
+RESULTS_ARTIFACTS = ["top_segments", "dominant_profile", "strategic_insights", "dataset_summary"]
+
+
+def summarize_run_dataset(patients_path: str) -> Dict[str, Any]:
+    """
+    Procedures offered, patient count and total revenue of a run's dataset.
+    Computed once when the run completes and stored as its dataset_summary
+    artifact, so the results endpoint doesn't re-read the CSV.
+    patient_count is None when the upload has no revenue; total_revenue is
+    None when it couldn't be computed at all.
+    """
+    summary = {"available_procedures": [], "patient_count": None, "total_revenue": None}
+    try:
+        df = pd.read_csv(patients_path)
+    except Exception as e:
+        print(f"[DEBUG] Could not read run dataset {patients_path}: {e}")
+        return summary
+
+    # Get available procedures from the dataset
+    try:
+        # Check multiple possible column names for procedures
+        possible_columns = ['procedure_norm', 'procedure', 'treatment', 'service', 'treatments_received']
+        procedure_column = None
+        
+        for col in possible_columns:
+            if col in df.columns:
+                procedure_column = col
+                print(f"[DEBUG] Found procedure column: {col}")
+                break
+        
+        if procedure_column:
+            # If it's a comma-separated list (like "Botox, Fillers"), split it
+            if procedure_column == 'treatments_received':
+                all_procedures = []
+                for treatments in df[procedure_column].dropna():
+                    procs = [p.strip() for p in str(treatments).split(',')]
+                    all_procedures.extend(procs)
+                summary["available_procedures"] = sorted(list(set(all_procedures)))
+            else:
+                summary["available_procedures"] = sorted(df[procedure_column].dropna().unique().tolist())
+            
+            print(f"[DEBUG] Found {len(summary['available_procedures'])} procedures: {summary['available_procedures']}")
+        else:
+            print(f"[DEBUG] No procedure column found. Available columns: {df.columns.tolist()}")
+            
+    except Exception as e:
+        print(f"[DEBUG] Could not extract procedures: {e}")
+        import traceback
+        print(traceback.format_exc())
+        summary["available_procedures"] = []
+
+    # Aggregate visits to patient level (this sums revenue per patient)
+    try:
+        df_patients = aggregate_visits_to_patients(df)
+        if 'revenue' in df_patients.columns:
+            summary["total_revenue"] = float(df_patients['revenue'].sum())
+            summary["patient_count"] = len(df_patients)
+            print(f"[REVENUE CALC] Calculated from {len(df)} visits → {len(df_patients)} patients")
+            print(f"[REVENUE CALC] Total revenue: ${summary['total_revenue']:,.0f}")
+        else:
+            summary["total_revenue"] = 0.0
+            print(f"[REVENUE CALC] No revenue column found after aggregation")
+    except Exception as e:
+        print(f"[REVENUE CALC] Failed to calculate revenue: {e}")
+        import traceback
+        traceback.print_exc()
+    return summary
+
+
+def _analyze_mortgage_dataset(patients_path: str) -> Dict[str, Any]:
+    from services.mortgage_metrics import get_mortgage_analysis
+    return get_mortgage_analysis(pd.read_csv(patients_path))
+
+
 @app.get("/api/v1/runs/{run_id}/results")
-async def get_run_results(run_id: str, db: Session = Depends(get_db)):
+async def get_run_results(run_id: str, request: fastapi.Request, response: fastapi.Response,
+                          db: AsyncSession = Depends(get_async_db)):
     """Get full analysis results including dominant profile for frontend"""
-    analysis_run = db.query(AnalysisRun).filter(AnalysisRun.id == run_id).first()
+    analysis_run = await db.get(AnalysisRun, run_id)
     # df_grouped may be created during run-time analysis flow; define locally to avoid
     # compile-time undefined-name errors when this endpoint is imported/run.
     df_grouped = None
     if not analysis_run:
         raise HTTPException(status_code=404, detail="Run not found")
     
+    # Status answers must not be cached; the done payload below carries its own headers
+    response.headers.update(run_cache_headers(None))
+    
     # Return status if not done
     if analysis_run.status == "processing":
         return {"status": "processing"}
@@ -1371,21 +1540,22 @@ async def get_run_results(run_id: str, db: Session = Depends(get_db)):
     if analysis_run.status != "done":
         return {"status": analysis_run.status}
     
-    # Parse stored results
-    top_segments = analysis_run.top_segments
-    if isinstance(top_segments, str):
-        try:
-            top_segments = json.loads(top_segments)
-        except Exception:
-            top_segments = []
-    
-    # Get dominant_profile if stored (you'll need to add this field to database)
-    dominant_profile_data = getattr(analysis_run, 'dominant_profile', None)
-    if isinstance(dominant_profile_data, str):
-        try:
-            dominant_profile_data = json.loads(dominant_profile_data)
-        except Exception:
-            dominant_profile_data = None
+    # A done run never changes: answer revalidations before reading artifacts or the CSV.
+    # Mortgage results also count stale preapprovals against today, so they turn over daily.
+    dataset = await db.get(Dataset, analysis_run.dataset_id)
+    variant, max_age = ("results",), RUN_CACHE_MAX_AGE
+    if dataset and dataset.detected_vertical == 'real_estate_mortgage':
+        today, max_age = daily_variant()
+        variant += (today,)
+    etag = await db.run_sync(run_etag, run_id, RESULTS_ARTIFACTS, *variant)
+    cached = not_modified(request, etag, max_age)
+    if cached:
+        return cached
+    
+    # Load stored results (only once the run is done)
+    artifacts = await db.run_sync(load_run_artifacts, run_id, RESULTS_ARTIFACTS)
+    top_segments = artifacts["top_segments"] or []
+    dominant_profile_data = artifacts["dominant_profile"]
 
     # Calculate campaign metrics - handle missing data gracefully
     if dominant_profile_data and isinstance(dominant_profile_data, dict):
@@ -1406,87 +1576,38 @@ async def get_run_results(run_id: str, db: Session = Depends(get_db)):
     )
     mortgage_data = {}
 
-    # Get the dataset for this run and determine which path to use (filtered or original)
-    dataset = db.query(Dataset).filter(Dataset.id == analysis_run.dataset_id).first()
+    # Determine which path to use for this run's dataset (filtered or original)
     patients_path_to_use = getattr(analysis_run, 'filtered_dataset_path', None) or (dataset.patients_path if dataset else None)
     print(f"[DATA PATH] Using: {patients_path_to_use} (filtered={bool(getattr(analysis_run, 'filtered_dataset_path', None))})")
 
-   # Get available procedures from the dataset
-    available_procedures = []
-    try:
-        if dataset and patients_path_to_use:
-            import pandas as pd
-            df = pd.read_csv(patients_path_to_use)
-            
-            # Check multiple possible column names for procedures
-            possible_columns = ['procedure_norm', 'procedure', 'treatment', 'service', 'treatments_received']
-            procedure_column = None
-            
-            for col in possible_columns:
-                if col in df.columns:
-                    procedure_column = col
-                    print(f"[DEBUG] Found procedure column: {col}")
-                    break
-            
-            if procedure_column:
-                # If it's a comma-separated list (like "Botox, Fillers"), split it
-                if procedure_column == 'treatments_received':
-                    all_procedures = []
-                    for treatments in df[procedure_column].dropna():
-                        procs = [p.strip() for p in str(treatments).split(',')]
-                        all_procedures.extend(procs)
-                    available_procedures = sorted(list(set(all_procedures)))
-                else:
-                    available_procedures = sorted(df[procedure_column].dropna().unique().tolist())
-                
-                print(f"[DEBUG] Found {len(available_procedures)} procedures: {available_procedures}")
-            else:
-                print(f"[DEBUG] No procedure column found. Available columns: {df.columns.tolist()}")
-                
-    except Exception as e:
-        print(f"[DEBUG] Could not extract procedures: {e}")
-        import traceback
-        print(traceback.format_exc())
-        available_procedures = []
+    # Procedures and revenue totals were summarized when the run completed; runs
+    # from before that are summarized here, in a worker thread
+    dataset_summary = artifacts["dataset_summary"]
+    if dataset_summary is None and dataset and patients_path_to_use:
+        dataset_summary = await asyncio.to_thread(summarize_run_dataset, patients_path_to_use)
+    dataset_summary = dataset_summary or {}
+    available_procedures = dataset_summary.get("available_procedures") or []
 
-    # Add mortgage-specific analysis if applicable
+    # Add mortgage-specific analysis if applicable (dated, so computed per request)
     if dataset and dataset.detected_vertical == 'real_estate_mortgage':
         try:
-            from services.mortgage_metrics import get_mortgage_analysis
-            mortgage_df = pd.read_csv(patients_path_to_use)
-            mortgage_data = get_mortgage_analysis(mortgage_df)
+            mortgage_data = await asyncio.to_thread(_analyze_mortgage_dataset, patients_path_to_use)
             print(f"[DEBUG] Mortgage analysis complete: {mortgage_data.get('preapproval_metrics', {}).get('stale_count', 0)} stale preapprovals")
         except Exception as e:
             print(f"[DEBUG] Mortgage analysis failed: {e}")
 
     # Return full structure for frontend
-    # CORRECTLY calculate total revenue by reloading and aggregating patient data
     filtered_patient_count = getattr(analysis_run, 'patient_count', 0)
     filtered_revenue = 0
     actual_total_revenue = 0
 
-    # Reload patient data to calculate actual revenue
     if dataset and patients_path_to_use:
-        try:
-            # Read the visit-level data (filtered or original)
-            df_visits = pd.read_csv(patients_path_to_use)
-
-            # Aggregate visits to patient level (this sums revenue per patient)
-            df_patients = aggregate_visits_to_patients(df_visits)
-
-            # Calculate totals from aggregated patient data
-            if 'revenue' in df_patients.columns:
-                actual_total_revenue = float(df_patients['revenue'].sum())
-                filtered_revenue = actual_total_revenue
-                filtered_patient_count = len(df_patients)
-                print(f"[REVENUE CALC] Calculated from {len(df_visits)} visits → {filtered_patient_count} patients")
-                print(f"[REVENUE CALC] Total revenue: ${actual_total_revenue:,.0f}")
-            else:
-                print(f"[REVENUE CALC] No revenue column found after aggregation")
-        except Exception as e:
-            print(f"[REVENUE CALC] Failed to calculate revenue: {e}")
-            import traceback
-            traceback.print_exc()
+        if dataset_summary.get("total_revenue") is not None:
+            actual_total_revenue = dataset_summary["total_revenue"]
+            filtered_revenue = actual_total_revenue
+            if dataset_summary.get("patient_count") is not None:
+                filtered_patient_count = dataset_summary["patient_count"]
+        else:
             # Fallback to stored segment data
             actual_total_revenue = sum(
                 seg.get('expected_monthly_revenue', 0)
@@ -1501,7 +1622,8 @@ async def get_run_results(run_id: str, db: Session = Depends(get_db)):
     print(f"[REVENUE DEBUG] actual_total_revenue: ${actual_total_revenue:,.0f}")
     print(f"{'='*80}\n")
 
-    return {
+    # Returned as a response so the payload skips jsonable_encoder and goes straight to orjson
+    return ORJSONResponse({
         "status": "done",
         "procedure": analysis_run.procedure,
         "patient_count": dominant_profile_data.get("segment_patient_count", getattr(analysis_run, 'patient_count', 79)) if dominant_profile_data else getattr(analysis_run, 'patient_count', 79),
@@ -1520,7 +1642,7 @@ async def get_run_results(run_id: str, db: Session = Depends(get_db)):
         "journeyComparison": dominant_profile_data.get("journey_comparison") if dominant_profile_data else None,
         "geographic_summary": dominant_profile_data.get("geographic_summary", {}) if dominant_profile_data else {},
         "profile_summary": dominant_profile_data.get("profile_summary", "") if dominant_profile_data else "",
-        "strategic_insights": analysis_run.strategic_insights if analysis_run.strategic_insights else [],
+        "strategic_insights": artifacts["strategic_insights"] or [],
         "top_segments": top_segments[:10],
         "campaign_metrics": campaign_metrics,
         "available_procedures": available_procedures,
@@ -1530,7 +1652,7 @@ async def get_run_results(run_id: str, db: Session = Depends(get_db)):
         "preapproval_metrics": mortgage_data.get('preapproval_metrics') if mortgage_data else None,
         "channel_roi": mortgage_data.get('channel_roi') if mortgage_data else None,
         "detected_vertical": dataset.detected_vertical if dataset else "medspa"
-    }
+    }, headers=run_cache_headers(etag, max_age))
 
 
 @app.post("/api/generate-campaign")
@@ -1541,7 +1663,7 @@ async def generate_campaign_endpoint(request: CampaignRequest):
         from services.campaign_generator import generate_campaign_content
         print(f"[DEBUG] Import successful, calling generate_campaign_content...")
         
-        return generate_campaign_content(
+        return await generate_campaign_content(
             request.cohort,
             request.zip_code,
             request.competitors,
@@ -1556,6 +1678,23 @@ async def generate_campaign_endpoint(request: CampaignRequest):
         print(f"[ERROR] Exception: {e}")
         raise HTTPException(status_code=500, detail=f"Campaign generation failed: {str(e)}")
 
+
+@app.post("/api/generate-campaign/batch")
+async def generate_campaign_batch_endpoint(request: CampaignBatchRequest):
+    """Generate campaign content for many top segments, several ZIPs per LLM call"""
+    if not request.segments:
+        raise HTTPException(status_code=400, detail="No segments provided")
+    if len(request.segments) > 50:
+        raise HTTPException(status_code=400, detail="At most 50 segments per batch")
+    
+    from services.campaign_generator import generate_campaign_content_batch
+    campaigns = await generate_campaign_content_batch(
+        [segment.model_dump() for segment in request.segments],
+        procedure=request.procedure,
+        vertical=request.vertical
+    )
+    return {"campaigns": campaigns}
+
 @app.post("/api/v1/integrations/facebook")
 async def connect_facebook(access_token: str = Form(...), ad_account_id: str = Form(...)):
     """Connect Facebook Ads account"""
@@ -2246,6 +2385,7 @@ def execute_advanced_analysis(dataset: Dict[str, Any], request: RunCreateRequest
                     "map_points": [],
                     "confidence_info": {"level": "low", "score": 0},
                     "patient_count": 0,
+                    "scored_patients": patients_df,
                     "dominant_profile": {},
                     "strategic_insights": []
                 }
@@ -2257,14 +2397,17 @@ def execute_advanced_analysis(dataset: Dict[str, Any], request: RunCreateRequest
         # Ensure unique index
         patients_df = patients_df.reset_index(drop=True)
 
+        # Sort visits once; rebooking, gateway and journey analyses all reduce over this index
+        visit_index = build_visit_index(patients_df)
+
         # Analyze service rebooking BEFORE aggregation (needs visit-level data)
         from services.service_analysis import analyze_service_rebooking, analyze_gateway_services
-        service_rebooking = analyze_service_rebooking(patients_df)
+        service_rebooking = analyze_service_rebooking(patients_df, visit_index=visit_index)
         print(f"[ANALYSIS] Service rebooking analysis: {service_rebooking['service'] if service_rebooking else 'No issues found'}")
         print(f"[DEBUG] Full service_rebooking data: {service_rebooking}")
 
         # Analyze gateway services (first services that lead to high LTV)
-        gateway_services = analyze_gateway_services(patients_df)
+        gateway_services = analyze_gateway_services(patients_df, visit_index=visit_index)
         print(f"[ANALYSIS] Gateway service analysis: {gateway_services['service'] if gateway_services else 'No gateway services found'}")
         print(f"[DEBUG] Full gateway_services data: {gateway_services}")
 
@@ -2277,7 +2420,7 @@ def execute_advanced_analysis(dataset: Dict[str, Any], request: RunCreateRequest
         revenue_col = 'revenue' if 'revenue' in patients_df_aggregated.columns else 'total_spent'
         top_20pct_count = max(1, int(len(patients_df_aggregated) * 0.2))
         vip_patient_ids = set(patients_df_aggregated.nlargest(top_20pct_count, revenue_col).get('patient_id', pd.Series()).dropna())
-        provider_risk = analyze_provider_concentration(patients_df, vip_patients=vip_patient_ids, min_risk_threshold=50)
+        provider_risk = analyze_provider_concentration(patients_df, vip_patients=vip_patient_ids, min_risk_threshold=50, trend='monthly')
         print(f"[ANALYSIS] Provider risk analysis: {'Risk detected' if provider_risk and provider_risk.get('has_concentration_risk') else 'No concentration risk'}")
         print(f"[DEBUG] Full provider_risk data: {provider_risk}")
 
@@ -2290,7 +2433,7 @@ def execute_advanced_analysis(dataset: Dict[str, Any], request: RunCreateRequest
         print(f"[JOURNEY] Sample VIP IDs: {list(vip_patient_ids)[:5] if vip_patient_ids else 'EMPTY SET'}")
 
         try:
-            journey_comparison = analyze_patient_journey(patients_df, vip_patient_ids=vip_patient_ids, min_patients=10, min_vips=2)
+            journey_comparison = analyze_patient_journey(patients_df, vip_patient_ids=vip_patient_ids, min_patients=10, min_vips=2, visit_index=visit_index)
             print(f"[JOURNEY] ========== JOURNEY ANALYSIS COMPLETE ==========")
             print(f"[JOURNEY] Result: {'Calculated' if journey_comparison else 'Insufficient data'}")
             if journey_comparison:
@@ -2977,6 +3120,7 @@ def execute_advanced_analysis(dataset: Dict[str, Any], request: RunCreateRequest
             "map_points": [],
             "confidence_info": {"level": "early", "message": "Limited data confidence"},
             "patient_count": len(patients_df),
+            "scored_patients": patients_df,
             "actual_total_revenue": total_revenue,
             "demographics": demographics,
             "actual_treatments": actual_treatments,
@@ -3032,22 +3176,13 @@ async def generate_instagram_campaign(
     # Generate with LLM
     try:
         # Create context for LLM
-        context = CampaignContext(
-            segment_name=segment_name,
-            patient_count=patient_count,
-            avg_ltv=avg_ltv,
-            avg_ticket=avg_ticket,
-            top_procedures=top_procedures.split(','),
-            target_zips=[],  # ADD THIS LINE
-            target_demographics=target_demographics,
-            practice_name=practice_name,
-            practice_city=practice_city,
-            recommended_budget=avg_ltv * 0.1,
-            competition_level="moderate"
+        context = _segment_campaign_context(
+            segment_name, patient_count, avg_ltv, avg_ticket, top_procedures,
+            target_demographics, practice_name, practice_city
         )
         
         print(f"[LLM] Generating Instagram ad for {segment_name}...")
-        result = llm_service.generate_instagram_ad(context)
+        result = await llm_service.generate_instagram_ad(context)
         
         # Cache for 24 hours
         if CACHE_ENABLED and redis_client:
@@ -3067,13 +3202,46 @@ async def generate_instagram_campaign(
     except Exception as e:
         print(f"[LLM ERROR] Instagram generation failed: {e}")
         # Return fallback content if LLM fails
-        procedures_list = top_procedures.split(',')
-        return {
-            "caption": f"✨ Transform your look with {procedures_list[0] if procedures_list else 'expert treatments'}",
-            "first_comment": f"Book your free consultation today at {practice_name}. {target_demographics} love our results! 💕",
-            "hashtags": ["aesthetics", "beauty", "transformation", practice_city.lower().replace(' ', '')],
-            "story_cta": "Swipe up to book your consultation"
-        }  
+        return _instagram_fallback(top_procedures, practice_name, practice_city, target_demographics)
+
+
+def _segment_campaign_context(segment_name, patient_count, avg_ltv, avg_ticket, top_procedures,
+                              target_demographics, practice_name, practice_city):
+    """CampaignContext for the per-segment Instagram/Google ad endpoints"""
+    return CampaignContext(
+        segment_name=segment_name,
+        patient_count=patient_count,
+        avg_ltv=avg_ltv,
+        avg_ticket=avg_ticket,
+        top_procedures=top_procedures.split(','),
+        target_zips=[],
+        target_demographics=target_demographics,
+        practice_name=practice_name,
+        practice_city=practice_city,
+        recommended_budget=avg_ltv * 0.1,
+        competition_level="moderate"
+    )
+
+
+def _instagram_fallback(top_procedures, practice_name, practice_city, target_demographics):
+    procedures_list = top_procedures.split(',')
+    return {
+        "caption": f"✨ Transform your look with {procedures_list[0] if procedures_list else 'expert treatments'}",
+        "first_comment": f"Book your free consultation today at {practice_name}. {target_demographics} love our results! 💕",
+        "hashtags": ["aesthetics", "beauty", "transformation", practice_city.lower().replace(' ', '')],
+        "story_cta": "Swipe up to book your consultation"
+    }
+
+
+def _google_fallback(top_procedures, practice_city, patient_count):
+    procedures_list = top_procedures.split(',')
+    return {
+        "headlines": [f"Best {procedures_list[0]} in {practice_city}", f"Top-Rated {procedures_list[0]}", "Book Your Free Consult"],
+        "descriptions": [f"Expert {procedures_list[0]} treatments. Trusted by {patient_count}+ patients. Book today!"],
+        "keywords": [procedures_list[0].lower(), f"{procedures_list[0].lower()} near me", f"{procedures_list[0].lower()} {practice_city.lower()}"]
+    }
+
+
 @app.post("/api/v1/campaigns/google")
 @limiter.limit("100/hour")
 async def generate_google_campaign(
@@ -3101,21 +3269,12 @@ async def generate_google_campaign(
             print(f"[CACHE ERROR] {e}")
     
     try:
-        context = CampaignContext(
-            segment_name=segment_name,
-            patient_count=patient_count,
-            avg_ltv=avg_ltv,
-            avg_ticket=avg_ticket,
-            top_procedures=top_procedures.split(','),
-            target_zips=[],
-            target_demographics=target_demographics,
-            practice_name=practice_name,
-            practice_city=practice_city,
-            recommended_budget=avg_ltv * 0.1,
-            competition_level="moderate"
+        context = _segment_campaign_context(
+            segment_name, patient_count, avg_ltv, avg_ticket, top_procedures,
+            target_demographics, practice_name, practice_city
         )
         
-        result = llm_service.generate_google_ad(context)
+        result = await llm_service.generate_google_ad(context)
         
         if CACHE_ENABLED and redis_client:
             redis_client.setex(f"google:{cache_key}", 86400, json.dumps(result))
@@ -3123,12 +3282,7 @@ async def generate_google_campaign(
         return result
         
     except Exception as e:
-        procedures_list = top_procedures.split(',')
-        return {
-            "headlines": [f"Best {procedures_list[0]} in {practice_city}", f"Top-Rated {procedures_list[0]}", "Book Your Free Consult"],
-            "descriptions": [f"Expert {procedures_list[0]} treatments. Trusted by {patient_count}+ patients. Book today!"],
-            "keywords": [procedures_list[0].lower(), f"{procedures_list[0].lower()} near me", f"{procedures_list[0].lower()} {practice_city.lower()}"]
-        }       
+        return _google_fallback(top_procedures, practice_city, patient_count)
 
 @app.post("/api/v1/campaigns/generate-copy")
 async def generate_campaign_copy(
@@ -3141,6 +3295,18 @@ async def generate_campaign_copy(
     top_services: str = Form(""),
 ):
     """Generate all ad copy based on vertical and data."""
+    prompt = _campaign_copy_prompt(vertical, profile_type, city, avg_ltv, total_clients, top_services)
+    
+    try:
+        response = await llm_service.generate(prompt, max_tokens=600, validate=json.loads)
+        return json.loads(response)
+    except Exception as e:
+        print(f"[LLM ERROR] Campaign copy generation failed: {e}")
+        return _campaign_copy_fallback(vertical, city, total_clients)
+
+
+def _campaign_copy_prompt(vertical, profile_type, city, avg_ltv, total_clients, top_services):
+    """Prompt for Facebook/Instagram/Google copy in one completion"""
     from services.verticals import get_prompt_context
     
     vertical_context = get_prompt_context(vertical)
@@ -3173,43 +3339,42 @@ Return ONLY valid JSON:
   }}
 }}
 """
-    
-    try:
-        response = await llm_service.generate(prompt, max_tokens=600)
-        return json.loads(response)
-    except Exception as e:
-        print(f"[LLM ERROR] Campaign copy generation failed: {e}")
-        if vertical == "real_estate_mortgage":
-            return {
-                "facebook": {
-                    "headline": f"Your Trusted Real Estate Partner in {city}",
-                    "body": f"Thinking of buying or selling? Our team has helped {total_clients}+ clients find their perfect home. Get a free consultation today."
-                },
-                "instagram": {
-                    "headline": f"🏡 Real Results in {city}",
-                    "body": f"See why {total_clients}+ clients trust us with their biggest investment. Your dream home is closer than you think."
-                },
-                "google": {
-                    "headlines": [f"Top Real Estate Agent {city}", "Buy or Sell With Confidence", "Free Home Valuation"],
-                    "descriptions": [f"Trusted by {total_clients}+ clients. Expert guidance for buyers and sellers.", "Get your free consultation today. No obligation."]
-                }
+    return prompt
+
+
+def _campaign_copy_fallback(vertical, city, total_clients):
+    if vertical == "real_estate_mortgage":
+        return {
+            "facebook": {
+                "headline": f"Your Trusted Real Estate Partner in {city}",
+                "body": f"Thinking of buying or selling? Our team has helped {total_clients}+ clients find their perfect home. Get a free consultation today."
+            },
+            "instagram": {
+                "headline": f"🏡 Real Results in {city}",
+                "body": f"See why {total_clients}+ clients trust us with their biggest investment. Your dream home is closer than you think."
+            },
+            "google": {
+                "headlines": [f"Top Real Estate Agent {city}", "Buy or Sell With Confidence", "Free Home Valuation"],
+                "descriptions": [f"Trusted by {total_clients}+ clients. Expert guidance for buyers and sellers.", "Get your free consultation today. No obligation."]
             }
-        else:
-            return {
-                "facebook": {
-                    "headline": f"Expert Aesthetic Care in {city}",
-                    "body": f"Join {total_clients}+ satisfied patients who trust us for natural-looking results. Book your complimentary consultation."
-                },
-                "instagram": {
-                    "headline": f"✨ Real Results in {city}",
-                    "body": f"See the transformations our patients love. Natural beauty, expert care."
-                },
-                "google": {
-                    "headlines": [f"Top Med Spa {city}", "Natural-Looking Results", "Free Consultation"],
-                    "descriptions": [f"Trusted by {total_clients}+ patients. Expert aesthetic treatments.", "Book your free consultation today."]
-                }
+        }
+    else:
+        return {
+            "facebook": {
+                "headline": f"Expert Aesthetic Care in {city}",
+                "body": f"Join {total_clients}+ satisfied patients who trust us for natural-looking results. Book your complimentary consultation."
+            },
+            "instagram": {
+                "headline": f"✨ Real Results in {city}",
+                "body": f"See the transformations our patients love. Natural beauty, expert care."
+            },
+            "google": {
+                "headlines": [f"Top Med Spa {city}", "Natural-Looking Results", "Free Consultation"],
+                "descriptions": [f"Trusted by {total_clients}+ patients. Expert aesthetic treatments.", "Book your free consultation today."]
             }
-        
+        }
+
+
 @app.post("/api/v1/campaigns/email")
 @limiter.limit("100/hour")
 async def generate_email_campaign(
@@ -3243,7 +3408,7 @@ async def generate_email_campaign(
     
     try:
         print(f"[LLM] Generating {sequence_type} email sequence for {segment_name}...")
-        result = generate_email_sequence(
+        result = await generate_email_sequence(
             cohort=segment_name,
             procedure=procedure,
             sequence_type=sequence_type,
@@ -3315,7 +3480,7 @@ async def generate_sms_campaign(
     
     try:
         print(f"[LLM] Generating {campaign_type} SMS campaign for {segment_name}...")
-        result = gen_sms(
+        result = await gen_sms(
             cohort=segment_name,
             procedure=procedure,
             campaign_type=campaign_type,
@@ -3323,10 +3488,7 @@ async def generate_sms_campaign(
         )
         
         # Replace placeholders with practice info
-        for msg in result.get("messages", []):
-            msg["text"] = msg["text"].replace("[Business Name]", practice_name)
-            msg["text"] = msg["text"].replace("[Phone]", practice_phone)
-            msg["character_count"] = len(msg["text"])
+        _apply_sms_practice_info(result, practice_name, practice_phone)
         
         # Cache for 24 hours
         if CACHE_ENABLED and redis_client:
@@ -3352,65 +3514,197 @@ async def generate_sms_campaign(
             "compliance_note": "Ensure patient has opted in to SMS marketing."
         }
         
+def _apply_sms_practice_info(result: dict, practice_name: str, practice_phone: str):
+    """Fill [Business Name]/[Phone] placeholders and recount characters"""
+    for msg in result.get("messages", []):
+        msg["text"] = msg["text"].replace("[Business Name]", practice_name)
+        msg["text"] = msg["text"].replace("[Phone]", practice_phone)
+        msg["character_count"] = len(msg["text"])
+    return result
+
+
+# ---- Streaming (SSE) variants of the campaign copy endpoints ----
+# Events: "token" {"text": delta} while the model writes, then one "result"
+# carrying the same JSON the non-streaming endpoint returns. If generation or
+# parsing fails an "error" event precedes a "result" built from the fallback.
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _stream_llm_json(prompt: str, label: str, fallback, finalize=None, max_tokens: int = 1024):
+    """StreamingResponse that forwards completion tokens as SSE, then the parsed result"""
+    from services.campaign_generator import parse_llm_json
+    finalize = finalize or (lambda result: result)
+
+    async def events():
+        chunks = []
+        error = None
+        try:
+            async for text in stream_complete(prompt, max_tokens=max_tokens, validate=parse_llm_json):
+                chunks.append(text)
+                yield _sse("token", {"text": text})
+            result = finalize(parse_llm_json("".join(chunks)))
+        except Exception as e:
+            error = e
+
+        if error is not None:
+            print(f"[LLM ERROR] {label} stream failed: {error}")
+            yield _sse("error", {"detail": f"{label} generation failed, using template copy"})
+            result = finalize(fallback())
+        yield _sse("result", result)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/api/v1/campaigns/generate-copy/stream")
+async def stream_campaign_copy(
+    request: fastapi.Request,
+    vertical: str = Form("medspa"),
+    profile_type: str = Form(""),
+    city: str = Form(""),
+    avg_ltv: float = Form(0),
+    total_clients: int = Form(0),
+    top_services: str = Form(""),
+):
+    """Streaming variant of /api/v1/campaigns/generate-copy."""
+    prompt = _campaign_copy_prompt(vertical, profile_type, city, avg_ltv, total_clients, top_services)
+    return _stream_llm_json(
+        prompt, "Campaign copy",
+        fallback=lambda: _campaign_copy_fallback(vertical, city, total_clients),
+        max_tokens=600
+    )
+
+
+@app.post("/api/v1/campaigns/instagram/stream")
+@limiter.limit("100/hour")
+async def stream_instagram_campaign(
+    request: fastapi.Request,
+    segment_name: str = Form(...),
+    patient_count: int = Form(...),
+    avg_ltv: float = Form(...),
+    avg_ticket: float = Form(...),
+    top_procedures: str = Form(...),  # comma-separated
+    target_demographics: str = Form(...),
+    practice_name: str = Form("Your Practice"),
+    practice_city: str = Form("Your City"),
+):
+    """Streaming variant of /api/v1/campaigns/instagram."""
+    context = _segment_campaign_context(
+        segment_name, patient_count, avg_ltv, avg_ticket, top_procedures,
+        target_demographics, practice_name, practice_city
+    )
+    return _stream_llm_json(
+        PromptLibrary.instagram_ad_copy(context), "Instagram ad",
+        fallback=lambda: _instagram_fallback(top_procedures, practice_name, practice_city, target_demographics)
+    )
+
+
+@app.post("/api/v1/campaigns/google/stream")
+@limiter.limit("100/hour")
+async def stream_google_campaign(
+    request: fastapi.Request,
+    segment_name: str = Form(...),
+    patient_count: int = Form(...),
+    avg_ltv: float = Form(...),
+    avg_ticket: float = Form(...),
+    top_procedures: str = Form(...),
+    target_demographics: str = Form(...),
+    practice_name: str = Form("Your Practice"),
+    practice_city: str = Form("Your City"),
+):
+    """Streaming variant of /api/v1/campaigns/google."""
+    context = _segment_campaign_context(
+        segment_name, patient_count, avg_ltv, avg_ticket, top_procedures,
+        target_demographics, practice_name, practice_city
+    )
+    return _stream_llm_json(
+        PromptLibrary.google_ad_copy(context), "Google ad",
+        fallback=lambda: _google_fallback(top_procedures, practice_city, patient_count)
+    )
+
+
+@app.post("/api/v1/campaigns/email/stream")
+@limiter.limit("100/hour")
+async def stream_email_campaign(
+    request: fastapi.Request,
+    segment_name: str = Form(...),
+    procedure: str = Form("aesthetic treatments"),
+    sequence_type: str = Form("nurture"),
+    practice_name: str = Form("Your Practice"),
+    practice_city: str = Form("Your City"),
+    vertical: str = Form("medspa"),
+):
+    """Streaming variant of /api/v1/campaigns/email."""
+    from services.campaign_generator import email_sequence_fallback, email_sequence_prompt
+
+    def add_practice_info(result):
+        result["practice_name"] = practice_name
+        result["practice_city"] = practice_city
+        return result
+
+    return _stream_llm_json(
+        email_sequence_prompt(segment_name, procedure, sequence_type, vertical),
+        f"Email sequence ({sequence_type})",
+        fallback=lambda: email_sequence_fallback(procedure),
+        finalize=add_practice_info
+    )
+
+
+@app.post("/api/v1/campaigns/sms/stream")
+@limiter.limit("100/hour")
+async def stream_sms_campaign(
+    request: fastapi.Request,
+    segment_name: str = Form(...),
+    procedure: str = Form("your treatment"),
+    campaign_type: str = Form("reactivation"),
+    practice_name: str = Form("Your Practice"),
+    practice_phone: str = Form("[Phone]"),
+    vertical: str = Form("medspa"),
+):
+    """Streaming variant of /api/v1/campaigns/sms."""
+    from services.campaign_generator import sms_campaign_fallback, sms_campaign_prompt
+
+    return _stream_llm_json(
+        sms_campaign_prompt(segment_name, procedure, campaign_type, vertical),
+        f"SMS campaign ({campaign_type})",
+        fallback=lambda: sms_campaign_fallback(procedure),
+        finalize=lambda result: _apply_sms_practice_info(result, practice_name, practice_phone)
+    )
+
+
 def reconcile_outreach_returns(db: Session, run_id: str, df: pd.DataFrame):
     """
     Check if any contacted patients have returned based on new upload data.
     Auto-marks them as returned and logs their revenue.
     """
-    from datetime import datetime
-    
     print(f"[RECONCILE] Starting reconciliation for run {run_id}")
     
-    # Only check patients from THIS run (not all runs)
-    contacted = db.query(PatientOutreach).filter(
-        PatientOutreach.run_id == run_id,
-        PatientOutreach.contacted_at.isnot(None),
-        PatientOutreach.returned_at.is_(None)
-    ).all()
-    
-    print(f"[RECONCILE] Found {len(contacted)} contacted patients awaiting return")
-    
-    if not contacted:
-        return {"reconciled": 0, "revenue": 0}
-    
     # Get column names from current upload
     patient_col = 'patient_id' if 'patient_id' in df.columns else df.columns[0]
     revenue_col = 'revenue' if 'revenue' in df.columns else 'amount' if 'amount' in df.columns else None
     date_col = next((c for c in ['visit_date', 'date', 'last_visit', 'appointment_date'] if c in df.columns), None)
     
-    # Parse dates if available
-    if date_col:
-        df = df.copy()
-        df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
-    
-    current_patients = set(df[patient_col].astype(str).unique())
-    print(f"[RECONCILE] Current upload has {len(current_patients)} patients: {list(current_patients)[:5]}...")
-    print(f"[RECONCILE] Looking for matches with: {[c.patient_id for c in contacted]}")
-    
-    reconciled = 0
-    total_revenue = 0
-    
-    for outreach in contacted:
-        if outreach.patient_id not in current_patients:
-            continue
-            
-        patient_rows = df[df[patient_col].astype(str) == outreach.patient_id]
-        
-        # Only count visits AFTER the contact date
-        if date_col and outreach.contacted_at:
-            patient_rows = patient_rows[patient_rows[date_col] > outreach.contacted_at]
-        
-        if patient_rows.empty:
-            continue
-            
-        # Patient returned! Mark them
-        outreach.returned_at = datetime.utcnow()
-        
+    # Only check patients from THIS run (not all runs)
+    result = reconcile_outreach(db, df, patient_col, date_col, revenue_col, run_id=run_id)
     
-    db.commit()
-    return {"success": True, "contacted_count": len(patient_ids)}
+    print(f"[RECONCILE] Checked {result['checked']} contacted patients, "
+          f"{result['reconciled']} returned (${result['revenue']:,.0f})")
+    return {"reconciled": result["reconciled"], "revenue": result["revenue"]}
 
 
+@app.get("/api/v1/metrics/responses")
+async def get_response_metrics(reset: bool = False):
+    """Payload size, bytes sent and serialization time per endpoint since startup (or last reset)."""
+    report = RESPONSE_METRICS.snapshot()
+    if reset:
+        RESPONSE_METRICS.reset()
+    return {"endpoints": report}
+
 @app.post("/api/v1/runs/{run_id}/outreach/mark-returned")
 async def mark_patients_returned(
     run_id: str,
@@ -3419,21 +3713,9 @@ async def mark_patients_returned(
     db: Session = Depends(get_db)
 ):
     """Mark a patient as returned and log recovered revenue."""
-    from datetime import datetime
-    
-    outreach = db.query(PatientOutreach).filter(
-        PatientOutreach.run_id == run_id,
-        PatientOutreach.patient_id == patient_id
-    ).first()
-    
-    if outreach:
-        outreach.returned_at = datetime.utcnow()
-        outreach.revenue_recovered = revenue
-        db.commit()
+    if mark_returned(db, run_id, patient_id, revenue):
         return {"success": True}
     
-    
-    
     return {"success": False, "error": "Patient not found in outreach list"}
 
 
@@ -3443,19 +3725,26 @@ async def get_outreach_summary(
     db: Session = Depends(get_db)
 ):
     """Get ROI summary for outreach campaign."""
-    outreach_records = db.query(PatientOutreach).filter(
-        PatientOutreach.run_id == run_id
-    ).all()
-    
-    contacted = [r for r in outreach_records if r.contacted_at]
-    returned = [r for r in outreach_records if r.returned_at]
-    total_recovered = sum(r.revenue_recovered or 0 for r in returned)
+    from sqlalchemy import func
+    
+    # Totals come from the rollup; only the patient list touches patient_outreach
+    contacted, returned, total_recovered = db.query(
+        func.coalesce(func.sum(OutreachRollup.contacted), 0),
+        func.coalesce(func.sum(OutreachRollup.returned), 0),
+        func.coalesce(func.sum(OutreachRollup.revenue), 0.0)
+    ).filter(OutreachRollup.run_id == run_id).one()
+    outreach_records = db.query(
+        PatientOutreach.patient_id,
+        PatientOutreach.contacted_at,
+        PatientOutreach.returned_at,
+        PatientOutreach.revenue_recovered
+    ).filter(PatientOutreach.run_id == run_id).all()
     
     return {
-        "contacted_count": len(contacted),
-        "returned_count": len(returned),
-        "conversion_rate": round(len(returned) / len(contacted) * 100, 1) if contacted else 0,
-        "revenue_recovered": total_recovered,
+        "contacted_count": contacted,
+        "returned_count": returned,
+        "conversion_rate": round(returned / contacted * 100, 1) if contacted else 0,
+        "revenue_recovered": float(total_recovered),
         "patients": [
             {
                 "patient_id": r.patient_id,
@@ -3477,41 +3766,40 @@ async def mark_patients_contacted(
     db: Session = Depends(get_db)
 ):
     """Mark patients as contacted for outreach tracking with context."""
-    import uuid
-    from datetime import datetime
-
     print(f"[DEBUG] mark_contacted: run_id={run_id}, segment={segment}, patient_count={len(patient_ids)}")
 
     days_stale = [int(d) for d in days_stale_list.split(",") if d.strip()] if days_stale_list else []
     loan_amounts = [float(a) for a in loan_amount_list.split(",") if a.strip()] if loan_amount_list else []
     
-    for i, pid in enumerate(patient_ids):
-        existing = db.query(PatientOutreach).filter(
-            PatientOutreach.run_id == run_id,
-            PatientOutreach.patient_id == pid
-        ).first()
-        
-        if existing:
-            existing.contacted_at = datetime.utcnow()
-            existing.days_stale_when_contacted = days_stale[i] if i < len(days_stale) else None
-            existing.outcome = "pending"
-        else:
-            outreach = PatientOutreach(
-                id=str(uuid.uuid4()),
-                run_id=run_id,
-                patient_id=pid,
-                segment=segment if segment else None,
-                contacted_at=datetime.utcnow(),
-                days_stale_when_contacted=days_stale[i] if i < len(days_stale) else None,
-                loan_amount=loan_amounts[i] if i < len(loan_amounts) else None,
-                commission=(loan_amounts[i] * 0.01) if i < len(loan_amounts) else None,
-                outcome="pending"
-            )
-            db.add(outreach)
-    
-    db.commit()
+    patients = [
+        {
+            "patient_id": pid,
+            "days_stale": days_stale[i] if i < len(days_stale) else None,
+            "loan_amount": loan_amounts[i] if i < len(loan_amounts) else None,
+        }
+        for i, pid in enumerate(patient_ids)
+    ]
+    mark_contacted(db, run_id, patients, segment=segment)
     return {"success": True, "contacted_count": len(patient_ids)}
 
+
+@app.post("/api/v1/runs/{run_id}/outreach/contacted")
+async def mark_patients_contacted_bulk(
+    run_id: str,
+    request: OutreachContactRequest,
+    db: Session = Depends(get_db)
+):
+    """JSON variant of mark-contacted for large lists, with per-patient metadata."""
+    if len(request.patients) > MAX_OUTREACH_PATIENTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_OUTREACH_PATIENTS} patients per request")
+    
+    result = mark_contacted(
+        db, run_id, [p.model_dump() for p in request.patients],
+        segment=request.segment, campaign_name=request.campaign_name
+    )
+    print(f"[OUTREACH] Run {run_id}: {result['inserted']} new, {result['updated']} re-contacted")
+    return {"success": True, "contacted_count": result["contacted"], **result}
+
 @app.post("/api/v1/outreach/{outreach_id}/outcome")
 async def update_outreach_outcome(
     outreach_id: str,
@@ -3519,38 +3807,26 @@ async def update_outreach_outcome(
     db: Session = Depends(get_db)
 ):
     """Update outcome: pending, closed, lost, no_answer, callback"""
-    outreach = db.query(PatientOutreach).filter(PatientOutreach.id == outreach_id).first()
-    if not outreach:
+    if not set_outreach_outcome(db, outreach_id, outcome):
         raise HTTPException(status_code=404, detail="Outreach record not found")
     
-    outreach.outcome = outcome
-    if outcome == "closed":
-        outreach.returned_at = datetime.utcnow()
-        outreach.revenue_recovered = outreach.commission or (outreach.loan_amount * 0.01 if outreach.loan_amount else 4000)
-    
-    db.commit()
     return {"success": True, "outcome": outcome}
 
 
 @app.get("/api/v1/analytics/recovery-rates")
 async def get_recovery_analytics(db: Session = Depends(get_db)):
     """Conversion rates by days-to-contact — the moat data."""
-    from sqlalchemy import func, case
+    from sqlalchemy import func
     
     results = db.query(
-        case(
-            (PatientOutreach.days_stale_when_contacted < 7, '0-7 days'),
-            (PatientOutreach.days_stale_when_contacted < 30, '8-30 days'),
-            (PatientOutreach.days_stale_when_contacted < 60, '31-60 days'),
-            else_='60+ days'
-        ).label('timing_bucket'),
-        func.count(PatientOutreach.id).label('total'),
-        func.sum(case((PatientOutreach.outcome == 'closed', 1), else_=0)).label('closed'),
-        func.sum(PatientOutreach.revenue_recovered).label('revenue')
+        OutreachRollup.stale_bucket.label('timing_bucket'),
+        func.sum(OutreachRollup.with_outcome).label('total'),
+        func.sum(OutreachRollup.closed).label('closed'),
+        func.sum(OutreachRollup.outcome_revenue).label('revenue')
     ).filter(
-        PatientOutreach.outcome.isnot(None),
-        PatientOutreach.days_stale_when_contacted.isnot(None)
-    ).group_by('timing_bucket').all()
+        OutreachRollup.stale_bucket != '',
+        OutreachRollup.with_outcome > 0
+    ).group_by(OutreachRollup.stale_bucket).all()
     
     return {
         "buckets": [
@@ -3575,7 +3851,6 @@ async def detect_patient_returns(
     Auto-detect who came back based on new visit dates.
     """
     import pandas as pd
-    from datetime import datetime
 
     # Get the current run and its dataset
     analysis_run = db.query(AnalysisRun).filter(AnalysisRun.id == run_id).first()
@@ -3611,60 +3886,18 @@ async def detect_patient_returns(
     if not id_col:
         return {"error": "No patient ID column found"}
 
-    # Parse dates
-    df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
+    revenue_col = next((c for c in ['revenue', 'amount', 'total', 'spend', 'value'] if c in df.columns), None)
 
-    # Get all contacted patients (not yet returned)
-    contacted = db.query(PatientOutreach).filter(
-        PatientOutreach.contacted_at.isnot(None),
-        PatientOutreach.returned_at.is_(None)
-    ).all()
+    # Check every run's pending outreach against this upload in one pass
+    result = reconcile_outreach(db, df, id_col, date_col, revenue_col, outcome='closed')
 
-    if not contacted:
+    if not result["checked"]:
         return {"returns_detected": 0, "message": "No pending outreach to check"}
 
-    returns_detected = 0
-    total_revenue = 0
-
-    for outreach in contacted:
-        # Find this patient in current data
-        patient_rows = df[df[id_col].astype(str) == str(outreach.patient_id)]
-
-        if patient_rows.empty:
-            continue
-
-        # Get their latest visit
-        latest_visit = patient_rows[date_col].max()
-
-        if pd.isna(latest_visit):
-            continue
-
-        # If latest visit is after contacted_at, they returned
-        if latest_visit > outreach.contacted_at:
-            outreach.returned_at = datetime.utcnow()
-
-            # Calculate revenue from visits after contact
-            revenue_col = None
-            for col in ['revenue', 'amount', 'total', 'spend', 'value']:
-                if col in df.columns:
-                    revenue_col = col
-                    break
-
-            if revenue_col:
-                post_contact = patient_rows[patient_rows[date_col] > outreach.contacted_at]
-                revenue = float(post_contact[revenue_col].sum())
-                outreach.revenue_recovered = revenue
-                total_revenue += revenue
-
-            outreach.outcome = 'closed'
-            returns_detected += 1
-
-    db.commit()
-
     return {
-        "returns_detected": returns_detected,
-        "total_revenue_recovered": round(total_revenue, 2),
-        "patients_checked": len(contacted)
+        "returns_detected": result["reconciled"],
+        "total_revenue_recovered": round(result["revenue"], 2),
+        "patients_checked": result["checked"]
     }
 
 
@@ -3673,18 +3906,17 @@ async def get_performance_summary(db: Session = Depends(get_db)):
     """
     Get overall campaign performance across all segments.
     """
-    from sqlalchemy import func, Integer
+    from sqlalchemy import func
 
-    # Get counts by segment
+    # Get counts by segment from the incrementally maintained rollup
     segment_stats = db.query(
-        PatientOutreach.segment,
-        func.count(PatientOutreach.id).label('targeted'),
-        func.sum(func.cast(PatientOutreach.returned_at.isnot(None), Integer)).label('returned'),
-        func.sum(PatientOutreach.revenue_recovered).label('revenue')
+        OutreachRollup.segment,
+        func.sum(OutreachRollup.contacted).label('targeted'),
+        func.sum(OutreachRollup.returned).label('returned'),
+        func.sum(OutreachRollup.revenue).label('revenue')
     ).filter(
-        PatientOutreach.contacted_at.isnot(None),
-        PatientOutreach.segment.isnot(None)
-    ).group_by(PatientOutreach.segment).all()
+        OutreachRollup.segment != ''
+    ).group_by(OutreachRollup.segment).having(func.sum(OutreachRollup.contacted) > 0).all()
 
     campaigns = []
     total_targeted = 0
@@ -3726,17 +3958,7 @@ async def mark_patients_returned(
     db: Session = Depends(get_db)
 ):
     """Mark a patient as returned and log recovered revenue."""
-    from datetime import datetime
-    
-    outreach = db.query(PatientOutreach).filter(
-        PatientOutreach.run_id == run_id,
-        PatientOutreach.patient_id == patient_id
-    ).first()
-    
-    if outreach:
-        outreach.returned_at = datetime.utcnow()
-        outreach.revenue_recovered = revenue
-        db.commit()
+    if mark_returned(db, run_id, patient_id, revenue):
         return {"success": True}
     
     return {"success": False, "error": "Patient not found in outreach list"}
@@ -3748,19 +3970,26 @@ async def get_outreach_summary(
     db: Session = Depends(get_db)
 ):
     """Get ROI summary for outreach campaign."""
-    outreach_records = db.query(PatientOutreach).filter(
-        PatientOutreach.run_id == run_id
-    ).all()
-    
-    contacted = [r for r in outreach_records if r.contacted_at]
-    returned = [r for r in outreach_records if r.returned_at]
-    total_recovered = sum(r.revenue_recovered or 0 for r in returned)
+    from sqlalchemy import func
+    
+    # Totals come from the rollup; only the patient list touches patient_outreach
+    contacted, returned, total_recovered = db.query(
+        func.coalesce(func.sum(OutreachRollup.contacted), 0),
+        func.coalesce(func.sum(OutreachRollup.returned), 0),
+        func.coalesce(func.sum(OutreachRollup.revenue), 0.0)
+    ).filter(OutreachRollup.run_id == run_id).one()
+    outreach_records = db.query(
+        PatientOutreach.patient_id,
+        PatientOutreach.contacted_at,
+        PatientOutreach.returned_at,
+        PatientOutreach.revenue_recovered
+    ).filter(PatientOutreach.run_id == run_id).all()
     
     return {
-        "contacted_count": len(contacted),
-        "returned_count": len(returned),
-        "conversion_rate": round(len(returned) / len(contacted) * 100, 1) if contacted else 0,
-        "revenue_recovered": total_recovered,
+        "contacted_count": contacted,
+        "returned_count": returned,
+        "conversion_rate": round(returned / contacted * 100, 1) if contacted else 0,
+        "revenue_recovered": float(total_recovered),
         "patients": [
             {
                 "patient_id": r.patient_id,
@@ -3823,7 +4052,7 @@ Return ONLY valid JSON:
 Warm and personal, not salesy."""
 
     try:
-        response = await llm_service.generate(prompt, max_tokens=500)
+        response = await llm_service.generate(prompt, max_tokens=500, validate=json.loads)
         scripts = json.loads(response)
     except:
         scripts = {
@@ -3883,9 +4112,8 @@ async def track_script_usage(
 # ACQUISITION CAMPAIGN ENDPOINTS
 # ============================================================================
 
-@app.get("/api/segments/{segment_id}/acquisition-summary")
-async def get_acquisition_summary(segment_id: str, db: Session = Depends(get_db)):
-    """Get segment summary for acquisition campaign page."""
+def build_acquisition_summary(db: Session, segment_id: str) -> dict:
+    """Segment summary for the acquisition campaign page (defaults if the run is unknown)."""
     analysis_run = db.query(AnalysisRun).filter(AnalysisRun.id == segment_id).first()
     
     if not analysis_run:
@@ -3903,24 +4131,13 @@ async def get_acquisition_summary(segment_id: str, db: Session = Depends(get_db)
             "profileLabel": "VIP",
         }
     
-    dominant_profile_data = getattr(analysis_run, 'dominant_profile', None)
-    if isinstance(dominant_profile_data, str):
-        try:
-            dominant_profile_data = json.loads(dominant_profile_data)
-        except:
-            dominant_profile_data = {}
-    if not dominant_profile_data:
-        dominant_profile_data = {}
+    artifacts = load_run_artifacts(db, segment_id, ["dominant_profile", "top_segments"])
+    dominant_profile_data = artifacts["dominant_profile"] or {}
     
     demographics = dominant_profile_data.get("dominant_profile", {})
     behavior = dominant_profile_data.get("behavior_patterns", {})
     
-    top_segments = analysis_run.top_segments
-    if isinstance(top_segments, str):
-        try:
-            top_segments = json.loads(top_segments)
-        except:
-            top_segments = []
+    top_segments = artifacts["top_segments"] or []
     
     neighborhoods = []
     if top_segments:
@@ -3948,25 +4165,16 @@ async def get_acquisition_summary(segment_id: str, db: Session = Depends(get_db)
     }
 
 
-@app.get("/api/acquisition/{segment_id}/projection")
-async def get_acquisition_projection(segment_id: str, db: Session = Depends(get_db)):
-    """Get projected new patient revenue."""
-    analysis_run = db.query(AnalysisRun).filter(AnalysisRun.id == segment_id).first()
-    
+def build_acquisition_projection(db: Session, segment_id: str) -> dict:
+    """Projected new patient revenue."""
     avg_ltv = 850
     patient_count = 50
     
-    if analysis_run:
-        dominant_profile_data = getattr(analysis_run, 'dominant_profile', None)
-        if isinstance(dominant_profile_data, str):
-            try:
-                dominant_profile_data = json.loads(dominant_profile_data)
-            except:
-                dominant_profile_data = {}
-        if dominant_profile_data:
-            behavior = dominant_profile_data.get("behavior_patterns", {})
-            avg_ltv = behavior.get("avg_lifetime_value", 850)
-            patient_count = dominant_profile_data.get("segment_patient_count", 50)
+    dominant_profile_data = load_run_artifact(db, segment_id, "dominant_profile")
+    if dominant_profile_data:
+        behavior = dominant_profile_data.get("behavior_patterns", {})
+        avg_ltv = behavior.get("avg_lifetime_value", 850)
+        patient_count = dominant_profile_data.get("segment_patient_count", 50)
     
     projected_new_patients = max(5, min(20, int(patient_count * 0.15)))
     projected_revenue = projected_new_patients * avg_ltv
@@ -3981,10 +4189,9 @@ async def get_acquisition_projection(segment_id: str, db: Session = Depends(get_
     }
 
 
-@app.get("/api/acquisition/{segment_id}/channels")
-async def get_acquisition_channels(segment_id: str, db: Session = Depends(get_db)):
-    """Get recommended channel mix."""
-    projection = await get_acquisition_projection(segment_id, db)
+def build_acquisition_channels(db: Session, segment_id: str) -> list:
+    """Recommended channel mix."""
+    projection = build_acquisition_projection(db, segment_id)
     monthly_spend = projection["projectedAdSpendMonthly"]
     daily_total = monthly_spend / 30
     
@@ -4016,10 +4223,46 @@ async def get_acquisition_channels(segment_id: str, db: Session = Depends(get_db
     ]
 
 
+@app.get("/api/segments/{segment_id}/acquisition-summary")
+async def get_acquisition_summary(segment_id: str, request: fastapi.Request, response: fastapi.Response,
+                                  db: Session = Depends(get_db)):
+    """Get segment summary for acquisition campaign page."""
+    etag = run_etag(db, segment_id, ["dominant_profile", "top_segments"], "acquisition-summary")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    response.headers.update(run_cache_headers(etag))
+    return build_acquisition_summary(db, segment_id)
+
+
+@app.get("/api/acquisition/{segment_id}/projection")
+async def get_acquisition_projection(segment_id: str, request: fastapi.Request, response: fastapi.Response,
+                                     db: Session = Depends(get_db)):
+    """Get projected new patient revenue."""
+    etag = run_etag(db, segment_id, ["dominant_profile"], "acquisition-projection")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    response.headers.update(run_cache_headers(etag))
+    return build_acquisition_projection(db, segment_id)
+
+
+@app.get("/api/acquisition/{segment_id}/channels")
+async def get_acquisition_channels(segment_id: str, request: fastapi.Request, response: fastapi.Response,
+                                   db: Session = Depends(get_db)):
+    """Get recommended channel mix."""
+    etag = run_etag(db, segment_id, ["dominant_profile"], "acquisition-channels")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    response.headers.update(run_cache_headers(etag))
+    return build_acquisition_channels(db, segment_id)
+
+
 @app.post("/api/acquisition/{segment_id}/channels/{channel_id}/generate")
 async def generate_acquisition_ad_content(segment_id: str, channel_id: str, db: Session = Depends(get_db)):
     """Generate ad copy for a channel."""
-    summary = await get_acquisition_summary(segment_id, db)
+    summary = build_acquisition_summary(db, segment_id)
     targeting_focus = f"Ages 25–54 · Income ${int(summary['avgIncome']/1000)}K+ · {', '.join(summary['neighborhoods'][:3])}"
     
     return {
@@ -4037,9 +4280,9 @@ async def generate_acquisition_ad_content(segment_id: str, channel_id: str, db:
 @app.get("/api/acquisition/{segment_id}/export")
 async def export_acquisition_plan(segment_id: str, db: Session = Depends(get_db)):
     """Export campaign plan as JSON."""
-    summary = await get_acquisition_summary(segment_id, db)
-    projection = await get_acquisition_projection(segment_id, db)
-    channels = await get_acquisition_channels(segment_id, db)
+    summary = build_acquisition_summary(db, segment_id)
+    projection = build_acquisition_projection(db, segment_id)
+    channels = build_acquisition_channels(db, segment_id)
     
     return {
         "exportedAt": datetime.now().isoformat(),
@@ -4049,69 +4292,141 @@ async def export_acquisition_plan(segment_id: str, db: Session = Depends(get_db)
         "channels": channels,
     }
 
+def _cohort_label(profile_data) -> str:
+    """The run's cohort label (from its dominant profile), given to its top patients"""
+    if not isinstance(profile_data, dict):
+        return "Best Patient"
+    return (profile_data.get("cohort_descriptor") or {}).get("label", "Best Patient")
+
+
+def persist_scored_patients(run_id: str, df: pd.DataFrame, cohort_label: str, session_factory=SessionLocal) -> int:
+    """Label an already scored patient frame and persist it to run_patients, in its own session."""
+    # Fix column name if needed
+    if 'patient_id_' in df.columns and 'patient_id' not in df.columns:
+        df = df.rename(columns={'patient_id_': 'patient_id'})
+    db = session_factory()
+    try:
+        count = persist_run_patients(db, run_id, label_patients(df, cohort_label))
+    finally:
+        db.close()
+    print(f"[EXPORT] Persisted {count} labeled patients for run {run_id}")
+    return count
+
+
+def materialize_run_patients(run_id: str, session_factory=SessionLocal) -> int:
+    """
+    Score and label the patients of a run that completed before run_patients
+    existed, once, and persist them. Opens its own session (runs in a worker thread).
+    """
+    db = session_factory()
+    try:
+        analysis_run = db.get(AnalysisRun, run_id)
+        dataset = db.query(Dataset).filter(Dataset.id == analysis_run.dataset_id).first()
+        if not dataset:
+            raise HTTPException(status_code=404, detail="Dataset not found")
+        patients_path = analysis_run.filtered_dataset_path or dataset.patients_path
+        cohort_label = _cohort_label(load_run_artifact(db, run_id, "dominant_profile", {}))
+    finally:
+        db.close()
+    
+    # Load and process patient data
+    df = pd.read_csv(patients_path)
+    df = normalize_patients_dataframe(df)
+    df = aggregate_visits_to_patients(df)
+    # Fix column name if needed
+    if 'patient_id_' in df.columns and 'patient_id' not in df.columns:
+        df = df.rename(columns={'patient_id_': 'patient_id'})
+    df = segment_patients_by_behavior(df)
+    return persist_scored_patients(run_id, df, cohort_label, session_factory)
+
+
 @app.get("/api/v1/runs/{run_id}/export-patients")
 async def export_labeled_patients(
     run_id: str,
+    request: fastapi.Request,
+    format: str = "csv",
+    gzip: bool = False,
     db: Session = Depends(get_db)
 ):
     """
-    Export patient list with computed labels and scores.
+    Export patient list with computed labels and scores (csv or parquet),
+    streamed from the run's persisted patients.
     """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    
     # Get the run
     analysis_run = db.query(AnalysisRun).filter(AnalysisRun.id == run_id).first()
     if not analysis_run or analysis_run.status != "done":
         raise HTTPException(status_code=404, detail="Run not found or not completed")
     
-    # Get the dataset
-    dataset = db.query(Dataset).filter(Dataset.id == analysis_run.dataset_id).first()
-    if not dataset:
-        raise HTTPException(status_code=404, detail="Dataset not found")
-    
-    # Load and process patient data
-    df = pd.read_csv(dataset.patients_path)
-    df = normalize_patients_dataframe(df)
-    df = aggregate_visits_to_patients(df)
-    # Fix column name if needed
-    if 'patient_id_' in df.columns and 'patient_id' not in df.columns:
-        df = df.rename(columns={'patient_id_': 'patient_id'})
-    df = segment_patients_by_behavior(df)
-    
-    # Get cohort descriptor from run results
-    dominant_profile = getattr(analysis_run, 'dominant_profile', None)
-    cohort_label = "Best Patient"
-    if dominant_profile:
+    # Patients are labeled from dominant_profile, so its digest versions the file
+    etag = run_etag(db, run_id, ["dominant_profile"], "export-patients", format, gzip)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
+    # Runs from before run_patients existed are scored on their first export
+    columns = persisted_patient_columns(db, run_id)
+    if columns is None:
+        # Scoring and hashing are CPU-bound: keep them off the event loop
+        await asyncio.to_thread(materialize_run_patients, run_id)
+        db.expire_all()
+        columns = persisted_patient_columns(db, run_id)
+    
+    chunks = iter_run_patient_chunks(SessionLocal, run_id, columns=columns)
+    if format == "parquet":
         try:
-            profile_data = json.loads(dominant_profile) if isinstance(dominant_profile, str) else dominant_profile
-            cohort_label = profile_data.get("cohort_descriptor", {}).get("label", "Best Patient")
-        except:
-            pass
-    
-    # Mark top 20% with cohort label
-    top_count = max(1, int(len(df) * 0.2))
-    df = df.sort_values('value_score', ascending=False).reset_index(drop=True)
-    df['cohort'] = df.index.map(lambda i: cohort_label if i < top_count else "General")
+            body = stream_parquet(chunks, columns, {c: RUN_PATIENT_TYPES[c] for c in columns})
+        except ImportError as e:
+            raise HTTPException(status_code=501, detail=f"Parquet export needs pyarrow: {e}")
+    else:
+        body = stream_csv(chunks, columns, gzip=gzip)
     
-    # Select export columns
-    export_cols = ['patient_id', 'zip_code', 'behavioral_segment', 'value_score', 'cohort']
-    if 'revenue' in df.columns:
-        export_cols.append('revenue')
-    if 'visits_per_year' in df.columns:
-        export_cols.append('visits_per_year')
+    filename = export_filename(f"labeled_patients_{run_id[:8]}", format, gzip)
+    return StreamingResponse(
+        body,
+        media_type=export_media_type(format, gzip),
+        headers={"Content-Disposition": f"attachment; filename={filename}", **run_cache_headers(etag)}
+    )
+
+@app.get("/api/v1/runs/{run_id}/export-customer-match")
+async def export_customer_match(
+    run_id: str,
+    request: fastapi.Request,
+    platform: str = "facebook",
+    segment: Optional[str] = None,
+    gzip: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Customer-match upload (SHA-256 hashed email / phone) for a run's patients,
+    optionally one behavioral segment, streamed from the persisted patients.
+    """
+    if platform not in PLATFORM_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"platform must be one of {', '.join(PLATFORM_COLUMNS)}")
     
-    export_df = df[[c for c in export_cols if c in df.columns]]
+    analysis_run = db.query(AnalysisRun).filter(AnalysisRun.id == run_id).first()
+    if not analysis_run or analysis_run.status != "done":
+        raise HTTPException(status_code=404, detail="Run not found or not completed")
     
-    # Return as CSV
-    from fastapi.responses import StreamingResponse
-    import io
+    etag = run_etag(db, run_id, ["dominant_profile"], "export-customer-match", platform, segment, gzip)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
     
-    stream = io.StringIO()
-    export_df.to_csv(stream, index=False)
-    stream.seek(0)
+    if persisted_patient_columns(db, run_id) is None:
+        # Scoring and hashing are CPU-bound: keep them off the event loop
+        await asyncio.to_thread(materialize_run_patients, run_id)
     
+    headers, columns = zip(*PLATFORM_COLUMNS[platform].items())
+    chunks = iter_run_patient_chunks(SessionLocal, run_id, columns=list(columns), segment=segment, hashed_only=True)
+    segment_slug = f"_{segment.lower().replace(' ', '_')}" if segment else ""
+    filename = export_filename(f"{platform}_customer_match_{run_id[:8]}{segment_slug}", "csv", gzip)
     return StreamingResponse(
-        iter([stream.getvalue()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename=labeled_patients_{run_id[:8]}.csv"}
+        stream_csv(chunks, headers, gzip=gzip),
+        media_type=export_media_type("csv", gzip),
+        headers={"Content-Disposition": f"attachment; filename={filename}", **run_cache_headers(etag)}
     )
 
 @app.post("/api/v1/segments/churn-analysis")
@@ -4119,17 +4434,27 @@ async def export_labeled_patients(
 async def analyze_segment_churn(
     request: fastapi.Request,
     run_id: str = Form(...),
+    refresh: bool = Form(False),
     db: Session = Depends(get_db)
 ):
     """
     Analyze churn risk for patients in a completed analysis run.
+    Served from persisted churn scores; the CSV is only loaded and scored the
+    first time (or when refresh=true).
     """
-    from services.churn_scoring import get_churn_summary
-    
     # Get the run
     analysis_run = db.query(AnalysisRun).filter(AnalysisRun.id == run_id).first()
     if not analysis_run or analysis_run.status != "done":
         raise HTTPException(status_code=404, detail="Run not found or not completed")
+
+    summary = None if refresh else get_stored_churn_summary(db, run_id)
+    if summary is not None:
+        print(f"[CHURN] Served stored churn scores for run {run_id} (as of {summary['scored_as_of']})")
+        return {
+            "success": True,
+            "run_id": run_id,
+            **summary
+        }
     
     # Get the dataset to load patient data
     dataset = db.query(Dataset).filter(Dataset.id == analysis_run.dataset_id).first()
@@ -4143,6 +4468,8 @@ async def analyze_segment_churn(
     # Load patient data
     df = pd.read_csv(patients_path_to_use)
     df = normalize_patients_dataframe(df)
+    # Visit gaps for procedure intervals come from the visit-level rows
+    visit_index = build_visit_index(df)
     df = aggregate_visits_to_patients(df)
 
     # Score patients but analyze ALL for churn (not just top 20%)
@@ -4163,7 +4490,8 @@ async def analyze_segment_churn(
     if 'last_visit' in df.columns:
         print(f"[CHURN DEBUG] last_visit sample: {df['last_visit'].head(3).tolist()}")
 
-    summary = get_churn_summary(df)
+    persist_churn_scores(db, run_id, df, visit_index=visit_index)
+    summary = get_stored_churn_summary(db, run_id)
     print(f"\n[CHURN DEBUG] ========== AFTER CHURN CALCULATION ==========")
     print(f"[CHURN DEBUG] Churn summary result: at_risk_percent={summary.get('at_risk_percent', 'MISSING')}, total_patients={summary.get('total_patients', 'MISSING')}")
     print(f"[CHURN DEBUG] Risk counts: critical={summary.get('critical_count', 0)}, high={summary.get('high_count', 0)}, medium={summary.get('medium_count', 0)}, low={summary.get('low_count', 0)}, on_schedule={summary.get('on_schedule_count', 0)}")
@@ -4181,11 +4509,16 @@ async def analyze_segment_churn(
 # SEGMENT INSIGHTS WITH LLM INTERPRETATION
 # ============================================================================
 
-async def generate_segment_insight_llm(segment_type: str, stats: dict, procedures: list, cta_action: str) -> str:
+# Per-card budget for segment insight copy; a card past it gets its fallback text
+SEGMENT_INSIGHT_DEADLINE_SECONDS = float(os.getenv("SEGMENT_INSIGHT_DEADLINE_SECONDS", "8"))
+
+async def generate_segment_insight_llm(segment_type: str, stats: dict, procedures: list, cta_action: str,
+                                       deadline: float = None) -> str:
     """
     Generate insight copy for patient segment cards.
     Follows the behavioral truth → risk/opportunity → action bridge pattern.
     CTA action must be explicitly referenced in the copy.
+    Falls back to the approved copy on error or when deadline (seconds) runs out.
     """
     procedure_list = ", ".join(procedures[:3]) if procedures else "various treatments"
     
@@ -4260,16 +4593,20 @@ Write the insight copy. Reference "{cta_action}" explicitly in the action bridge
     if not prompt:
         return fallbacks.get(segment_type, "No insight available.")
     
+    # Validate that CTA action is referenced: at least one significant word from it appears
+    cta_keywords = [keyword for keyword in cta_action.lower().split() if len(keyword) > 3]
+    
+    def require_cta_reference(text):
+        if not text or not any(keyword in text.lower() for keyword in cta_keywords):
+            raise ValueError(f"no reference to CTA '{cta_action}'")
+    
     try:
         full_prompt = f"{system_prompt}\n\n{prompt}"
-        response = await llm_service.generate(full_prompt, max_tokens=200)
-        
-        # Validate that CTA action is referenced in response
-        cta_keywords = cta_action.lower().split()
-        response_lower = response.lower() if response else ""
+        # Off-pattern replies fall back below and are kept out of the cache so the next call retries
+        response = await llm_service.generate(full_prompt, max_tokens=200, deadline=deadline,
+                                              validate=require_cta_reference)
         
-        # Check if at least one significant word from CTA appears
-        has_cta_reference = any(keyword in response_lower for keyword in cta_keywords if len(keyword) > 3)
+        has_cta_reference = any(keyword in (response or "").lower() for keyword in cta_keywords)
         
         if response and has_cta_reference:
             return response.strip()
@@ -4481,25 +4818,29 @@ async def get_segment_insights(
         "lapsed_regulars": "Start personal outreach"
     }
     
-    # Generate LLM insights if requested
+    # Generate LLM insights if requested (all cards at once; each bounded by its own deadline)
     if generate_llm:
+        pending = {}
         for seg_type, seg_data in segments.items():
             if seg_data["count"] > 0:
-                insight = await generate_segment_insight_llm(
-                    seg_type, 
-                    seg_data["stats"], 
+                pending[seg_type] = generate_segment_insight_llm(
+                    seg_type,
+                    seg_data["stats"],
                     seg_data["top_procedures"],
-                    cta_actions.get(seg_type, "Take action")
+                    cta_actions.get(seg_type, "Take action"),
+                    deadline=SEGMENT_INSIGHT_DEADLINE_SECONDS
                 )
-                seg_data["llm_insight"] = insight
             else:
                 seg_data["llm_insight"] = "No patients in this segment."
+        insights = await asyncio.gather(*pending.values())
+        for seg_type, insight in zip(pending, insights):
+            segments[seg_type]["llm_insight"] = insight
     
     # Calculate overall market averages for comparison
     avg_ltv = df['revenue'].mean() if 'revenue' in df.columns else 0
     avg_visits = df['visit_count'].mean() if 'visit_count' in df.columns else 1
     
-    return {
+    return ORJSONResponse({
         "success": True,
         "run_id": run_id,
         "total_patients": total_patients,
@@ -4569,7 +4910,7 @@ async def get_segment_insights(
                 }
             ]
         }
-    }
+    })
 
 
 @app.post("/api/v1/segments/behavior-patterns")
@@ -4723,13 +5064,23 @@ async def analyze_behavior_patterns(
 
 from services.sms_service import sms_service
 from database import SMSCampaign, SMSMessage
+from services.sms_outbox import campaign_progress, drain_outbox, enqueue_sms_campaign, notify_outbox, run_outbox_dispatcher
+from services.sms_status import flush_status_buffer, record_status_callback, run_status_flusher
+from services.sms_template import preview_sms_campaign
 
 class SMSRecipient(BaseModel):
     patient_id: Optional[str] = None
     name: Optional[str] = None
     phone: str
 
+class SMSPreviewRequest(BaseModel):
+    message: str
+    recipients: list[SMSRecipient]
+    cost_per_segment: Optional[float] = None  # defaults to SMS_COST_PER_SEGMENT
+
 class SMSSendRequest(BaseModel):
+    campaign_id: Optional[str] = None  # client-chosen id: poll /progress, and resubmit safely
+    wait: bool = True  # False: queue for the background dispatcher and return immediately
     run_id: Optional[str] = None
     segment: Optional[str] = None
     campaign_name: Optional[str] = None
@@ -4746,6 +5097,13 @@ async def get_sms_status():
     }
 
 
+@app.post("/api/sms/preview")
+async def preview_sms_send(request: SMSPreviewRequest):
+    """Render a campaign and estimate its encoding, segments and cost without sending"""
+    recipients = [{"patient_id": r.patient_id, "name": r.name, "phone": r.phone} for r in request.recipients]
+    return preview_sms_campaign(request.message, recipients, cost_per_segment=request.cost_per_segment)
+
+
 @app.post("/api/sms/send")
 async def send_sms_campaign(request: SMSSendRequest, db: Session = Depends(get_db)):
     """Send SMS to a list of recipients"""
@@ -4755,59 +5113,75 @@ async def send_sms_campaign(request: SMSSendRequest, db: Session = Depends(get_d
     if not request.recipients:
         raise HTTPException(status_code=400, detail="No recipients provided")
     
-    campaign_id = str(uuid.uuid4())
+    campaign_id = request.campaign_id or str(uuid.uuid4())
     
     # Format recipients
     recipients = [{"patient_id": r.patient_id, "name": r.name, "phone": r.phone} for r in request.recipients]
     
-    # Send messages
-    results = sms_service.send_bulk_sms(
-        recipients=recipients,
-        message_template=request.message,
-        status_callback=None
+    # Write every message to the outbox first, so a crash mid-send loses nothing
+    # and a retry with the same campaign_id never double-sends
+    queued = enqueue_sms_campaign(
+        db, campaign_id, request.message, recipients,
+        run_id=request.run_id,
+        name=request.campaign_name or f"SMS to {request.segment or 'patients'}",
+        segment=request.segment
     )
     
-    # Store campaign
-    try:
-        campaign = SMSCampaign(
-            id=campaign_id,
-            run_id=request.run_id,
-            name=request.campaign_name or f"SMS to {request.segment or 'patients'}",
-            segment=request.segment,
-            message_template=request.message,
-            total_recipients=results["total"],
-            sent_count=results["sent"],
-            failed_count=results["failed"],
-            sent_at=datetime.utcnow()
-        )
-        db.add(campaign)
-        
-        for detail in results["details"]:
-            msg = SMSMessage(
-                id=str(uuid.uuid4()),
-                campaign_id=campaign_id,
-                twilio_sid=detail.get("sid"),
-                patient_id=detail.get("patient_id"),
-                patient_name=detail.get("recipient_name"),
-                phone_number=detail.get("to", ""),
-                message_body=request.message,
-                status="sent" if detail["success"] else "failed",
-                error_code=detail.get("error_code"),
-                error_message=detail.get("error_message"),
-                sent_at=datetime.utcnow() if detail["success"] else None
-            )
-            db.add(msg)
-        
-        db.commit()
-    except Exception as e:
-        print(f"[ERROR] Failed to store SMS campaign: {e}")
+    if not request.wait:
+        notify_outbox()
+        return {
+            "campaign_id": campaign_id,
+            "status": "queued",
+            "total": queued["queued"],
+            "duplicates": queued["duplicates"],
+            "message": f"Queued {queued['queued']} messages"
+        }
+    
+    await drain_outbox(campaign_id=campaign_id)
+    
+    db.expire_all()
+    campaign = db.query(SMSCampaign).filter(SMSCampaign.id == campaign_id).first()
+    print(f"[SMS] Campaign {campaign_id}: sent {campaign.sent_count}, failed {campaign.failed_count} of {campaign.total_recipients}")
+    
+    return {
+        "campaign_id": campaign_id,
+        "status": campaign.status,
+        "total": campaign.total_recipients,
+        "sent": campaign.sent_count,
+        "failed": campaign.failed_count,
+        "message": f"Sent {campaign.sent_count} of {campaign.total_recipients} messages"
+    }
+
+
+@app.post("/api/sms/status-callback", status_code=204)
+async def sms_status_callback(
+    MessageSid: str = Form(...),
+    MessageStatus: str = Form(...),
+    ErrorCode: Optional[str] = Form(None),
+    ErrorMessage: Optional[str] = Form(None)
+):
+    """Twilio delivery-status webhook. Buffered in memory and written to the DB in batches."""
+    record_status_callback(MessageSid, MessageStatus, ErrorCode, ErrorMessage)
+    return fastapi.Response(status_code=204)
+
+
+@app.get("/api/sms/campaigns/{campaign_id}/progress")
+async def get_sms_send_progress(campaign_id: str, db: Session = Depends(get_db)):
+    """Send progress for a campaign, read from its outbox rows"""
+    campaign = db.query(SMSCampaign).filter(SMSCampaign.id == campaign_id).first()
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
     
+    counts = campaign_progress(db, campaign_id)
+    pending = counts["queued"] + counts["sending"]
     return {
         "campaign_id": campaign_id,
-        "total": results["total"],
-        "sent": results["sent"],
-        "failed": results["failed"],
-        "message": f"Sent {results['sent']} of {results['total']} messages"
+        "status": campaign.status,
+        "total": campaign.total_recipients,
+        "done": campaign.total_recipients - pending,
+        "sent": campaign.sent_count,
+        "failed": campaign.failed_count,
+        "by_status": counts
     }
 
 
@@ -0,0 +1,62 @@
+"""
+Alembic environment for Audience Mirror.
+Runs against database.engine by default; a caller can pass its own
+connection in config.attributes["connection"] (see database.create_tables).
+"""
+
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine
+
+import database
+
+config = context.config
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = database.Base.metadata
+
+
+def _url():
+    return config.get_main_option("sqlalchemy.url") or database.DATABASE_URL
+
+
+def _configure(dialect: str, **kwargs):
+    context.configure(
+        target_metadata=target_metadata,
+        # SQLite can't ALTER most things in place; batch mode rebuilds the table
+        render_as_batch=dialect == "sqlite",
+        compare_type=True,
+        **kwargs
+    )
+
+
+def run_migrations_offline():
+    url = _url()
+    _configure(url.split(":", 1)[0].split("+", 1)[0], url=url, literal_binds=True,
+               dialect_opts={"paramstyle": "named"})
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        _configure(connection.dialect.name, connection=connection)
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+
+    url = config.get_main_option("sqlalchemy.url")
+    engine = create_engine(url, future=True) if url else database.engine
+    with engine.connect() as connection:
+        _configure(connection.dialect.name, connection=connection)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,183 @@
+"""Baseline schema
+
+Creates every table as it stood before migrations were introduced. Databases
+created by the old create_all + ALTER TABLE startup code are adopted in place:
+existing tables only get their missing columns and indexes.
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-19
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001_baseline"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# Backfill for columns the old startup code added to populated tables
+LEGACY_DEFAULTS = {
+    ("sms_campaigns", "status"): sa.text("'done'"),
+    ("sms_messages", "attempts"): sa.text("0"),
+}
+
+
+def _tables(metadata):
+    return [
+        sa.Table(
+            "datasets", metadata,
+            sa.Column("id", sa.String, primary_key=True),
+            sa.Column("patients_path", sa.String, nullable=False),
+            sa.Column("competitors_path", sa.String, nullable=True),
+            sa.Column("practice_zip", sa.String, nullable=False),
+            sa.Column("vertical", sa.String),
+            sa.Column("created_at", sa.DateTime),
+            sa.Column("patient_count", sa.Integer),
+            sa.Column("dominant_profile", sa.JSON),
+            sa.Column("unique_zips", sa.Integer),
+            sa.Column("detected_vertical", sa.String),
+        ),
+        sa.Table(
+            "analysis_runs", metadata,
+            sa.Column("id", sa.String, primary_key=True),
+            sa.Column("dataset_id", sa.String, nullable=False),
+            sa.Column("status", sa.String),
+            sa.Column("focus", sa.String),
+            sa.Column("created_at", sa.DateTime),
+            sa.Column("completed_at", sa.DateTime, nullable=True),
+            sa.Column("error_message", sa.Text, nullable=True),
+            sa.Column("headline_metrics", sa.JSON, nullable=True),
+            sa.Column("top_segments", sa.JSON, nullable=True),
+            sa.Column("map_points", sa.JSON, nullable=True),
+            sa.Column("confidence_info", sa.JSON, nullable=True),
+            sa.Column("procedure", sa.String, nullable=True),
+            sa.Column("patient_count", sa.Integer, nullable=True),
+            sa.Column("dominant_profile", sa.JSON, nullable=True),
+            sa.Column("strategic_insights", sa.JSON, nullable=True),
+            sa.Column("filtered_dataset_path", sa.String, nullable=True),
+        ),
+        sa.Table(
+            "patient_outreach", metadata,
+            sa.Column("id", sa.String, primary_key=True),
+            sa.Column("run_id", sa.String, nullable=False),
+            sa.Column("patient_id", sa.String, nullable=False),
+            sa.Column("segment", sa.String, nullable=True),
+            sa.Column("campaign_name", sa.String, nullable=True),
+            sa.Column("contacted_at", sa.DateTime, nullable=True),
+            sa.Column("returned_at", sa.DateTime, nullable=True),
+            sa.Column("revenue_recovered", sa.Float, nullable=True),
+            sa.Column("days_stale_when_contacted", sa.Integer, nullable=True),
+            sa.Column("outcome", sa.String, nullable=True),
+            sa.Column("loan_amount", sa.Float, nullable=True),
+            sa.Column("commission", sa.Float, nullable=True),
+            sa.Index("ix_patient_outreach_run_patient", "run_id", "patient_id"),
+        ),
+        sa.Table(
+            "winback_templates", metadata,
+            sa.Column("id", sa.String, primary_key=True),
+            sa.Column("treatment", sa.String, nullable=False),
+            sa.Column("template_type", sa.String, nullable=False),
+            sa.Column("subject", sa.String, nullable=True),
+            sa.Column("body", sa.Text, nullable=False),
+            sa.Column("times_used", sa.Integer),
+            sa.Column("times_converted", sa.Integer),
+            sa.Column("created_at", sa.DateTime),
+        ),
+        sa.Table(
+            "sms_campaigns", metadata,
+            sa.Column("id", sa.String, primary_key=True),
+            sa.Column("run_id", sa.String, nullable=True),
+            sa.Column("name", sa.String, nullable=True),
+            sa.Column("segment", sa.String, nullable=True),
+            sa.Column("message_template", sa.Text, nullable=False),
+            sa.Column("total_recipients", sa.Integer),
+            sa.Column("sent_count", sa.Integer),
+            sa.Column("delivered_count", sa.Integer),
+            sa.Column("failed_count", sa.Integer),
+            sa.Column("clicks", sa.Integer),
+            sa.Column("responses", sa.Integer),
+            sa.Column("conversions", sa.Integer),
+            sa.Column("status", sa.String),
+            sa.Column("created_at", sa.DateTime),
+            sa.Column("sent_at", sa.DateTime, nullable=True),
+        ),
+        sa.Table(
+            "sms_messages", metadata,
+            sa.Column("id", sa.String, primary_key=True),
+            sa.Column("campaign_id", sa.String, nullable=False),
+            sa.Column("twilio_sid", sa.String, nullable=True),
+            sa.Column("patient_id", sa.String, nullable=True),
+            sa.Column("patient_name", sa.String, nullable=True),
+            sa.Column("phone_number", sa.String, nullable=False),
+            sa.Column("recipient_key", sa.String, nullable=True),
+            sa.Column("message_body", sa.Text, nullable=False),
+            sa.Column("status", sa.String),
+            sa.Column("error_code", sa.String, nullable=True),
+            sa.Column("error_message", sa.Text, nullable=True),
+            sa.Column("attempts", sa.Integer),
+            sa.Column("dispatch_token", sa.String, nullable=True),
+            sa.Column("claimed_at", sa.DateTime, nullable=True),
+            sa.Column("created_at", sa.DateTime),
+            sa.Column("sent_at", sa.DateTime, nullable=True),
+            sa.Column("delivered_at", sa.DateTime, nullable=True),
+            sa.Index("uq_sms_messages_campaign_recipient", "campaign_id", "recipient_key", unique=True),
+            sa.Index("ix_sms_messages_status", "status"),
+            sa.Index("ix_sms_messages_twilio_sid", "twilio_sid"),
+        ),
+        sa.Table(
+            "churn_score_runs", metadata,
+            sa.Column("run_id", sa.String, primary_key=True),
+            sa.Column("reference_date", sa.Date, nullable=False),
+            sa.Column("procedure_intervals", sa.JSON, nullable=True),
+            sa.Column("patient_count", sa.Integer),
+            sa.Column("scored_at", sa.DateTime),
+            sa.Column("rescored_at", sa.DateTime, nullable=True),
+        ),
+        sa.Table(
+            "patient_churn_scores", metadata,
+            sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+            sa.Column("run_id", sa.String, nullable=False, index=True),
+            sa.Column("patient_id", sa.String, nullable=True),
+            sa.Column("procedure", sa.String, nullable=True),
+            sa.Column("last_visit", sa.DateTime, nullable=True),
+            sa.Column("visit_number", sa.Integer, nullable=True),
+            sa.Column("expected_interval", sa.Float, nullable=False),
+            sa.Column("days_since_visit", sa.Integer, nullable=False),
+            sa.Column("days_overdue", sa.Float, nullable=False),
+            sa.Column("overdue_ratio", sa.Float, nullable=False),
+            sa.Column("risk_level", sa.String, nullable=False),
+            sa.Column("risk_score", sa.Integer, nullable=False),
+        ),
+    ]
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+
+    for table in _tables(sa.MetaData()):
+        if table.name not in existing_tables:
+            table.create(bind)
+            continue
+
+        present = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in present:
+                op.add_column(table.name, sa.Column(
+                    column.name, column.type, nullable=True,
+                    server_default=LEGACY_DEFAULTS.get((table.name, column.name))
+                ))
+                print(f"[DB] Added {column.name} column to {table.name}")
+
+        present_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in present_indexes:
+                op.create_index(index.name, table.name, [c.name for c in index.columns], unique=index.unique)
+
+
+def downgrade():
+    for table in reversed(_tables(sa.MetaData())):
+        op.drop_table(table.name)
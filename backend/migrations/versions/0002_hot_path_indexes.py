@@ -0,0 +1,43 @@
+"""Indexes for hot query paths
+
+- patient_outreach: pending-return scans (per run and across runs), patient
+  lookups across runs, and the per-segment performance rollup
+- sms_messages: per-campaign progress / outbox claims
+- sms_campaigns: campaign list per run
+- analysis_runs: runs per dataset
+- winback_templates: template lookup by treatment and type
+
+Revision ID: 0002_hot_path_indexes
+Revises: 0001_baseline
+Create Date: 2026-10-19
+"""
+
+from alembic import op
+
+revision = "0002_hot_path_indexes"
+down_revision = "0001_baseline"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_patient_outreach_run_pending", "patient_outreach", ["run_id", "returned_at", "contacted_at"]),
+    ("ix_patient_outreach_pending", "patient_outreach", ["returned_at", "contacted_at"]),
+    ("ix_patient_outreach_patient", "patient_outreach", ["patient_id"]),
+    # Covering, so the segment rollup never touches the table
+    ("ix_patient_outreach_segment_rollup", "patient_outreach",
+     ["segment", "contacted_at", "returned_at", "revenue_recovered"]),
+    ("ix_sms_messages_campaign_status", "sms_messages", ["campaign_id", "status"]),
+    ("ix_sms_campaigns_run_created", "sms_campaigns", ["run_id", "created_at"]),
+    ("ix_analysis_runs_dataset_created", "analysis_runs", ["dataset_id", "created_at"]),
+    ("ix_winback_templates_treatment_type", "winback_templates", ["treatment", "template_type", "created_at"]),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, if_not_exists=True)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
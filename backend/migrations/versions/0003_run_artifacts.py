@@ -0,0 +1,89 @@
+"""Move large AnalysisRun JSON blobs to analysis_run_artifacts
+
+top_segments, map_points, dominant_profile and strategic_insights are copied
+into the new side table as zlib-compressed JSON, then dropped from
+analysis_runs so run lookups and status polling stay small.
+
+Revision ID: 0003_run_artifacts
+Revises: 0002_hot_path_indexes
+Create Date: 2026-10-19
+"""
+
+import json
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003_run_artifacts"
+down_revision = "0002_hot_path_indexes"
+branch_labels = None
+depends_on = None
+
+MOVED_COLUMNS = ("top_segments", "map_points", "dominant_profile", "strategic_insights")
+BATCH_SIZE = 200
+
+
+def _encode(value):
+    raw = json.dumps(value, separators=(",", ":"), default=str).encode("utf-8")
+    return zlib.compress(raw, 6), len(raw)
+
+
+def upgrade():
+    artifacts = op.create_table(
+        "analysis_run_artifacts",
+        sa.Column("run_id", sa.String, primary_key=True),
+        sa.Column("name", sa.String, primary_key=True),
+        sa.Column("encoding", sa.String, nullable=False),
+        sa.Column("payload", sa.LargeBinary, nullable=False),
+        sa.Column("raw_bytes", sa.Integer, nullable=True),
+        sa.Column("created_at", sa.DateTime),
+    )
+
+    bind = op.get_bind()
+    runs = sa.table("analysis_runs", sa.column("id", sa.String), sa.column("completed_at", sa.DateTime),
+                    *[sa.column(name, sa.JSON) for name in MOVED_COLUMNS])
+    last_id = ""
+    while True:
+        rows = bind.execute(
+            sa.select(runs).where(runs.c.id > last_id).order_by(runs.c.id).limit(BATCH_SIZE)
+        ).mappings().all()
+        if not rows:
+            break
+        inserts = []
+        for row in rows:
+            for name in MOVED_COLUMNS:
+                value = row[name]
+                if isinstance(value, str):
+                    # Some older rows were stored as JSON text
+                    try:
+                        value = json.loads(value)
+                    except ValueError:
+                        pass
+                if value is None:
+                    continue
+                payload, raw_bytes = _encode(value)
+                inserts.append({"run_id": row["id"], "name": name, "encoding": "json+zlib",
+                                "payload": payload, "raw_bytes": raw_bytes, "created_at": row["completed_at"]})
+        if inserts:
+            op.bulk_insert(artifacts, inserts)
+        last_id = rows[-1]["id"]
+
+    with op.batch_alter_table("analysis_runs") as batch:
+        for name in MOVED_COLUMNS:
+            batch.drop_column(name)
+
+
+def downgrade():
+    with op.batch_alter_table("analysis_runs") as batch:
+        for name in MOVED_COLUMNS:
+            batch.add_column(sa.Column(name, sa.JSON, nullable=True))
+
+    bind = op.get_bind()
+    runs = sa.table("analysis_runs", sa.column("id", sa.String), *[sa.column(name, sa.JSON) for name in MOVED_COLUMNS])
+    artifacts = sa.table("analysis_run_artifacts", sa.column("run_id", sa.String), sa.column("name", sa.String),
+                         sa.column("payload", sa.LargeBinary))
+    for run_id, name, payload in bind.execute(sa.select(artifacts.c.run_id, artifacts.c.name, artifacts.c.payload)):
+        if name in MOVED_COLUMNS:
+            bind.execute(runs.update().where(runs.c.id == run_id).values({name: json.loads(zlib.decompress(payload))}))
+    op.drop_table("analysis_run_artifacts")
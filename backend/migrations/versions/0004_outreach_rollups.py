@@ -0,0 +1,70 @@
+"""Incrementally maintained outreach rollups
+
+Creates outreach_rollups (counters per run, segment, contact day and
+staleness bucket) and backfills it from patient_outreach in one GROUP BY.
+
+Revision ID: 0004_outreach_rollups
+Revises: 0003_run_artifacts
+Create Date: 2026-10-19
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004_outreach_rollups"
+down_revision = "0003_run_artifacts"
+branch_labels = None
+depends_on = None
+
+MEASURES = ("contacted", "returned", "revenue", "with_outcome", "closed", "outcome_revenue")
+
+
+def upgrade():
+    rollups = op.create_table(
+        "outreach_rollups",
+        sa.Column("run_id", sa.String, primary_key=True),
+        sa.Column("segment", sa.String, primary_key=True),
+        sa.Column("day", sa.String, primary_key=True),
+        sa.Column("stale_bucket", sa.String, primary_key=True),
+        sa.Column("contacted", sa.Integer, nullable=False),
+        sa.Column("returned", sa.Integer, nullable=False),
+        sa.Column("revenue", sa.Float, nullable=False),
+        sa.Column("with_outcome", sa.Integer, nullable=False),
+        sa.Column("closed", sa.Integer, nullable=False),
+        sa.Column("outcome_revenue", sa.Float, nullable=False),
+        sa.Column("updated_at", sa.DateTime),
+    )
+
+    outreach = sa.table(
+        "patient_outreach", sa.column("run_id", sa.String), sa.column("segment", sa.String),
+        sa.column("contacted_at", sa.DateTime), sa.column("returned_at", sa.DateTime),
+        sa.column("outcome", sa.String), sa.column("revenue_recovered", sa.Float),
+        sa.column("days_stale_when_contacted", sa.Integer),
+    )
+    contacted = outreach.c.contacted_at.isnot(None)
+    has_outcome = outreach.c.outcome.isnot(None)
+    revenue = sa.func.coalesce(outreach.c.revenue_recovered, 0.0)
+    days = outreach.c.days_stale_when_contacted
+    bucket = sa.case(
+        (days.is_(None), ""), (days < 7, "0-7 days"), (days < 30, "8-30 days"), (days < 60, "31-60 days"),
+        else_="60+ days"
+    )
+    day = sa.func.coalesce(sa.cast(sa.func.date(outreach.c.contacted_at), sa.String), "")
+    segment = sa.func.coalesce(outreach.c.segment, "")
+    backfill = sa.select(
+        outreach.c.run_id, segment, day, bucket,
+        sa.func.sum(sa.case((contacted, 1), else_=0)),
+        sa.func.sum(sa.case((contacted & outreach.c.returned_at.isnot(None), 1), else_=0)),
+        sa.func.sum(sa.case((contacted, revenue), else_=0.0)),
+        sa.func.sum(sa.case((has_outcome, 1), else_=0)),
+        sa.func.sum(sa.case((outreach.c.outcome == "closed", 1), else_=0)),
+        sa.func.sum(sa.case((has_outcome, revenue), else_=0.0)),
+        sa.func.max(sa.func.current_timestamp()),
+    ).group_by(outreach.c.run_id, segment, day, bucket)
+    op.execute(rollups.insert().from_select(
+        ["run_id", "segment", "day", "stale_bucket", *MEASURES, "updated_at"], backfill
+    ))
+
+
+def downgrade():
+    op.drop_table("outreach_rollups")
@@ -0,0 +1,39 @@
+"""Persisted labeled patients per run
+
+run_patients holds each completed run's scored, labeled patients so the
+patient export streams from the table instead of re-scoring the upload.
+Existing runs are filled in on their first export.
+
+Revision ID: 0005_run_patients
+Revises: 0004_outreach_rollups
+Create Date: 2026-10-19
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005_run_patients"
+down_revision = "0004_outreach_rollups"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "run_patients",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("run_id", sa.String, nullable=False),
+        sa.Column("patient_id", sa.String, nullable=True),
+        sa.Column("zip_code", sa.String, nullable=True),
+        sa.Column("behavioral_segment", sa.String, nullable=True),
+        sa.Column("value_score", sa.Float, nullable=True),
+        sa.Column("cohort", sa.String, nullable=True),
+        sa.Column("revenue", sa.Float, nullable=True),
+        sa.Column("visits_per_year", sa.Float, nullable=True),
+    )
+    op.create_index("ix_run_patients_run_score", "run_patients", ["run_id", "value_score"])
+
+
+def downgrade():
+    op.drop_index("ix_run_patients_run_score", table_name="run_patients")
+    op.drop_table("run_patients")
@@ -0,0 +1,35 @@
+"""Hashed PII on run_patients for customer-match exports
+
+Adds the hashed email / phone columns and a (run, segment, score) index.
+Stored run_patients rows are cleared so each run is rebuilt, with hashes,
+on its next export.
+
+Revision ID: 0006_run_patient_hashes
+Revises: 0005_run_patients
+Create Date: 2026-10-19
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006_run_patient_hashes"
+down_revision = "0005_run_patients"
+branch_labels = None
+depends_on = None
+
+HASH_COLUMNS = ("email_sha256", "phone_sha256", "phone_e164_sha256")
+
+
+def upgrade():
+    op.execute("DELETE FROM run_patients")
+    with op.batch_alter_table("run_patients") as batch:
+        for name in HASH_COLUMNS:
+            batch.add_column(sa.Column(name, sa.String, nullable=True))
+    op.create_index("ix_run_patients_run_segment", "run_patients", ["run_id", "behavioral_segment", "value_score"])
+
+
+def downgrade():
+    op.drop_index("ix_run_patients_run_segment", table_name="run_patients")
+    with op.batch_alter_table("run_patients") as batch:
+        for name in HASH_COLUMNS:
+            batch.drop_column(name)
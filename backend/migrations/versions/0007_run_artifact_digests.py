@@ -0,0 +1,52 @@
+"""Content digests on analysis_run_artifacts
+
+Adds a sha256 digest of each artifact's uncompressed JSON, used to build the
+ETags of completed runs, and backfills it for existing artifacts.
+
+Revision ID: 0007_run_artifact_digests
+Revises: 0006_run_patient_hashes
+Create Date: 2026-10-19
+"""
+
+import hashlib
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007_run_artifact_digests"
+down_revision = "0006_run_patient_hashes"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 200
+
+
+def upgrade():
+    with op.batch_alter_table("analysis_run_artifacts") as batch:
+        batch.add_column(sa.Column("digest", sa.String, nullable=True))
+
+    bind = op.get_bind()
+    artifacts = sa.table("analysis_run_artifacts", sa.column("run_id", sa.String), sa.column("name", sa.String),
+                         sa.column("payload", sa.LargeBinary), sa.column("digest", sa.String))
+    last_key = ("", "")
+    while True:
+        rows = bind.execute(
+            sa.select(artifacts.c.run_id, artifacts.c.name, artifacts.c.payload)
+            .where(sa.tuple_(artifacts.c.run_id, artifacts.c.name) > last_key)
+            .order_by(artifacts.c.run_id, artifacts.c.name).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        for run_id, name, payload in rows:
+            bind.execute(
+                artifacts.update()
+                .where(artifacts.c.run_id == run_id, artifacts.c.name == name)
+                .values(digest=hashlib.sha256(zlib.decompress(payload)).hexdigest())
+            )
+        last_key = (rows[-1][0], rows[-1][1])
+
+
+def downgrade():
+    with op.batch_alter_table("analysis_run_artifacts") as batch:
+        batch.drop_column("digest")
@@ -0,0 +1,29 @@
+"""Heartbeat on claimed SMS outbox rows
+
+A worker refreshes heartbeat_at on the rows it has claimed while it sends
+them, and only claims whose heartbeat has gone quiet are re-queued. Existing
+claims start from their claimed_at.
+
+Revision ID: 0008_sms_claim_heartbeat
+Revises: 0007_run_artifact_digests
+Create Date: 2026-10-19
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008_sms_claim_heartbeat"
+down_revision = "0007_run_artifact_digests"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("sms_messages") as batch:
+        batch.add_column(sa.Column("heartbeat_at", sa.DateTime, nullable=True))
+    op.execute("UPDATE sms_messages SET heartbeat_at = claimed_at WHERE status = 'sending'")
+
+
+def downgrade():
+    with op.batch_alter_table("sms_messages") as batch:
+        batch.drop_column("heartbeat_at")
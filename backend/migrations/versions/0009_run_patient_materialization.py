@@ -0,0 +1,45 @@
+"""Record run patient materialization on analysis_runs
+
+run_patient_count marks a run whose patients were persisted (even when it
+has none), and run_patient_columns keeps the export columns its upload had
+data for. Runs already in run_patients are backfilled with the full column
+set they were exported with so far.
+
+Revision ID: 0009_run_patient_materialization
+Revises: 0008_sms_claim_heartbeat
+Create Date: 2026-10-19
+"""
+
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009_run_patient_materialization"
+down_revision = "0008_sms_claim_heartbeat"
+branch_labels = None
+depends_on = None
+
+EXPORTED_COLUMNS = ["patient_id", "zip_code", "behavioral_segment", "value_score", "cohort",
+                    "revenue", "visits_per_year"]
+
+
+def upgrade():
+    with op.batch_alter_table("analysis_runs") as batch:
+        batch.add_column(sa.Column("run_patient_count", sa.Integer, nullable=True))
+        batch.add_column(sa.Column("run_patient_columns", sa.JSON, nullable=True))
+    op.get_bind().execute(
+        sa.text(
+            "UPDATE analysis_runs SET "
+            "run_patient_count = (SELECT COUNT(*) FROM run_patients WHERE run_patients.run_id = analysis_runs.id), "
+            "run_patient_columns = :columns "
+            "WHERE EXISTS (SELECT 1 FROM run_patients WHERE run_patients.run_id = analysis_runs.id)"
+        ),
+        {"columns": json.dumps(EXPORTED_COLUMNS)},
+    )
+
+
+def downgrade():
+    with op.batch_alter_table("analysis_runs") as batch:
+        batch.drop_column("run_patient_columns")
+        batch.drop_column("run_patient_count")
@@ -4,6 +4,7 @@ from typing import Optional, List, Dict, Any
 import pandas as pd
 import tempfile
 import os
+from services.json_response import ORJSONResponse
 from services.provider_analysis import analyze_provider_concentration
 
 router = APIRouter(prefix="/api", tags=["patient-intel"])
@@ -85,7 +86,7 @@ async def analyze_patient_intelligence(request: PatientIntelRequest) -> Dict[str
         os.unlink(temp_path)
 
         # Transform to Patient Intelligence format
-        return transform_to_patient_intel_format(result, df)
+        return ORJSONResponse(transform_to_patient_intel_format(result, df))
 
     except Exception as e:
         import traceback
@@ -565,7 +566,7 @@ async def get_patient_intel_by_dataset(dataset_id: str) -> Dict[str, Any]:
             raise HTTPException(status_code=400, detail={"errors": errors})
 
         # Run the patient intel analysis
-        return await analyze_patient_intel_from_df(patients_df)
+        return ORJSONResponse(await analyze_patient_intel_from_df(patients_df))
 
     finally:
         db.close()
@@ -727,7 +728,7 @@ async def filter_patients_by_criteria(
         # Extract patient list with enriched data
         patients = extract_patient_list(filtered_df, max_patients=1000)
 
-        return {
+        return ORJSONResponse({
             "total_patients": len(patients),
             "patients": patients,
             "filters_applied": {
@@ -736,7 +737,7 @@ async def filter_patients_by_criteria(
                 "procedures": filter_request.procedures or [],
                 "min_revenue": filter_request.min_revenue
             }
-        }
+        })
 
     finally:
         db.close()
@@ -1,7 +1,8 @@
 # /backend/services/campaign_generator.py
-from anthropic import Anthropic
-import os
+import asyncio
 import json
+from services.llm_cache import get_llm_cache, make_payload_key
+from services.llm_client import DEFAULT_MODEL, complete, parse_llm_json
 
 # Shared cohort psychology used across all channels
 COHORT_PSYCHOLOGY = {
@@ -27,31 +28,28 @@ COHORT_PSYCHOLOGY = {
     }
 }
 
-def _get_client():
-    return Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-
 def _get_cohort_info(cohort: str):
     return COHORT_PSYCHOLOGY.get(cohort, COHORT_PSYCHOLOGY["Comfort Spenders"])
 
-def _call_llm(prompt: str, context: str):
+def parse_campaign_batch(response_text: str) -> list:
+    """The "campaigns" list of a batch completion; raises if there isn't one"""
+    campaigns = parse_llm_json(response_text).get("campaigns")
+    if not isinstance(campaigns, list):
+        raise ValueError("Batch response has no campaigns list")
+    return campaigns
+
+async def _call_llm(prompt: str, context: str):
     """Shared LLM call with error handling"""
     try:
-        client = _get_client()
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=1024,
-            temperature=0.7,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        response_text = message.content[0].text
-        response_text = response_text.replace("```json", "").replace("```", "").strip()
-        return json.loads(response_text)
+        response_text = await complete(prompt, max_tokens=1024, temperature=0.7, model=DEFAULT_MODEL,
+                                       validate=parse_llm_json)
+        return parse_llm_json(response_text)
     except Exception as e:
         print(f"[LLM ERROR] {context} failed: {e}")
         return None
 
 
-def generate_campaign_content(cohort: str, zip_code: str, competitors: int, reasons: list, match_score: float, procedure: str = None, vertical: str = None):
+async def generate_campaign_content(cohort: str, zip_code: str, competitors: int, reasons: list, match_score: float, procedure: str = None, vertical: str = None):
     """Generate Facebook/Instagram ad content"""
     
     cohort_info = _get_cohort_info(cohort)
@@ -94,12 +92,18 @@ Return ONLY valid JSON with this exact structure (no markdown, no explanation):
 }}"""
 
     print(f"[LLM] Generating ad campaign for {cohort} in {zip_code}...")
-    result = _call_llm(prompt, "Ad campaign generation")
+    result = await _call_llm(prompt, "Ad campaign generation")
     
     if result:
         print(f"[LLM] Ad campaign generated successfully for {cohort}")
         return result
     
+    return campaign_content_fallback(cohort, procedure)
+
+
+def campaign_content_fallback(cohort: str, procedure: str = None):
+    """Template ad content used when the LLM is unavailable"""
+    procedure_text = procedure if procedure and procedure != "all" else "aesthetic treatments"
     return {
         "adCopy": [
             {"headline": f"Expert {procedure_text} in Your Area", "description": f"Professional {procedure_text} from experienced specialists. Book your free consultation today."},
@@ -118,8 +122,155 @@ Return ONLY valid JSON with this exact structure (no markdown, no explanation):
     }
 
 
-def generate_email_sequence(cohort: str, procedure: str = None, sequence_type: str = "nurture", vertical: str = None):
-    """Generate email sequence for patient nurturing or re-engagement"""
+# ZIPs per model call in batch generation; larger batches risk truncated JSON
+CAMPAIGN_BATCH_SIZE = 5
+CAMPAIGN_TOKENS_PER_ZIP = 700
+
+
+def _campaign_cache_key(segment: dict, procedure: str = None, vertical: str = None):
+    return make_payload_key("campaign-zip-v1", {
+        "cohort": segment["cohort"],
+        "zip_code": str(segment["zip_code"]),
+        "competitors": segment.get("competitors", 0),
+        "reasons": list(segment.get("reasons") or []),
+        "match_score": round(float(segment.get("match_score", 0)), 4),
+        "procedure": procedure,
+        "vertical": vertical,
+    })
+
+
+def campaign_batch_prompt(cohort: str, segments: list, procedure: str = None, vertical: str = None):
+    """One prompt covering several ZIPs that share a cohort and procedure"""
+    
+    cohort_info = _get_cohort_info(cohort)
+    procedure_text = procedure if procedure and procedure != "all" else "aesthetic treatments"
+    
+    from services.verticals import get_prompt_context
+    vertical_context = get_prompt_context(vertical if vertical else "medspa")
+    
+    zip_lines = "\n".join(
+        f"- ZIP {seg['zip_code']}: {seg.get('competitors', 0)} competitors, match score {float(seg.get('match_score', 0)):.1%}, "
+        f"key advantages: {', '.join(seg.get('reasons') or []) or 'Quality service, experienced staff'}"
+        for seg in segments
+    )
+    
+    return f"""Create Facebook ad content targeting {cohort} customers in each of these ZIP codes.
+
+{vertical_context}
+
+COHORT PSYCHOLOGY:
+- Primary concerns: {cohort_info['concerns']}
+- Key motivators: {cohort_info['motivators']}
+- Tone: {cohort_info['tone']}
+
+PROCEDURE FOCUS: {procedure_text}
+
+MARKET CONTEXT BY ZIP:
+{zip_lines}
+
+Tailor each ZIP's copy to its own market context.
+
+Return ONLY valid JSON with this exact structure (no markdown, no explanation), one entry per ZIP:
+{{
+  "campaigns": [
+    {{
+      "zip_code": "ZIP code exactly as given",
+      "adCopy": [
+        {{"headline": "5-8 word headline", "description": "2-3 sentence description"}},
+        {{"headline": "5-8 word headline", "description": "2-3 sentence description"}},
+        {{"headline": "5-8 word headline", "description": "2-3 sentence description"}}
+      ],
+      "creativeSuggestions": {{
+        "images": ["image idea 1", "image idea 2", "image idea 3"],
+        "videos": ["video idea 1", "video idea 2", "video idea 3"],
+        "hooks": ["hook 1", "hook 2", "hook 3"]
+      }},
+      "creativeDirection": {{
+        "photography": "photography style recommendation",
+        "video": "video style recommendation"
+      }}
+    }}
+  ]
+}}"""
+
+
+async def _generate_campaign_chunk(cohort: str, segments: list, procedure: str = None, vertical: str = None):
+    """One model call for up to CAMPAIGN_BATCH_SIZE ZIPs; returns {zip_code: content} for the ZIPs it covered"""
+    prompt = campaign_batch_prompt(cohort, segments, procedure, vertical)
+    max_tokens = CAMPAIGN_TOKENS_PER_ZIP * len(segments) + 200
+    try:
+        # Each ZIP is cached on its own by the caller; the whole chunk reply never recurs
+        response_text = await complete(prompt, max_tokens=max_tokens, temperature=0.7, model=DEFAULT_MODEL,
+                                       use_cache=False)
+        campaigns = parse_campaign_batch(response_text)
+    except Exception as e:
+        print(f"[LLM ERROR] Batch ad campaign generation ({cohort}, {len(segments)} ZIPs) failed: {e}")
+        return {}
+    
+    wanted = {str(seg["zip_code"]) for seg in segments}
+    content = {}
+    for item in campaigns:
+        zip_code = str(item.pop("zip_code", ""))
+        if zip_code in wanted and item.get("adCopy"):
+            content[zip_code] = item
+    return content
+
+
+async def generate_campaign_content_batch(segments: list, procedure: str = None, vertical: str = None):
+    """
+    Generate Facebook/Instagram ad content for many top segments at once.
+    
+    segments: dicts with cohort, zip_code, competitors, reasons, match_score and
+    optionally procedure (defaults to the batch-level procedure).
+    Segments are grouped by (cohort, procedure) and sent CAMPAIGN_BATCH_SIZE ZIPs per call,
+    all calls concurrently. Each ZIP's content is cached on its own, so a later
+    batch with overlapping segments only pays for ZIPs it hasn't seen.
+    Returns one {"zip_code", "cohort", "source", ...content} per input segment, in order.
+    """
+    cache = get_llm_cache()
+    results = [None] * len(segments)
+    pending = {}  # (cohort, procedure) -> [(index, segment, cache_key)]
+    
+    for i, seg in enumerate(segments):
+        seg_procedure = seg.get("procedure") or procedure
+        key = _campaign_cache_key(seg, seg_procedure, vertical)
+        cached = await cache.get(key) if cache is not None else None
+        if cached is not None:
+            results[i] = {**json.loads(cached), "source": "cache"}
+        else:
+            pending.setdefault((seg["cohort"], seg_procedure), []).append((i, seg, key))
+    
+    chunks = []
+    for group, items in pending.items():
+        for start in range(0, len(items), CAMPAIGN_BATCH_SIZE):
+            chunks.append((group, items[start:start + CAMPAIGN_BATCH_SIZE]))
+    
+    print(f"[LLM] Batch ad campaigns: {len(segments)} segments, "
+          f"{len(segments) - sum(len(items) for items in pending.values())} cached, {len(chunks)} model calls")
+    
+    generated = await asyncio.gather(*[
+        _generate_campaign_chunk(cohort, [seg for _, seg, _ in items], seg_procedure, vertical)
+        for (cohort, seg_procedure), items in chunks
+    ])
+    
+    for ((cohort, seg_procedure), items), content in zip(chunks, generated):
+        for i, seg, key in items:
+            item = content.get(str(seg["zip_code"]))
+            if item is None:
+                results[i] = {**campaign_content_fallback(cohort, seg_procedure), "source": "fallback"}
+                continue
+            if cache is not None:
+                await cache.set(key, json.dumps(item))
+            results[i] = {**item, "source": "llm"}
+    
+    return [
+        {"zip_code": str(seg["zip_code"]), "cohort": seg["cohort"], **result}
+        for seg, result in zip(segments, results)
+    ]
+
+
+def email_sequence_prompt(cohort: str, procedure: str = None, sequence_type: str = "nurture", vertical: str = None):
+    """Prompt for an email sequence (shared by the JSON and streaming endpoints)"""
     
     cohort_info = _get_cohort_info(cohort)
     procedure_text = procedure if procedure and procedure != "all" else "aesthetic treatments"
@@ -183,14 +334,27 @@ Return ONLY valid JSON with this exact structure (no markdown, no explanation):
   ],
   "sequence_strategy": "1-2 sentence explanation of the psychological progression across emails"
 }}"""
+    return prompt
+
+
+async def generate_email_sequence(cohort: str, procedure: str = None, sequence_type: str = "nurture", vertical: str = None):
+    """Generate email sequence for patient nurturing or re-engagement"""
+    
+    prompt = email_sequence_prompt(cohort, procedure, sequence_type, vertical)
 
     print(f"[LLM] Generating {sequence_type} email sequence for {cohort}...")
-    result = _call_llm(prompt, f"Email sequence ({sequence_type})")
+    result = await _call_llm(prompt, f"Email sequence ({sequence_type})")
     
     if result:
         print("[LLM] Email sequence generated successfully")
         return result
     
+    return email_sequence_fallback(procedure)
+
+
+def email_sequence_fallback(procedure: str = None):
+    """Template sequence used when the LLM is unavailable"""
+    procedure_text = procedure if procedure and procedure != "all" else "aesthetic treatments"
     return {
         "sequence": [
             {
@@ -225,8 +389,8 @@ Return ONLY valid JSON with this exact structure (no markdown, no explanation):
     }
 
 
-def generate_sms_campaign(cohort: str, procedure: str = None, campaign_type: str = "appointment_reminder", vertical: str = None):
-    """Generate SMS messages for various campaign types"""
+def sms_campaign_prompt(cohort: str, procedure: str = None, campaign_type: str = "appointment_reminder", vertical: str = None):
+    """Prompt for SMS messages (shared by the JSON and streaming endpoints)"""
     
     cohort_info = _get_cohort_info(cohort)
     procedure_text = procedure if procedure and procedure != "all" else "your treatment"
@@ -286,16 +450,35 @@ Return ONLY valid JSON with this exact structure (no markdown, no explanation):
   "recommended_send_time": "best time to send this type of message",
   "compliance_note": "any compliance considerations for this message type"
 }}"""
+    return prompt
+
+
+def count_sms_characters(result: dict):
+    """Recompute character_count on each message (the model's counts are unreliable)"""
+    for msg in result.get("messages", []):
+        msg["character_count"] = len(msg.get("text", ""))
+    return result
+
+
+async def generate_sms_campaign(cohort: str, procedure: str = None, campaign_type: str = "appointment_reminder", vertical: str = None):
+    """Generate SMS messages for various campaign types"""
+    
+    prompt = sms_campaign_prompt(cohort, procedure, campaign_type, vertical)
 
     print(f"[LLM] Generating {campaign_type} SMS campaign for {cohort}...")
-    result = _call_llm(prompt, f"SMS campaign ({campaign_type})")
+    result = await _call_llm(prompt, f"SMS campaign ({campaign_type})")
     
     if result:
-        for msg in result.get("messages", []):
-            msg["character_count"] = len(msg.get("text", ""))
+        count_sms_characters(result)
         print("[LLM] SMS campaign generated successfully")
         return result
     
+    return sms_campaign_fallback(procedure)
+
+
+def sms_campaign_fallback(procedure: str = None):
+    """Template messages used when the LLM is unavailable"""
+    procedure_text = procedure if procedure and procedure != "all" else "your treatment"
     return {
         "messages": [
             {
@@ -3,20 +3,31 @@ Churn Risk Scoring for Audience Mirror
 Calculates patient-level churn risk based on actual visit patterns.
 """
 
-from datetime import datetime, date
+from datetime import date
 from typing import Optional
+import numpy as np
 import pandas as pd
 
 
-def calculate_procedure_intervals(df: pd.DataFrame) -> dict:
+def calculate_procedure_intervals(df: pd.DataFrame, visit_index: Optional[pd.DataFrame] = None) -> dict:
     """
     Calculate expected intervals from actual patient data.
     Uses median days_since_last_visit for repeat visitors per procedure.
+
+    When a visit index (services.visit_index.build_visit_index) is given, the
+    intervals are the real gaps between consecutive serviced visits, keyed by
+    the procedure of the return visit.
     """
     intervals = {}
+
+    if visit_index is not None:
+        returns = visit_index[visit_index["next_service_gap"] > 0]
+        if len(returns) > 0:
+            intervals = returns.groupby("next_service")["next_service_gap"].median().to_dict()
+            intervals["default"] = returns["next_service_gap"].median()
     
     # Only use repeat visitors (they have a real interval)
-    if "visit_number" in df.columns and "days_since_last_visit" in df.columns:
+    elif "visit_number" in df.columns and "days_since_last_visit" in df.columns:
         repeat_visitors = df[(df["visit_number"] > 1) & (df["days_since_last_visit"] > 0)].copy()
         
         if len(repeat_visitors) > 0:
@@ -39,6 +50,128 @@ def calculate_procedure_intervals(df: pd.DataFrame) -> dict:
     return intervals
 
 
+# (upper bound on overdue ratio, risk level, risk score); anything beyond is critical
+RISK_THRESHOLDS = [
+    (1.0, "on_schedule", 0),
+    (1.3, "low", 25),
+    (1.6, "medium", 50),
+    (2.0, "high", 75),
+]
+CRITICAL_RISK = ("critical", 100)
+
+
+def _parse_encounter_dates(values) -> pd.Series:
+    """
+    Parse encounter dates column-wise, mirroring the scalar rules:
+    strings must be YYYY-MM-DD, datetime/date objects are used as-is,
+    anything unparseable becomes NaT (treated as the reference date).
+    """
+    raw = pd.Series(values).reset_index(drop=True)
+
+    if pd.api.types.is_datetime64_any_dtype(raw):
+        parsed = raw
+    elif pd.api.types.is_string_dtype(raw) and not pd.api.types.is_object_dtype(raw):
+        parsed = pd.to_datetime(raw, format="%Y-%m-%d", errors="coerce")
+    else:
+        is_str = raw.map(type) == str
+        parsed = pd.to_datetime(raw.where(is_str), format="%Y-%m-%d", errors="coerce")
+        is_date = raw.map(lambda v: isinstance(v, date))
+        if is_date.any():
+            other_parsed = pd.to_datetime(raw.where(is_date), errors="coerce")
+            parsed = parsed.where(is_str, other_parsed)
+
+    if getattr(parsed.dt, "tz", None) is not None:
+        parsed = parsed.dt.tz_localize(None)
+    return parsed.dt.normalize()
+
+
+def _round2(values: np.ndarray) -> np.ndarray:
+    """np.round to 2 places, deferring near-ties to Python round() so results match the scalar path."""
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for i in np.flatnonzero(near_tie):
+        rounded[i] = round(float(values[i]), 2)
+    return rounded
+
+
+def score_churn_arrays(
+    encounter_dates,
+    procedures,
+    visit_numbers=None,
+    days_since_last_visit=None,
+    procedure_intervals: dict = None,
+    reference_date: Optional[date] = None
+) -> pd.DataFrame:
+    """
+    Vectorized churn scoring over whole columns.
+    Returns one row per input with risk_level, risk_score, days_since_visit,
+    days_overdue, expected_interval and overdue_ratio (same rules as
+    calculate_churn_risk).
+    """
+    if reference_date is None:
+        reference_date = date.today()
+    ref = pd.Timestamp(reference_date).normalize()
+
+    procedures = pd.Series(procedures).reset_index(drop=True)
+    n = len(procedures)
+
+    encounter = _parse_encounter_dates(encounter_dates)
+    days_since = (ref - encounter).dt.days.fillna(0).astype("int64").to_numpy()
+
+    if visit_numbers is None:
+        visit_numbers = np.ones(n)
+    if days_since_last_visit is None:
+        days_since_last_visit = np.zeros(n)
+    visit_numbers = pd.to_numeric(pd.Series(visit_numbers).reset_index(drop=True), errors="coerce").to_numpy(dtype=float)
+    last_gap = pd.to_numeric(pd.Series(days_since_last_visit).reset_index(drop=True), errors="coerce").to_numpy(dtype=float)
+
+    # Get expected interval from data (or use patient's own pattern)
+    if procedure_intervals:
+        fallback = procedure_intervals.get("default", 90)
+        expected = pd.to_numeric(procedures.map(procedure_intervals)).fillna(fallback).to_numpy()
+        # Keep integer intervals integral, as the scalar lookup would
+        if all(isinstance(v, (int, np.integer)) for v in list(procedure_intervals.values()) + [fallback]):
+            expected = expected.astype("int64")
+    else:
+        expected = np.full(n, 90)
+
+    # For patients with visit history, blend with their actual pattern
+    # (60% weight on patient's own pattern, 40% on procedure average)
+    blend = (visit_numbers > 1) & (last_gap > 0)
+    blended = np.trunc(0.4 * expected + 0.6 * np.where(blend, last_gap, 0)).astype("int64")
+    expected = np.where(blend, blended, expected)
+
+    return bucket_churn_risk(days_since, expected)
+
+
+def bucket_churn_risk(days_since, expected_interval) -> pd.DataFrame:
+    """
+    Overdue ratio and risk bucket from days since visit and expected interval.
+    Shared by the full scorer and the incremental rescoring job.
+    """
+    days_since = np.asarray(days_since)
+    expected = np.asarray(expected_interval)
+
+    # Calculate overdue ratio
+    with np.errstate(divide="ignore", invalid="ignore"):
+        overdue_ratio = np.where(expected > 0, days_since / np.where(expected > 0, expected, 1), 0.0)
+
+    # Risk thresholds
+    conditions = [overdue_ratio < upper for upper, _, _ in RISK_THRESHOLDS]
+    risk_level = np.select(conditions, [level for _, level, _ in RISK_THRESHOLDS], default=CRITICAL_RISK[0])
+    risk_score = np.select(conditions, [score for _, _, score in RISK_THRESHOLDS], default=CRITICAL_RISK[1])
+
+    return pd.DataFrame({
+        "risk_level": risk_level.astype(object),
+        "risk_score": risk_score.astype("int64"),
+        "days_since_visit": days_since,
+        "days_overdue": days_since - expected,
+        "expected_interval": expected,
+        "overdue_ratio": _round2(overdue_ratio.astype(float)),
+    })
+
+
 def calculate_churn_risk(
     encounter_date,
     procedure: str,
@@ -50,64 +183,57 @@ def calculate_churn_risk(
     """
     Calculate churn risk for a single patient.
     Uses data-driven intervals when available.
+    Thin wrapper around score_churn_arrays.
     """
-    if reference_date is None:
-        reference_date = date.today()
-    
-    # Parse encounter date
-    if isinstance(encounter_date, str):
-        try:
-            encounter = datetime.strptime(encounter_date, "%Y-%m-%d").date()
-        except:
-            encounter = reference_date
-    elif isinstance(encounter_date, datetime):
-        encounter = encounter_date.date()
-    elif isinstance(encounter_date, date):
-        encounter = encounter_date
-    else:
-        encounter = reference_date
-    
-    days_since = (reference_date - encounter).days
-    
-    # Get expected interval from data (or use patient's own pattern)
-    if procedure_intervals and procedure in procedure_intervals:
-        expected_interval = procedure_intervals[procedure]
-    elif procedure_intervals and "default" in procedure_intervals:
-        expected_interval = procedure_intervals["default"]
-    else:
-        expected_interval = 90  # Fallback
-    
-    # For patients with visit history, blend with their actual pattern
+    scored = score_churn_arrays(
+        pd.Series([encounter_date], dtype=object),
+        pd.Series([procedure], dtype=object),
+        [visit_number],
+        [days_since_last_visit],
+        procedure_intervals,
+        reference_date
+    )
+    scored = {col: values[0] for col, values in scored.to_dict("list").items()}
+
+    expected_interval = scored["expected_interval"]
     if visit_number > 1 and days_since_last_visit > 0:
-        # 60% weight on patient's own pattern, 40% on procedure average
-        expected_interval = int(0.4 * expected_interval + 0.6 * days_since_last_visit)
-    
-    # Calculate overdue ratio
-    overdue_ratio = days_since / expected_interval if expected_interval > 0 else 0
-    
-    # Risk thresholds
-    if overdue_ratio < 1.0:
-        risk_level, risk_score = "on_schedule", 0
-    elif overdue_ratio < 1.3:
-        risk_level, risk_score = "low", 25
-    elif overdue_ratio < 1.6:
-        risk_level, risk_score = "medium", 50
-    elif overdue_ratio < 2.0:
-        risk_level, risk_score = "high", 75
-    else:
-        risk_level, risk_score = "critical", 100
-    
+        expected_interval = int(expected_interval)
+    days_overdue = scored["days_since_visit"] - expected_interval
+
     return {
-        "risk_level": risk_level,
-        "risk_score": risk_score,
-        "days_since_visit": days_since,
-        "days_overdue": days_since - expected_interval,
+        "risk_level": scored["risk_level"],
+        "risk_score": scored["risk_score"],
+        "days_since_visit": scored["days_since_visit"],
+        "days_overdue": days_overdue,
         "expected_interval": expected_interval,
-        "overdue_ratio": round(overdue_ratio, 2),
+        "overdue_ratio": scored["overdue_ratio"],
     }
 
 
-def analyze_patient_churn(df: pd.DataFrame, reference_date: Optional[date] = None) -> pd.DataFrame:
+def _column(df: pd.DataFrame, name: str, default) -> pd.Series:
+    if name in df.columns:
+        return df[name].reset_index(drop=True)
+    return pd.Series([default] * len(df), dtype=object)
+
+
+def _encounter_column(df: pd.DataFrame) -> pd.Series:
+    """First non-empty of encounter_date / last_visit / visit_date per row."""
+    result = None
+    for col in ("encounter_date", "last_visit", "visit_date"):
+        if col not in df.columns:
+            continue
+        values = df[col].reset_index(drop=True)
+        if not pd.api.types.is_datetime64_any_dtype(values):
+            values = values.astype(object)
+            values = values.where(values != "")
+        result = values if result is None else result.where(result.notna(), values)
+    if result is None:
+        return pd.Series([None] * len(df), dtype=object)
+    return result
+
+
+def analyze_patient_churn(df: pd.DataFrame, reference_date: Optional[date] = None,
+                          procedure_intervals: Optional[dict] = None) -> pd.DataFrame:
     """
     Analyze churn risk for all patients in a DataFrame.
     Calculates procedure intervals from the data itself.
@@ -116,43 +242,44 @@ def analyze_patient_churn(df: pd.DataFrame, reference_date: Optional[date] = Non
         reference_date = date.today()
     
     # Calculate intervals from THIS dataset
-    procedure_intervals = calculate_procedure_intervals(df)
+    if procedure_intervals is None:
+        procedure_intervals = calculate_procedure_intervals(df)
     print(f"[CHURN] Calculated intervals from data: {procedure_intervals}")
-    
-    results = []
-    for _, row in df.iterrows():
-        # Find the encounter date column
-        enc_date = row.get("encounter_date") or row.get("last_visit") or row.get("visit_date")
-        proc = row.get("procedure", "default")
-        
-        risk = calculate_churn_risk(
-            encounter_date=enc_date,
-            procedure=proc,
-            visit_number=row.get("visit_number", 1),
-            days_since_last_visit=row.get("days_since_last_visit", 0),
-            procedure_intervals=procedure_intervals,
-            reference_date=reference_date
-        )
-        
-        results.append({
-            "patient_id": row.get("patient_id", ""),
-            "procedure": proc,
-            "last_visit": enc_date,
-            "visit_number": row.get("visit_number", 1),
-            **risk
-        })
-    
-    return pd.DataFrame(results)
 
+    enc_dates = _encounter_column(df)
+    procedures = _column(df, "procedure", "default")
+    visit_numbers = _column(df, "visit_number", 1)
 
-def get_churn_summary(df: pd.DataFrame, reference_date: Optional[date] = None) -> dict:
-    """
-    Get aggregate churn statistics for a patient cohort.
-    All intervals calculated from actual patient data.
-    """
-    churn_df = analyze_patient_churn(df, reference_date)
-    total = len(churn_df)
-    
+    risk = score_churn_arrays(
+        encounter_dates=enc_dates,
+        procedures=procedures,
+        visit_numbers=visit_numbers,
+        days_since_last_visit=_column(df, "days_since_last_visit", 0),
+        procedure_intervals=procedure_intervals,
+        reference_date=reference_date
+    )
+
+    meta = pd.DataFrame({
+        "patient_id": _column(df, "patient_id", ""),
+        "procedure": procedures,
+        "last_visit": enc_dates,
+        "visit_number": visit_numbers,
+    })
+    return pd.concat([meta, risk], axis=1)
+
+
+AT_RISK_LEVELS = ["medium", "high", "critical"]
+HIGH_RISK_LEVELS = ["high", "critical"]
+
+
+def build_churn_summary(
+    total: int,
+    risk_counts: dict,
+    avg_days_overdue: float,
+    high_risk_patients: list,
+    procedure_intervals: dict
+) -> dict:
+    """Shape churn aggregates into the summary payload served to the dashboard."""
     if total == 0:
         return {
             "total_patients": 0,
@@ -166,24 +293,9 @@ def get_churn_summary(df: pd.DataFrame, reference_date: Optional[date] = None) -
             "risk_distribution": {},
             "procedure_intervals": {}
         }
-    
-    # Count by risk level
-    risk_counts = churn_df["risk_level"].value_counts().to_dict()
-    
-    at_risk = risk_counts.get("medium", 0) + risk_counts.get("high", 0) + risk_counts.get("critical", 0)
-    
-    # Average days overdue for at-risk patients
-    at_risk_df = churn_df[churn_df["risk_level"].isin(["medium", "high", "critical"])]
-    avg_days_overdue = at_risk_df["days_overdue"].mean() if len(at_risk_df) > 0 else 0
-    
-    # Get highest-risk patients
-    high_risk_patients = churn_df[
-        churn_df["risk_level"].isin(["high", "critical"])
-    ].sort_values("risk_score", ascending=False).head(10).to_dict("records")
-    
-    # Include the calculated intervals for transparency
-    procedure_intervals = calculate_procedure_intervals(df)
-    
+
+    at_risk = sum(risk_counts.get(level, 0) for level in AT_RISK_LEVELS)
+
     return {
         "total_patients": total,
         "at_risk_count": at_risk,
@@ -200,4 +312,36 @@ def get_churn_summary(df: pd.DataFrame, reference_date: Optional[date] = None) -
             for level in ["critical", "high", "medium", "low", "on_schedule"]
         },
         "procedure_intervals": {k: round(v, 0) for k, v in procedure_intervals.items()}
-    }
\ No newline at end of file
+    }
+
+
+def summarize_churn(churn_df: pd.DataFrame, procedure_intervals: dict) -> dict:
+    """Summary statistics from an already-scored churn frame."""
+    total = len(churn_df)
+    if total == 0:
+        return build_churn_summary(0, {}, 0, [], {})
+
+    # Count by risk level
+    risk_counts = churn_df["risk_level"].value_counts().to_dict()
+
+    # Average days overdue for at-risk patients
+    at_risk_df = churn_df[churn_df["risk_level"].isin(AT_RISK_LEVELS)]
+    avg_days_overdue = at_risk_df["days_overdue"].mean() if len(at_risk_df) > 0 else 0
+
+    # Get highest-risk patients
+    high_risk_patients = churn_df[
+        churn_df["risk_level"].isin(HIGH_RISK_LEVELS)
+    ].sort_values("risk_score", ascending=False).head(10).to_dict("records")
+
+    return build_churn_summary(total, risk_counts, avg_days_overdue, high_risk_patients, procedure_intervals)
+
+
+def get_churn_summary(df: pd.DataFrame, reference_date: Optional[date] = None) -> dict:
+    """
+    Get aggregate churn statistics for a patient cohort.
+    All intervals calculated from actual patient data.
+    """
+    # Intervals are computed once and reused for scoring and for transparency
+    procedure_intervals = calculate_procedure_intervals(df)
+    churn_df = analyze_patient_churn(df, reference_date, procedure_intervals=procedure_intervals)
+    return summarize_churn(churn_df, procedure_intervals)
@@ -0,0 +1,211 @@
+"""
+Persisted churn scores for Audience Mirror.
+Scores are stored per run/patient with the date they are current as of, so the
+churn dashboard can be served from the table and advanced day by day without
+reloading visits.
+"""
+
+from datetime import date, datetime
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import case, delete, func, update
+from sqlalchemy.orm import Session
+
+from database import ChurnScoreRun, PatientChurnScore
+from services.churn_scoring import (
+    AT_RISK_LEVELS,
+    CRITICAL_RISK,
+    HIGH_RISK_LEVELS,
+    RISK_THRESHOLDS,
+    analyze_patient_churn,
+    build_churn_summary,
+    calculate_procedure_intervals,
+)
+
+
+def _to_optional(value, cast):
+    if value is None or (isinstance(value, float) and np.isnan(value)) or value is pd.NaT:
+        return None
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_datetime(value) -> Optional[datetime]:
+    ts = pd.to_datetime(value, errors="coerce")
+    if ts is None or pd.isna(ts):
+        return None
+    return ts.to_pydatetime()
+
+
+def persist_churn_scores(db: Session, run_id: str, df: pd.DataFrame,
+                         reference_date: Optional[date] = None,
+                         visit_index: Optional[pd.DataFrame] = None) -> ChurnScoreRun:
+    """
+    Score every patient in df and replace the stored scores for run_id.
+    df is the patient-level frame (after aggregate_visits_to_patients); pass
+    the visit index to derive procedure intervals from real visit gaps.
+    """
+    if reference_date is None:
+        reference_date = date.today()
+
+    procedure_intervals = calculate_procedure_intervals(df, visit_index=visit_index)
+    churn_df = analyze_patient_churn(df, reference_date, procedure_intervals=procedure_intervals)
+
+    rows = [
+        {
+            "run_id": run_id,
+            "patient_id": _to_optional(r["patient_id"], str),
+            "procedure": _to_optional(r["procedure"], str),
+            "last_visit": _to_datetime(r["last_visit"]),
+            "visit_number": _to_optional(r["visit_number"], int),
+            "expected_interval": float(r["expected_interval"]),
+            "days_since_visit": int(r["days_since_visit"]),
+            "days_overdue": float(r["days_overdue"]),
+            "overdue_ratio": float(r["overdue_ratio"]),
+            "risk_level": r["risk_level"],
+            "risk_score": int(r["risk_score"]),
+        }
+        for r in churn_df.to_dict("records")
+    ]
+
+    db.execute(delete(PatientChurnScore).where(PatientChurnScore.run_id == run_id))
+    if rows:
+        db.bulk_insert_mappings(PatientChurnScore, rows)
+
+    meta = db.get(ChurnScoreRun, run_id)
+    if meta is None:
+        meta = ChurnScoreRun(run_id=run_id)
+        db.add(meta)
+    meta.reference_date = reference_date
+    meta.procedure_intervals = {k: float(v) for k, v in procedure_intervals.items()}
+    meta.patient_count = len(rows)
+    meta.scored_at = datetime.utcnow()
+    meta.rescored_at = None
+    db.commit()
+
+    print(f"[CHURN STORE] Persisted {len(rows)} churn scores for run {run_id} as of {reference_date}")
+    return meta
+
+
+def _rescore_statement(run_id: str, delta_days: int):
+    """
+    Single UPDATE that advances days_since/days_overdue by delta_days and
+    re-buckets risk with the same thresholds as bucket_churn_risk.
+    Rows with no parseable last visit stay pinned to the reference date.
+    """
+    score = PatientChurnScore
+    days_since = case(
+        (score.last_visit.is_(None), score.days_since_visit),
+        else_=score.days_since_visit + delta_days,
+    )
+    ratio = case(
+        (score.expected_interval > 0, days_since * 1.0 / score.expected_interval),
+        else_=0.0,
+    )
+    risk_level = case(
+        *[(ratio < upper, level) for upper, level, _ in RISK_THRESHOLDS],
+        else_=CRITICAL_RISK[0],
+    )
+    risk_score = case(
+        *[(ratio < upper, points) for upper, _, points in RISK_THRESHOLDS],
+        else_=CRITICAL_RISK[1],
+    )
+    return (
+        update(score)
+        .where(score.run_id == run_id)
+        .values(
+            days_since_visit=days_since,
+            days_overdue=days_since - score.expected_interval,
+            overdue_ratio=func.round(ratio, 2),
+            risk_level=risk_level,
+            risk_score=risk_score,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def rescore_churn_run(db: Session, meta: ChurnScoreRun, reference_date: Optional[date] = None) -> bool:
+    """Advance one run's stored scores to reference_date. Returns True if rows changed."""
+    if reference_date is None:
+        reference_date = date.today()
+
+    delta_days = (reference_date - meta.reference_date).days
+    if delta_days <= 0:
+        return False
+
+    db.execute(_rescore_statement(meta.run_id, delta_days))
+    meta.reference_date = reference_date
+    meta.rescored_at = datetime.utcnow()
+    db.commit()
+    return True
+
+
+def rescore_all_churn_runs(db: Session, reference_date: Optional[date] = None) -> List[str]:
+    """Scheduled job: bring every stale run's stored scores up to reference_date."""
+    if reference_date is None:
+        reference_date = date.today()
+
+    stale_runs = db.query(ChurnScoreRun).filter(ChurnScoreRun.reference_date < reference_date).all()
+    rescored = [meta.run_id for meta in stale_runs if rescore_churn_run(db, meta, reference_date)]
+    if rescored:
+        print(f"[CHURN STORE] Rescored {len(rescored)} runs to {reference_date}")
+    return rescored
+
+
+def get_stored_churn_summary(db: Session, run_id: str, reference_date: Optional[date] = None) -> Optional[dict]:
+    """
+    Churn summary served from the stored table, or None if the run has not
+    been scored yet. Stale scores are advanced to reference_date first.
+    """
+    meta = db.get(ChurnScoreRun, run_id)
+    if meta is None:
+        return None
+    rescore_churn_run(db, meta, reference_date)
+
+    score = PatientChurnScore
+    risk_counts = dict(
+        db.query(score.risk_level, func.count(score.id))
+        .filter(score.run_id == run_id)
+        .group_by(score.risk_level)
+        .all()
+    )
+    total = sum(risk_counts.values())
+
+    avg_days_overdue = (
+        db.query(func.avg(score.days_overdue))
+        .filter(score.run_id == run_id, score.risk_level.in_(AT_RISK_LEVELS))
+        .scalar()
+    ) or 0
+
+    high_risk_rows = (
+        db.query(score)
+        .filter(score.run_id == run_id, score.risk_level.in_(HIGH_RISK_LEVELS))
+        .order_by(score.risk_score.desc(), score.id)
+        .limit(10)
+        .all()
+    )
+    high_risk_patients = [
+        {
+            "patient_id": row.patient_id,
+            "procedure": row.procedure,
+            "last_visit": row.last_visit,
+            "visit_number": row.visit_number,
+            "risk_level": row.risk_level,
+            "risk_score": row.risk_score,
+            "days_since_visit": row.days_since_visit,
+            "days_overdue": row.days_overdue,
+            "expected_interval": row.expected_interval,
+            "overdue_ratio": row.overdue_ratio,
+        }
+        for row in high_risk_rows
+    ]
+
+    summary = build_churn_summary(
+        total, risk_counts, avg_days_overdue, high_risk_patients, meta.procedure_intervals or {}
+    )
+    summary["scored_as_of"] = meta.reference_date.isoformat()
+    return summary
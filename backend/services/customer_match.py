@@ -0,0 +1,106 @@
+"""
+Customer-match hashing for Audience Mirror exports.
+Emails and phone numbers are normalized the way Facebook and Google expect
+and SHA-256 hashed, a whole column at a time. Large lists are split into
+chunks hashed in one long-lived worker pool. Its processes are started with
+forkserver/spawn rather than forked from the threaded server.
+"""
+
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import pandas as pd
+
+HASH_COLUMNS = ("email_sha256", "phone_sha256", "phone_e164_sha256")
+# Upload layouts: header -> stored hash column
+PLATFORM_COLUMNS = {
+    "facebook": {"email": "email_sha256", "phone": "phone_sha256"},  # phone as digits with country code
+    "google": {"Email": "email_sha256", "Phone": "phone_e164_sha256"},  # phone as +E.164
+}
+DEFAULT_COUNTRY_CODE = os.getenv("CUSTOMER_MATCH_COUNTRY_CODE", "1")
+HASH_CHUNK = 50000
+HASH_WORKERS = int(os.getenv("CUSTOMER_MATCH_WORKERS", str(os.cpu_count() or 1)))
+
+EMAIL_PATTERN = r"^[^@\s]+@[^@\s]+\.[^@\s]+$"
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """The shared hashing pool, created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _pool = ProcessPoolExecutor(max_workers=max(1, HASH_WORKERS), mp_context=context)
+        return _pool
+
+
+def shutdown_hash_pool():
+    """Stop the hashing pool's workers (app shutdown / tests)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def normalize_emails(emails: pd.Series) -> pd.Series:
+    """Trimmed, lowercased emails; None where the value isn't an email."""
+    emails = emails.astype("string").str.strip().str.lower()
+    return emails.where(emails.str.match(EMAIL_PATTERN).fillna(False).astype(bool), None)
+
+
+def normalize_phones(phones: pd.Series, country_code: str = DEFAULT_COUNTRY_CODE) -> pd.Series:
+    """
+    Digits-only phone numbers including the country code (no '+'). Ten-digit
+    numbers get country_code; '+'-prefixed numbers keep theirs. None if invalid.
+    """
+    raw = phones.astype("string").str.strip()
+    # Spreadsheets often turn phone numbers into floats
+    raw = raw.str.replace(r"\.0$", "", regex=True)
+    international = raw.str.startswith("+").fillna(False).astype(bool)
+    digits = raw.str.replace(r"\D", "", regex=True)
+    digits = digits.where(international, digits.str.lstrip("0"))
+    local = ~international & (digits.str.len() == 10)
+    digits = digits.where(~local.fillna(False).astype(bool), country_code + digits)
+    valid = digits.str.len().between(8, 15).fillna(False).astype(bool)
+    return digits.where(valid, None)
+
+
+def sha256_hex(values: pd.Series) -> List[Optional[str]]:
+    return [hashlib.sha256(v.encode("utf-8")).hexdigest() if isinstance(v, str) else None
+            for v in values.astype(object).where(values.notna(), None)]
+
+
+def _hash_chunk(emails: list, phones: list) -> dict:
+    phones = normalize_phones(pd.Series(phones, dtype=object))
+    return {
+        "email_sha256": sha256_hex(normalize_emails(pd.Series(emails, dtype=object))),
+        "phone_sha256": sha256_hex(phones),
+        "phone_e164_sha256": sha256_hex("+" + phones),
+    }
+
+
+def hash_pii(df: pd.DataFrame, workers: int = HASH_WORKERS, chunk_size: int = HASH_CHUNK) -> pd.DataFrame:
+    """Hash columns (HASH_COLUMNS) for df's email / phone columns, aligned with df's index."""
+    emails = df["email"].tolist() if "email" in df.columns else [None] * len(df)
+    phones = df["phone"].tolist() if "phone" in df.columns else [None] * len(df)
+    bounds = range(0, len(df), chunk_size)
+
+    if workers > 1 and len(df) > chunk_size:
+        parts = list(_get_pool().map(_hash_chunk, [emails[i:i + chunk_size] for i in bounds],
+                                     [phones[i:i + chunk_size] for i in bounds]))
+    else:
+        parts = [_hash_chunk(emails[i:i + chunk_size], phones[i:i + chunk_size]) for i in bounds]
+
+    return pd.DataFrame(
+        {name: [h for part in parts for h in part[name]] for name in HASH_COLUMNS},
+        index=df.index, dtype=object
+    )
@@ -0,0 +1,107 @@
+"""
+Streaming file encoders for Audience Mirror exports.
+Rows arrive in chunks (lists of tuples) and are encoded chunk by chunk, so a
+StreamingResponse never holds more than one chunk of the file in memory.
+CSV can be gzipped on the fly; Parquet needs pyarrow and writes one row
+group per chunk.
+"""
+
+import csv
+import io
+import zlib
+from typing import Dict, Iterable, Iterator, List, Sequence
+
+EXPORT_FORMATS = ("csv", "parquet")
+MEDIA_TYPES = {"csv": "text/csv", "csv.gz": "application/gzip", "parquet": "application/vnd.apache.parquet"}
+
+
+def export_filename(stem: str, format: str, gzip: bool = False) -> str:
+    return f"{stem}.{format}" + (".gz" if gzip and format == "csv" else "")
+
+
+def export_media_type(format: str, gzip: bool = False) -> str:
+    return MEDIA_TYPES["csv.gz" if gzip and format == "csv" else format]
+
+
+def gzip_stream(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Gzip a byte stream incrementally."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _csv_chunks(row_chunks: Iterable[Sequence[Sequence]], columns: Sequence[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    for rows in row_chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def stream_csv(row_chunks: Iterable[Sequence[Sequence]], columns: Sequence[str], gzip: bool = False) -> Iterator[bytes]:
+    """CSV bytes (header first) for chunks of row tuples, optionally gzipped."""
+    chunks = _csv_chunks(row_chunks, columns)
+    return gzip_stream(chunks) if gzip else chunks
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands whatever was written back to the generator."""
+
+    def __init__(self):
+        self.parts: List[bytes] = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self) -> bytes:
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+
+def stream_parquet(row_chunks: Iterable[Sequence[Sequence]], columns: Sequence[str],
+                   types: Dict[str, str]) -> Iterator[bytes]:
+    """
+    Parquet bytes for chunks of row tuples, one row group per chunk. types maps
+    each column to "string", "float" or "int". Raises ImportError without pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrow_types = {"string": pa.string(), "float": pa.float64(), "int": pa.int64()}
+    schema = pa.schema([(name, arrow_types[types[name]]) for name in columns])
+
+    def generate():
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(sink, schema, compression="snappy")
+        try:
+            for rows in row_chunks:
+                if not rows:
+                    continue
+                arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                data = sink.take()
+                if data:
+                    yield data
+        finally:
+            writer.close()
+        yield sink.take()
+
+    return generate()
@@ -5,10 +5,11 @@ Calculates retention funnels and service progression paths
 
 import pandas as pd
 import numpy as np
-from collections import defaultdict
 
+from services.visit_index import build_visit_index, serviced_visits
 
-def analyze_patient_journey(df, vip_patient_ids=None, min_patients=20, min_vips=3):
+
+def analyze_patient_journey(df, vip_patient_ids=None, min_patients=20, min_vips=3, visit_index=None):
     """
     Analyze patient journey comparing VIPs vs all patients.
 
@@ -17,38 +18,26 @@ def analyze_patient_journey(df, vip_patient_ids=None, min_patients=20, min_vips=
         vip_patient_ids: Set of VIP patient IDs (top 20% by revenue)
         min_patients: Minimum total patients to show (default 20)
         min_vips: Minimum VIP patients to show (default 3)
+        visit_index: Prebuilt index from build_visit_index (built from df if omitted)
 
     Returns:
         dict with journey comparison data, or None if insufficient data
     """
 
-    # Find required columns
-    patient_id_col = next((c for c in ['patient_id'] if c in df.columns), None)
-    date_col = next((c for c in ['visit_date', 'date', 'appointment_date'] if c in df.columns), None)
-    treatment_col = next((c for c in ['treatment', 'procedure', 'service', 'procedure_type'] if c in df.columns), None)
-
-    if not all([patient_id_col, date_col]):
+    if visit_index is None:
+        visit_index = build_visit_index(df)
+    if visit_index is None or len(visit_index) == 0:
         return None
 
-    # Clean data
-    df = df[[patient_id_col, date_col] + ([treatment_col] if treatment_col else [])].copy()
-    df = df[df[patient_id_col].notna()].copy()
-    df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
-    df = df[df[date_col].notna()]
-
-    if len(df) == 0:
-        return None
-
-    # Sort by patient and date
-    df = df.sort_values([patient_id_col, date_col])
+    has_treatment = visit_index.attrs.get('treatment_col') is not None
 
     # Get unique patient counts
-    total_patient_count = df[patient_id_col].nunique()
+    total_patient_count = int((visit_index['visit_seq'] == 1).sum())
     vip_count = len(vip_patient_ids) if vip_patient_ids else 0
 
     print(f"\n{'='*80}")
     print(f"[JOURNEY DEBUG] STARTING JOURNEY ANALYSIS")
-    print(f"[JOURNEY DEBUG] Data shape: {len(df)} rows, {total_patient_count} unique patients")
+    print(f"[JOURNEY DEBUG] Data shape: {len(visit_index)} rows, {total_patient_count} unique patients")
     print(f"[JOURNEY DEBUG] VIP count: {vip_count}")
     print(f"[JOURNEY DEBUG] Thresholds: min_patients={min_patients}, min_vips={min_vips}")
 
@@ -67,14 +56,14 @@ def analyze_patient_journey(df, vip_patient_ids=None, min_patients=20, min_vips=
 
     # Calculate VIP retention
     print(f"[JOURNEY DEBUG] Calculating VIP retention...")
-    vip_retention, vip_avg_days = calculate_visit_retention(df, vip_patient_ids, patient_id_col, date_col)
+    vip_retention, vip_avg_days = calculate_visit_retention(visit_index, vip_patient_ids)
     print(f"[JOURNEY DEBUG] VIP retention: {vip_retention}")
     print(f"[JOURNEY DEBUG] VIP avg days to V2: {vip_avg_days}")
 
     # Calculate all patients retention
     print(f"[JOURNEY DEBUG] Calculating all-patient retention...")
-    all_patient_ids = set(df[patient_id_col].unique())
-    all_retention, all_avg_days = calculate_visit_retention(df, all_patient_ids, patient_id_col, date_col)
+    all_patient_ids = set(visit_index['patient_id'].unique())
+    all_retention, all_avg_days = calculate_visit_retention(visit_index, all_patient_ids)
     print(f"[JOURNEY DEBUG] All retention: {all_retention}")
     print(f"[JOURNEY DEBUG] All avg days to V2: {all_avg_days}")
 
@@ -102,9 +91,9 @@ def analyze_patient_journey(df, vip_patient_ids=None, min_patients=20, min_vips=
     vip_service_path = None
     all_service_path = None
 
-    if treatment_col:
-        vip_service_path = calculate_service_path(df, vip_patient_ids, patient_id_col, date_col, treatment_col)
-        all_service_path = calculate_service_path(df, all_patient_ids, patient_id_col, date_col, treatment_col)
+    if has_treatment:
+        vip_service_path = calculate_service_path(visit_index, vip_patient_ids)
+        all_service_path = calculate_service_path(visit_index, all_patient_ids)
 
     # Determine biggest drop-off
     stage_names = ['Visit 1 → 2', 'Visit 2 → 3', 'Visit 3 → 4+']
@@ -136,7 +125,7 @@ def analyze_patient_journey(df, vip_patient_ids=None, min_patients=20, min_vips=
     }
 
 
-def calculate_visit_retention(df, patient_ids, patient_id_col, date_col):
+def calculate_visit_retention(visit_index, patient_ids):
     """
     Calculate retention percentages at each visit milestone.
 
@@ -144,16 +133,16 @@ def calculate_visit_retention(df, patient_ids, patient_id_col, date_col):
         tuple: (retention_list, avg_days_to_v2)
     """
 
-    # Filter to specific patients
-    patient_df = df[df[patient_id_col].isin(patient_ids)].copy()
+    # One row per patient (their first visit) carries visit_count and the gap to visit 2
+    first_visits = visit_index[(visit_index['visit_seq'] == 1) & visit_index['patient_id'].isin(patient_ids)]
 
-    if len(patient_df) == 0:
+    if len(first_visits) == 0:
         return [100, 0, 0, 0], 0
 
     total_patients = len(patient_ids)
 
     # Count visits per patient
-    visit_counts = patient_df.groupby(patient_id_col).size()
+    visit_counts = first_visits['visit_count']
 
     # Calculate retention at each milestone
     retention = [
@@ -164,24 +153,15 @@ def calculate_visit_retention(df, patient_ids, patient_id_col, date_col):
     ]
 
     # Calculate average days between first and second visit
-    patient_df = patient_df.sort_values([patient_id_col, date_col])
-
-    days_to_v2_list = []
-    for patient_id, visits in patient_df.groupby(patient_id_col):
-        if len(visits) >= 2:
-            visits_sorted = visits.sort_values(date_col)
-            first_visit = visits_sorted.iloc[0][date_col]
-            second_visit = visits_sorted.iloc[1][date_col]
-            days_diff = (second_visit - first_visit).days
-            if days_diff > 0:
-                days_to_v2_list.append(days_diff)
+    days_to_v2 = first_visits['next_visit_gap']
+    days_to_v2_list = days_to_v2[days_to_v2 > 0].to_numpy()
 
-    avg_days_to_v2 = np.mean(days_to_v2_list) if days_to_v2_list else 0
+    avg_days_to_v2 = np.mean(days_to_v2_list) if len(days_to_v2_list) else 0
 
     return retention, avg_days_to_v2
 
 
-def calculate_service_path(df, patient_ids, patient_id_col, date_col, treatment_col):
+def calculate_service_path(visit_index, patient_ids):
     """
     Calculate most common service progression path.
 
@@ -190,47 +170,20 @@ def calculate_service_path(df, patient_ids, patient_id_col, date_col, treatment_
     """
 
     # Filter to specific patients
-    patient_df = df[df[patient_id_col].isin(patient_ids)].copy()
-    patient_df = patient_df[patient_df[treatment_col].notna()].copy()
+    patient_visits = serviced_visits(visit_index)
+    patient_visits = patient_visits[patient_visits['patient_id'].isin(patient_ids)]
 
-    if len(patient_df) == 0:
+    if len(patient_visits) == 0:
         return None
 
-    # Sort by patient and date
-    patient_df = patient_df.sort_values([patient_id_col, date_col])
-
-    # Get first, second, third services (most common)
-    first_services = []
-    second_services = []
-    third_services = []
-
-    for patient_id, visits in patient_df.groupby(patient_id_col):
-        visits_sorted = visits.sort_values(date_col)
-        services = visits_sorted[treatment_col].astype(str).str.strip().tolist()
-
-        if len(services) >= 1:
-            first_services.append(services[0])
-        if len(services) >= 2:
-            second_services.append(services[1])
-        if len(services) >= 3:
-            third_services.append(services[2])
-
-    # Find most common at each position
+    # Find most common first, second, third service
     path = []
-
-    if first_services:
-        most_common_first = pd.Series(first_services).mode()
-        if len(most_common_first) > 0:
-            path.append(most_common_first[0])
-
-    if second_services:
-        most_common_second = pd.Series(second_services).mode()
-        if len(most_common_second) > 0:
-            path.append(most_common_second[0])
-
-    if third_services:
-        most_common_third = pd.Series(third_services).mode()
-        if len(most_common_third) > 0:
-            path.append(most_common_third[0])
+    for position in (1, 2, 3):
+        services = patient_visits.loc[patient_visits['service_seq'] == position, 'service']
+        if len(services) == 0:
+            continue
+        most_common = services.mode()
+        if len(most_common) > 0:
+            path.append(most_common.iloc[0])
 
     return path if path else None
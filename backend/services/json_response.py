@@ -0,0 +1,66 @@
+"""
+orjson-backed JSON responses for Audience Mirror.
+Analysis results are large nested dicts full of numpy / pandas values;
+orjson serializes them natively (NaN and infinity become null) and the
+default hook covers the pandas types it doesn't know. Each response reports
+its serialization time in a Server-Timing header, which the compression
+middleware aggregates per endpoint.
+"""
+
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any
+
+import numpy as np
+import orjson
+import pandas as pd
+from fastapi.responses import JSONResponse
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+SERVER_TIMING_METRIC = "serialize"
+
+
+def orjson_default(obj: Any) -> Any:
+    """Fallback for values orjson can't serialize itself."""
+    if obj is pd.NaT or obj is pd.NA:
+        return None
+    if isinstance(obj, (pd.Timestamp, datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, pd.Timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, pd.Series):
+        return obj.tolist()
+    if isinstance(obj, pd.DataFrame):
+        return obj.to_dict("records")
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=orjson_default, option=ORJSON_OPTIONS)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson, with a Server-Timing serialize entry."""
+
+    def render(self, content: Any) -> bytes:
+        started = time.perf_counter()
+        body = dumps(content)
+        self.serialize_ms = (time.perf_counter() - started) * 1000
+        return body
+
+    def init_headers(self, headers=None) -> None:
+        super().init_headers(headers)
+        serialize_ms = getattr(self, "serialize_ms", None)
+        if serialize_ms is not None:
+            self.raw_headers.append(
+                (b"server-timing", f"{SERVER_TIMING_METRIC};dur={serialize_ms:.2f}".encode("latin-1"))
+            )
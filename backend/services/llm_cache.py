@@ -0,0 +1,253 @@
+"""
+Tiered LLM response cache for Audience Mirror.
+In-process LRU -> SQLite file -> Redis (optional), with TTL and size-based
+eviction. Identical requests in flight at the same time share one upstream call.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from typing import Awaitable, Callable, Optional
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(24 * 3600)))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "512"))
+LLM_CACHE_DISK_MAX_BYTES = int(os.getenv("LLM_CACHE_DISK_MAX_BYTES", str(50 * 1024 * 1024)))
+LLM_CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)), "llm_cache.db")
+)
+# Redis tier is only used when a URL is configured
+LLM_CACHE_REDIS_URL = os.getenv("LLM_CACHE_REDIS_URL")
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def make_cache_key(prompt: str, model: str, temperature, max_tokens: int) -> str:
+    """Hash of the whitespace-normalized prompt plus the sampling parameters."""
+    normalized = _WHITESPACE.sub(" ", prompt).strip()
+    payload = json.dumps([normalized, model, temperature, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def make_payload_key(namespace: str, payload) -> str:
+    """Key for a cached derived item (e.g. one ZIP of a batched generation)."""
+    body = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{namespace}:{body}".encode("utf-8")).hexdigest()
+
+
+class MemoryLRU:
+    """Bounded in-process LRU of key -> (value, expires_at)."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key: str, now: float) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str, expires_at: float):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteStore:
+    """Disk tier: one row per key, least-recently-used rows evicted past max_bytes."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_access ON llm_cache (last_access)")
+
+    @contextmanager
+    def _connect(self):
+        """A connection that commits (or rolls back) and is closed on exit"""
+        with closing(sqlite3.connect(self.path, timeout=5)) as conn, conn:
+            yield conn
+
+    def get(self, key: str, now: float) -> Optional[tuple]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+        return row
+
+    def set(self, key: str, value: str, expires_at: float, now: float):
+        size = len(value.encode("utf-8"))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, expires_at, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now: float):
+        conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Walk rows oldest-access first until enough bytes are freed
+        excess, victims = total - self.max_bytes, []
+        for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access"):
+            victims.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM llm_cache WHERE key = ?", victims)
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM llm_cache")
+
+
+class TieredLLMCache:
+    """
+    Read-through cache: memory, then disk, then Redis; a hit in a lower tier
+    is promoted upward. get_or_compute() coalesces concurrent misses per key.
+    """
+
+    def __init__(self, memory_entries: int = LLM_CACHE_MEMORY_ENTRIES, disk_path: Optional[str] = LLM_CACHE_PATH,
+                 disk_max_bytes: int = LLM_CACHE_DISK_MAX_BYTES, redis_url: Optional[str] = LLM_CACHE_REDIS_URL,
+                 ttl_seconds: int = LLM_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.memory = MemoryLRU(memory_entries)
+        self.disk = None
+        if disk_path:
+            try:
+                self.disk = SQLiteStore(disk_path, disk_max_bytes)
+            except sqlite3.Error as e:
+                print(f"[LLM CACHE] Disk tier unavailable ({e}), using memory only")
+        self.redis = None
+        if redis_url:
+            try:
+                import redis.asyncio as redis_asyncio
+                self.redis = redis_asyncio.from_url(redis_url, decode_responses=True, socket_connect_timeout=2)
+            except Exception as e:
+                print(f"[LLM CACHE] Redis tier unavailable: {e}")
+        self._inflight = {}
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "redis_hits": 0, "misses": 0, "coalesced": 0}
+
+    async def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        value = self.memory.get(key, now)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            return value
+
+        if self.disk is not None:
+            try:
+                row = await asyncio.to_thread(self.disk.get, key, now)
+            except sqlite3.Error as e:
+                print(f"[LLM CACHE] Disk read failed: {e}")
+                row = None
+            if row is not None:
+                self.stats["disk_hits"] += 1
+                self.memory.set(key, row[0], row[1])
+                return row[0]
+
+        if self.redis is not None:
+            try:
+                value = await self.redis.get(f"llm:{key}")
+            except Exception as e:
+                print(f"[LLM CACHE] Redis read failed: {e}")
+                value = None
+            if value is not None:
+                self.stats["redis_hits"] += 1
+                await self._store_local(key, value, now + self.ttl_seconds, now)
+                return value
+        return None
+
+    async def _store_local(self, key: str, value: str, expires_at: float, now: float):
+        self.memory.set(key, value, expires_at)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, value, expires_at, now)
+            except sqlite3.Error as e:
+                print(f"[LLM CACHE] Disk write failed: {e}")
+
+    async def set(self, key: str, value: str):
+        now = time.time()
+        await self._store_local(key, value, now + self.ttl_seconds, now)
+        if self.redis is not None:
+            try:
+                await self.redis.setex(f"llm:{key}", self.ttl_seconds, value)
+            except Exception as e:
+                print(f"[LLM CACHE] Redis write failed: {e}")
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[str]],
+                             cacheable: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        Cached value for key, or the result of compute() shared by every
+        concurrent caller. The result is only stored if cacheable(result) is true.
+        """
+        value = await self.get(key)
+        if value is not None:
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(inflight)
+
+        self.stats["misses"] += 1
+
+        async def run():
+            try:
+                result = await compute()
+                if cacheable is None or cacheable(result):
+                    await self.set(key, result)
+                return result
+            finally:
+                self._inflight.pop(key, None)
+
+        task = asyncio.ensure_future(run())
+        self._inflight[key] = task
+        # Shield so one caller's cancellation (e.g. its deadline) doesn't fail the others
+        return await asyncio.shield(task)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+
+_cache = None
+
+
+def get_llm_cache() -> Optional[TieredLLMCache]:
+    """Process-wide cache, or None when LLM_CACHE_ENABLED=0."""
+    global _cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = TieredLLMCache()
+    return _cache
@@ -0,0 +1,246 @@
+"""
+Shared async Claude client for Audience Mirror.
+One AsyncAnthropic instance (and its pooled HTTP connections) per event loop,
+a global concurrency limit, a per-call deadline and jittered retry, so LLM
+calls never block the FastAPI event loop.
+"""
+
+import asyncio
+import json
+import os
+import random
+from typing import Any, AsyncIterator, Callable, Optional
+
+from anthropic import APIConnectionError, APIStatusError, AsyncAnthropic
+
+from .llm_cache import get_llm_cache, make_cache_key
+
+DEFAULT_MODEL = "claude-sonnet-4-20250514"
+
+# Max in-flight requests to the API across the whole process
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Total budget for one call, retries included
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+
+# Keyed by event loop: pooled connections and semaphores can't be shared across loops
+_clients = {}
+_semaphores = {}
+
+
+class LLMDeadlineExceeded(Exception):
+    """Raised when a call (including its retries) runs past its deadline."""
+
+
+def parse_llm_json(response_text: str):
+    """Parse a JSON completion, tolerating markdown code fences"""
+    return json.loads(response_text.replace("```json", "").replace("```", "").strip())
+
+
+def get_async_client() -> AsyncAnthropic:
+    """The shared client for the running event loop (created on first use)."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = AsyncAnthropic(
+            api_key=os.getenv("ANTHROPIC_API_KEY"),
+            base_url=os.getenv("ANTHROPIC_BASE_URL") or None,
+            max_retries=0,  # retries are handled here so they share the deadline
+        )
+        _clients[loop] = client
+    return client
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        _semaphores[loop] = semaphore
+    return semaphore
+
+
+async def close_async_client():
+    """Close the running loop's client (app shutdown / tests)."""
+    loop = asyncio.get_running_loop()
+    _semaphores.pop(loop, None)
+    client = _clients.pop(loop, None)
+    if client is not None:
+        await client.close()
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, APIConnectionError):  # includes APITimeoutError
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def _should_cache(text: str, stop_reason: Optional[str], validate: Optional[Callable[[str], Any]]) -> bool:
+    """Truncated replies and ones validate() rejects (by raising) are never cached."""
+    if stop_reason == "max_tokens":
+        print("[LLM CACHE] Response hit max_tokens, not caching")
+        return False
+    if validate is not None:
+        try:
+            validate(text)
+        except Exception as e:
+            print(f"[LLM CACHE] Response failed validation, not caching: {e}")
+            return False
+    return True
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+async def complete(prompt: str, max_tokens: int = 1024, temperature: Optional[float] = 0.7,
+                   model: str = DEFAULT_MODEL, deadline: Optional[float] = None,
+                   max_retries: Optional[int] = None, use_cache: bool = True,
+                   validate: Optional[Callable[[str], Any]] = None) -> str:
+    """
+    Send a single-turn prompt and return the response text.
+
+    deadline is the total seconds allowed for the call including retries and
+    time spent waiting for a concurrency slot. Raises LLMDeadlineExceeded when
+    it runs out, or the last API error when retries are exhausted.
+    temperature=None leaves it to the API default.
+
+    Responses go through the tiered LLM cache (see services.llm_cache) unless
+    use_cache is False; identical concurrent calls share one upstream request.
+    A response is only cached if it wasn't cut off at max_tokens and, when
+    given, validate(text) doesn't raise (e.g. json.loads for JSON prompts).
+    The text is returned either way so callers can apply their own fallback.
+    """
+    deadline = LLM_DEADLINE_SECONDS if deadline is None else deadline
+    max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    stop = {}
+
+    async def upstream():
+        text, stop["reason"] = await _complete_uncached(prompt, max_tokens, temperature, model, deadline, max_retries)
+        return text
+
+    cache = get_llm_cache() if use_cache else None
+    if cache is None:
+        return await upstream()
+
+    key = make_cache_key(prompt, model, temperature, max_tokens)
+    try:
+        return await asyncio.wait_for(
+            cache.get_or_compute(key, upstream, cacheable=lambda text: _should_cache(text, stop.get("reason"), validate)),
+            timeout=deadline
+        )
+    except asyncio.TimeoutError:
+        raise LLMDeadlineExceeded(f"LLM call exceeded {deadline}s deadline")
+
+
+async def _complete_uncached(prompt: str, max_tokens: int, temperature: Optional[float], model: str,
+                             deadline: float, max_retries: int) -> tuple:
+    """(text, stop_reason)"""
+    loop = asyncio.get_running_loop()
+    expires_at = loop.time() + deadline
+
+    params = {"model": model, "max_tokens": max_tokens, "messages": [{"role": "user", "content": prompt}]}
+    if temperature is not None:
+        params["temperature"] = temperature
+
+    async def attempt_call():
+        async with _get_semaphore():
+            message = await get_async_client().messages.create(**params)
+        return message.content[0].text, getattr(message, "stop_reason", None)
+
+    attempt = 0
+    while True:
+        remaining = expires_at - loop.time()
+        if remaining <= 0:
+            raise LLMDeadlineExceeded(f"LLM call exceeded {deadline}s deadline")
+        try:
+            return await asyncio.wait_for(attempt_call(), timeout=remaining)
+        except asyncio.TimeoutError:
+            raise LLMDeadlineExceeded(f"LLM call exceeded {deadline}s deadline")
+        except Exception as e:
+            if attempt >= max_retries or not _is_retryable(e):
+                raise
+            delay = min(_backoff_delay(attempt), max(0.0, expires_at - loop.time()))
+            print(f"[LLM] Retryable error ({e.__class__.__name__}), retry {attempt + 1}/{max_retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+async def stream_complete(prompt: str, max_tokens: int = 1024, temperature: Optional[float] = 0.7,
+                          model: str = DEFAULT_MODEL, deadline: Optional[float] = None,
+                          max_retries: Optional[int] = None, use_cache: bool = True,
+                          validate: Optional[Callable[[str], Any]] = None) -> AsyncIterator[str]:
+    """
+    Like complete(), but yields text deltas as the model generates them.
+
+    A cached response is yielded as a single chunk; a fully streamed response
+    is written back to the cache (same max_tokens / validate rules as complete()). Retries only happen before the first token,
+    and the deadline covers the whole stream.
+    """
+    deadline = LLM_DEADLINE_SECONDS if deadline is None else deadline
+    max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    loop = asyncio.get_running_loop()
+    expires_at = loop.time() + deadline
+
+    cache = get_llm_cache() if use_cache else None
+    key = make_cache_key(prompt, model, temperature, max_tokens) if cache is not None else None
+    if cache is not None:
+        cached = await cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    params = {"model": model, "max_tokens": max_tokens, "messages": [{"role": "user", "content": prompt}],
+              "stream": True}
+    if temperature is not None:
+        params["temperature"] = temperature
+
+    def remaining():
+        left = expires_at - loop.time()
+        if left <= 0:
+            raise LLMDeadlineExceeded(f"LLM stream exceeded {deadline}s deadline")
+        return left
+
+    async with _get_semaphore():
+        attempt = 0
+        while True:
+            try:
+                stream = await asyncio.wait_for(get_async_client().messages.create(**params), timeout=remaining())
+                break
+            except asyncio.TimeoutError:
+                raise LLMDeadlineExceeded(f"LLM stream exceeded {deadline}s deadline")
+            except Exception as e:
+                if attempt >= max_retries or not _is_retryable(e):
+                    raise
+                delay = min(_backoff_delay(attempt), max(0.0, expires_at - loop.time()))
+                print(f"[LLM] Retryable error ({e.__class__.__name__}), retry {attempt + 1}/{max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+        chunks = []
+        stop_reason = None
+        events = stream.__aiter__()
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(events.__anext__(), timeout=remaining())
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise LLMDeadlineExceeded(f"LLM stream exceeded {deadline}s deadline")
+                if event.type == "content_block_delta" and getattr(event.delta, "type", None) == "text_delta":
+                    chunks.append(event.delta.text)
+                    yield event.delta.text
+                elif event.type == "message_delta":
+                    stop_reason = getattr(event.delta, "stop_reason", None) or stop_reason
+        finally:
+            await stream.close()
+
+    text = "".join(chunks)
+    if cache is not None and _should_cache(text, stop_reason, validate):
+        await cache.set(key, text)
@@ -1,30 +1,28 @@
-import os
-import json
-from anthropic import Anthropic
 from typing import Dict
+from .llm_client import DEFAULT_MODEL, complete, parse_llm_json
 from .llm_prompts import PromptLibrary
 
+
 class LLMService:
     def __init__(self):
-        self.client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-        self.model = "claude-sonnet-4-20250514"
+        self.model = DEFAULT_MODEL
+
+    async def generate(self, prompt: str, max_tokens: int = 1024, temperature: float = 0.7,
+                       deadline: float = None, validate=None) -> str:
+        """
+        Raw completion text; errors propagate so callers can use their own fallback.
+        validate (raises on a bad reply) keeps unusable replies out of the cache.
+        """
+        return await complete(prompt, max_tokens=max_tokens, temperature=temperature,
+                              model=self.model, deadline=deadline, validate=validate)
         
-    def _call(self, prompt: str, expect_json: bool = False) -> str:
+    async def _call(self, prompt: str, expect_json: bool = False) -> str:
         """Base call to Claude API with error handling"""
         try:
-            message = self.client.messages.create(
-                model=self.model,
-                max_tokens=1024,
-                temperature=0.7,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            
-            response = message.content[0].text
+            response = await self.generate(prompt, validate=parse_llm_json if expect_json else None)
             
             if expect_json:
-                # Strip markdown code blocks if present
-                response = response.replace("```json", "").replace("```", "").strip()
-                return json.loads(response)
+                return parse_llm_json(response)
             
             return response
             
@@ -48,21 +46,21 @@ class LLMService:
             
             return "High-value segment showing strong engagement and revenue contribution. Focus on retention strategies and personalized campaigns to maximize lifetime value."
     
-    def generate_segment_strategy(self, context) -> str:
+    async def generate_segment_strategy(self, context) -> str:
         prompt = PromptLibrary.segment_strategy(context)
-        return self._call(prompt, expect_json=False)
+        return await self._call(prompt, expect_json=False)
     
-    def generate_facebook_ad(self, context) -> Dict:
+    async def generate_facebook_ad(self, context) -> Dict:
         prompt = PromptLibrary.facebook_ad_copy(context)
-        return self._call(prompt, expect_json=True)
+        return await self._call(prompt, expect_json=True)
     
-    def generate_instagram_ad(self, context) -> Dict:
+    async def generate_instagram_ad(self, context) -> Dict:
         prompt = PromptLibrary.instagram_ad_copy(context)
-        return self._call(prompt, expect_json=True)
+        return await self._call(prompt, expect_json=True)
     
-    def generate_google_ad(self, context) -> Dict:
+    async def generate_google_ad(self, context) -> Dict:
         prompt = PromptLibrary.google_ad_copy(context)
-        return self._call(prompt, expect_json=True)
+        return await self._call(prompt, expect_json=True)
 
 # Singleton instance
 llm_service = LLMService()
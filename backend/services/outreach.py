@@ -0,0 +1,219 @@
+"""
+Outreach tracking writes for Audience Mirror.
+Marks patients contacted with one lookup plus bulk insert/update, and matches
+contacted-but-not-returned PatientOutreach rows against uploaded visits with
+one merge, marking the returns with a single bulk UPDATE. Every write also
+moves the affected rows' outreach_rollups counters in the same transaction.
+"""
+
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from database import PatientOutreach
+from .outreach_rollups import ROLLUP_FIELDS, apply_rollup_deltas, snapshot
+
+# SQL IN-list size when looking up existing outreach rows
+OUTREACH_LOOKUP_CHUNK = 500
+# Share of the loan amount recorded as commission
+COMMISSION_RATE = 0.01
+# Revenue credited for a closed outreach with no loan amount on file
+DEFAULT_CLOSED_REVENUE = 4000
+
+
+def _rollup_columns():
+    return [getattr(PatientOutreach, field) for field in ROLLUP_FIELDS]
+
+
+def _load_snapshots(db: Session, outreach_ids: List[str]) -> Dict[str, Dict]:
+    """Rollup snapshots of existing outreach rows, keyed by id"""
+    snapshots = {}
+    for start in range(0, len(outreach_ids), OUTREACH_LOOKUP_CHUNK):
+        chunk = outreach_ids[start:start + OUTREACH_LOOKUP_CHUNK]
+        rows = db.query(PatientOutreach.id, *_rollup_columns()).filter(PatientOutreach.id.in_(chunk))
+        snapshots.update({row.id: snapshot(dict(row._mapping)) for row in rows})
+    return snapshots
+
+
+def mark_contacted(db: Session, run_id: str, patients: List[Dict], segment: Optional[str] = None,
+                   campaign_name: Optional[str] = None, contacted_at: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Upsert outreach rows for patients (dicts with patient_id and optional
+    days_stale, loan_amount). Existing (run_id, patient_id) rows are re-marked
+    as contacted and pending; new ones are inserted. A patient listed twice
+    keeps its last entry.
+    """
+    contacted_at = contacted_at or datetime.utcnow()
+    entries = {str(p["patient_id"]): p for p in patients}
+    patient_ids = list(entries)
+
+    existing = {}
+    for start in range(0, len(patient_ids), OUTREACH_LOOKUP_CHUNK):
+        chunk = patient_ids[start:start + OUTREACH_LOOKUP_CHUNK]
+        rows = db.query(PatientOutreach.patient_id, PatientOutreach.id, *_rollup_columns()).filter(
+            PatientOutreach.run_id == run_id,
+            PatientOutreach.patient_id.in_(chunk)
+        )
+        existing.update({row.patient_id: dict(row._mapping) for row in rows})
+
+    updates, inserts, before, after = [], [], [], []
+    for patient_id, entry in entries.items():
+        if patient_id in existing:
+            update = {
+                "id": existing[patient_id]["id"],
+                "contacted_at": contacted_at,
+                "days_stale_when_contacted": entry.get("days_stale"),
+                "outcome": "pending",
+            }
+            updates.append(update)
+            old = snapshot(existing[patient_id])
+            before.append(old)
+            after.append({**old, **{k: v for k, v in update.items() if k in ROLLUP_FIELDS}})
+            continue
+        loan_amount = entry.get("loan_amount")
+        inserts.append({
+            "id": str(uuid.uuid4()),
+            "run_id": run_id,
+            "patient_id": patient_id,
+            "segment": segment or None,
+            "campaign_name": campaign_name or None,
+            "contacted_at": contacted_at,
+            "days_stale_when_contacted": entry.get("days_stale"),
+            "loan_amount": loan_amount,
+            "commission": loan_amount * COMMISSION_RATE if loan_amount is not None else None,
+            "outcome": "pending",
+        })
+        before.append(None)
+        after.append(snapshot(inserts[-1]))
+
+    if updates:
+        db.bulk_update_mappings(PatientOutreach, updates)
+    if inserts:
+        db.bulk_insert_mappings(PatientOutreach, inserts)
+    apply_rollup_deltas(db, before, after)
+    db.commit()
+    return {"contacted": len(entries), "inserted": len(inserts), "updated": len(updates)}
+
+
+def load_pending_outreach(db: Session, run_id: Optional[str] = None) -> pd.DataFrame:
+    """Contacted patients with no return yet (one run, or every run), as a frame."""
+    query = db.query(PatientOutreach.id, PatientOutreach.patient_id, PatientOutreach.contacted_at).filter(
+        PatientOutreach.contacted_at.isnot(None),
+        PatientOutreach.returned_at.is_(None)
+    )
+    if run_id is not None:
+        query = query.filter(PatientOutreach.run_id == run_id)
+    return pd.DataFrame(query.all(), columns=["id", "patient_id", "contacted_at"])
+
+
+def find_outreach_returns(pending: pd.DataFrame, visits: pd.DataFrame, patient_col: str,
+                          date_col: Optional[str] = None, revenue_col: Optional[str] = None) -> pd.DataFrame:
+    """
+    Outreach rows whose patient has a visit after contacted_at (any visit when
+    there is no date column), with the revenue from those visits.
+    Returns columns id, revenue.
+    """
+    if pending.empty or visits.empty:
+        return pd.DataFrame({"id": pd.Series(dtype=object), "revenue": pd.Series(dtype=float)})
+
+    columns = {patient_col: "patient_id"}
+    if date_col:
+        columns[date_col] = "visit_date"
+    if revenue_col:
+        columns[revenue_col] = "revenue"
+    visits = visits[list(columns)].rename(columns=columns)
+    visits["patient_id"] = visits["patient_id"].astype(str)
+    if date_col:
+        visits["visit_date"] = pd.to_datetime(visits["visit_date"], errors="coerce")
+        # Nothing before the earliest contact can count
+        visits = visits[visits["visit_date"] > pending["contacted_at"].min()]
+    if revenue_col:
+        visits["revenue"] = pd.to_numeric(visits["revenue"], errors="coerce").fillna(0.0)
+    else:
+        visits["revenue"] = 0.0
+
+    pending = pending.assign(patient_id=pending["patient_id"].astype(str))
+    matched = pending.merge(visits, on="patient_id", how="inner")
+    if date_col:
+        matched = matched[matched["visit_date"] > matched["contacted_at"]]
+    return matched.groupby("id", sort=False, as_index=False)["revenue"].sum()
+
+
+def apply_outreach_returns(db: Session, returns: pd.DataFrame, set_revenue: bool = True,
+                           outcome: Optional[str] = None, returned_at: Optional[datetime] = None):
+    """Mark every row in returns as returned with one bulk UPDATE."""
+    if returns.empty:
+        return
+    returned_at = returned_at or datetime.utcnow()
+    snapshots = _load_snapshots(db, list(returns["id"]))
+    mappings, before, after = [], [], []
+    for outreach_id, revenue in zip(returns["id"], returns["revenue"]):
+        mapping = {"id": outreach_id, "returned_at": returned_at}
+        if set_revenue:
+            mapping["revenue_recovered"] = float(revenue)
+        if outcome:
+            mapping["outcome"] = outcome
+        mappings.append(mapping)
+        if outreach_id in snapshots:
+            before.append(snapshots[outreach_id])
+            after.append({**snapshots[outreach_id], **{k: v for k, v in mapping.items() if k in ROLLUP_FIELDS}})
+    db.bulk_update_mappings(PatientOutreach, mappings)
+    apply_rollup_deltas(db, before, after)
+    db.commit()
+
+
+def mark_returned(db: Session, run_id: str, patient_id: str, revenue: float,
+                  returned_at: Optional[datetime] = None) -> bool:
+    """Record a return (and its revenue) for one patient of a run; False if not in the outreach list."""
+    outreach = db.query(PatientOutreach).filter(
+        PatientOutreach.run_id == run_id,
+        PatientOutreach.patient_id == patient_id
+    ).first()
+    if not outreach:
+        return False
+    old = snapshot(outreach)
+    outreach.returned_at = returned_at or datetime.utcnow()
+    outreach.revenue_recovered = revenue
+    apply_rollup_deltas(db, [old], [snapshot(outreach)])
+    db.commit()
+    return True
+
+
+def set_outreach_outcome(db: Session, outreach_id: str, outcome: str) -> bool:
+    """
+    Set an outreach outcome; closing it marks the patient returned and credits
+    the commission. False if the row doesn't exist.
+    """
+    outreach = db.get(PatientOutreach, outreach_id)
+    if not outreach:
+        return False
+    old = snapshot(outreach)
+    outreach.outcome = outcome
+    if outcome == "closed":
+        outreach.returned_at = datetime.utcnow()
+        outreach.revenue_recovered = outreach.commission or (
+            outreach.loan_amount * COMMISSION_RATE if outreach.loan_amount else DEFAULT_CLOSED_REVENUE
+        )
+    apply_rollup_deltas(db, [old], [snapshot(outreach)])
+    db.commit()
+    return True
+
+
+def reconcile_outreach(db: Session, visits: pd.DataFrame, patient_col: str, date_col: Optional[str] = None,
+                       revenue_col: Optional[str] = None, run_id: Optional[str] = None,
+                       outcome: Optional[str] = None) -> Dict:
+    """Find and record returns for pending outreach; returns counts and revenue."""
+    pending = load_pending_outreach(db, run_id)
+    if pending.empty:
+        return {"checked": 0, "reconciled": 0, "revenue": 0.0}
+
+    returns = find_outreach_returns(pending, visits, patient_col, date_col, revenue_col)
+    apply_outreach_returns(db, returns, set_revenue=revenue_col is not None, outcome=outcome)
+    return {
+        "checked": len(pending),
+        "reconciled": len(returns),
+        "revenue": float(returns["revenue"].sum()) if revenue_col else 0.0,
+    }
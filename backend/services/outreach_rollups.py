@@ -0,0 +1,144 @@
+"""
+Outreach performance rollups for Audience Mirror.
+outreach_rollups holds per (run, segment, contact day, staleness bucket)
+counters. Every write to patient_outreach passes the affected rows' before and
+after state to apply_rollup_deltas, so the summary endpoints read a few
+rollup rows instead of scanning the outreach history.
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, cast, delete, func, insert, select, String
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from database import OutreachRollup, PatientOutreach
+
+# Columns of patient_outreach that feed the rollups
+ROLLUP_FIELDS = ("run_id", "segment", "contacted_at", "returned_at", "outcome",
+                 "revenue_recovered", "days_stale_when_contacted")
+MEASURES = ("contacted", "returned", "revenue", "with_outcome", "closed", "outcome_revenue")
+
+
+def stale_bucket(days_stale: Optional[int]) -> str:
+    """Days-to-contact bucket used by the recovery-rate analytics ('' when unknown)"""
+    if days_stale is None:
+        return ""
+    if days_stale < 7:
+        return "0-7 days"
+    if days_stale < 30:
+        return "8-30 days"
+    if days_stale < 60:
+        return "31-60 days"
+    return "60+ days"
+
+
+def rollup_key(row: Dict) -> Tuple[str, str, str, str]:
+    contacted_at = row["contacted_at"]
+    day = contacted_at.strftime("%Y-%m-%d") if contacted_at else ""
+    return row["run_id"], row["segment"] or "", day, stale_bucket(row["days_stale_when_contacted"])
+
+
+def contribution(row: Dict) -> Dict[str, float]:
+    """What one outreach row adds to its rollup bucket"""
+    contacted = row["contacted_at"] is not None
+    has_outcome = row["outcome"] is not None
+    revenue = float(row["revenue_recovered"] or 0)
+    return {
+        "contacted": int(contacted),
+        "returned": int(contacted and row["returned_at"] is not None),
+        "revenue": revenue if contacted else 0.0,
+        "with_outcome": int(has_outcome),
+        "closed": int(row["outcome"] == "closed"),
+        "outcome_revenue": revenue if has_outcome else 0.0,
+    }
+
+
+def snapshot(outreach) -> Dict:
+    """Rollup-relevant fields of a PatientOutreach instance or row mapping"""
+    if isinstance(outreach, dict):
+        return {field: outreach.get(field) for field in ROLLUP_FIELDS}
+    return {field: getattr(outreach, field) for field in ROLLUP_FIELDS}
+
+
+def apply_rollup_deltas(db: Session, before: Iterable[Optional[Dict]], after: Iterable[Optional[Dict]]):
+    """
+    Move rollup counters from each row's old state to its new one. before/after
+    are parallel snapshots; None means the row didn't exist (or was deleted).
+    Runs in the caller's transaction.
+    """
+    deltas = {}
+    for old, new in zip(before, after):
+        for row, sign in ((old, -1), (new, 1)):
+            if row is None:
+                continue
+            bucket = deltas.setdefault(rollup_key(row), dict.fromkeys(MEASURES, 0))
+            for measure, value in contribution(row).items():
+                bucket[measure] += sign * value
+
+    rows = [
+        {"run_id": key[0], "segment": key[1], "day": key[2], "stale_bucket": key[3], **values}
+        for key, values in deltas.items() if any(values.values())
+    ]
+    if rows:
+        _upsert_increments(db, rows)
+
+
+def _upsert_increments(db: Session, rows: List[Dict]):
+    dialect = db.get_bind().dialect.name
+    table = OutreachRollup.__table__
+    now = datetime.utcnow()
+    rows = [{**row, "updated_at": now} for row in rows]
+    if dialect in ("sqlite", "postgresql"):
+        module = sqlite if dialect == "sqlite" else postgresql
+        stmt = module.insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["run_id", "segment", "day", "stale_bucket"],
+            set_={**{m: table.c[m] + stmt.excluded[m] for m in MEASURES}, "updated_at": stmt.excluded.updated_at},
+        )
+        db.execute(stmt, rows)
+        return
+
+    # Other databases: read-modify-write per key
+    for row in rows:
+        existing = db.get(OutreachRollup, (row["run_id"], row["segment"], row["day"], row["stale_bucket"]))
+        if existing is None:
+            db.add(OutreachRollup(**row))
+            continue
+        for measure in MEASURES:
+            setattr(existing, measure, (getattr(existing, measure) or 0) + row[measure])
+        existing.updated_at = now
+
+
+def rollup_select():
+    """SELECT that computes every rollup row straight from patient_outreach"""
+    contacted = PatientOutreach.contacted_at.isnot(None)
+    has_outcome = PatientOutreach.outcome.isnot(None)
+    revenue = func.coalesce(PatientOutreach.revenue_recovered, 0.0)
+    days = PatientOutreach.days_stale_when_contacted
+    bucket = case(
+        (days.is_(None), ""), (days < 7, "0-7 days"), (days < 30, "8-30 days"), (days < 60, "31-60 days"),
+        else_="60+ days"
+    )
+    day = func.coalesce(cast(func.date(PatientOutreach.contacted_at), String), "")
+    segment = func.coalesce(PatientOutreach.segment, "")
+    return select(
+        PatientOutreach.run_id, segment, day, bucket,
+        func.sum(case((contacted, 1), else_=0)),
+        func.sum(case((contacted & PatientOutreach.returned_at.isnot(None), 1), else_=0)),
+        func.sum(case((contacted, revenue), else_=0.0)),
+        func.sum(case((has_outcome, 1), else_=0)),
+        func.sum(case((PatientOutreach.outcome == "closed", 1), else_=0)),
+        func.sum(case((has_outcome, revenue), else_=0.0)),
+        func.max(func.current_timestamp()),
+    ).group_by(PatientOutreach.run_id, segment, day, bucket)
+
+
+def rebuild_outreach_rollups(db: Session):
+    """Recompute every rollup row from scratch (repair / backfill)"""
+    db.execute(delete(OutreachRollup))
+    db.execute(insert(OutreachRollup).from_select(
+        ["run_id", "segment", "day", "stale_bucket", *MEASURES, "updated_at"], rollup_select()
+    ))
+    db.commit()
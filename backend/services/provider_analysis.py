@@ -3,11 +3,15 @@ Provider Concentration Analysis for Audience Mirror
 Identifies key person risk when revenue is concentrated with specific providers
 """
 
+import numpy as np
 import pandas as pd
-from collections import defaultdict
 
 
-def analyze_provider_concentration(df, vip_patients=None, min_risk_threshold=50):
+TREND_FREQUENCIES = {'monthly': 'M', 'quarterly': 'Q'}
+
+
+def analyze_provider_concentration(df, vip_patients=None, min_risk_threshold=50,
+                                   trend=None, trend_window=1):
     """
     Analyze revenue concentration by provider/injector.
 
@@ -15,6 +19,8 @@ def analyze_provider_concentration(df, vip_patients=None, min_risk_threshold=50)
         df: Patient dataframe (one row per patient or visit)
         vip_patients: Set of VIP patient IDs (optional, to check VIP concentration)
         min_risk_threshold: % threshold to flag as high risk (default 50%)
+        trend: 'monthly' or 'quarterly' to add per-period provider share (needs a visit date column)
+        trend_window: Number of trailing periods each trend point covers (default 1 = no smoothing)
 
     Returns:
         dict with provider metrics, or None if no provider data exists
@@ -35,46 +41,47 @@ def analyze_provider_concentration(df, vip_patients=None, min_risk_threshold=50)
         return None
 
     # Clean provider names and filter out nulls
-    df_clean = df[df[provider_col].notna()].copy()
-    df_clean[provider_col] = df_clean[provider_col].astype(str).str.strip()
+    df_clean = df[df[provider_col].notna()]
+    provider_names = df_clean[provider_col].astype(str).str.strip()
 
     if len(df_clean) == 0:
         return None
 
-    # Calculate revenue per provider
-    provider_revenue = defaultdict(float)
-    provider_patients = defaultdict(set)
-    provider_vip_patients = defaultdict(set)
-
-    for _, row in df_clean.iterrows():
-        provider = row[provider_col]
-        rev = float(row[revenue_col]) if pd.notna(row[revenue_col]) else 0
-        patient_id = row.get(patient_id_col) if patient_id_col else None
-
-        provider_revenue[provider] += rev
-
-        if patient_id:
-            provider_patients[provider].add(patient_id)
-
-            # Track VIP concentration
-            if vip_patients and patient_id in vip_patients:
-                provider_vip_patients[provider].add(patient_id)
+    # Providers coded in order of first appearance; revenue summed per provider
+    provider_codes, provider_labels = pd.factorize(provider_names)
+    revenue = pd.to_numeric(df_clean[revenue_col], errors='coerce').fillna(0).to_numpy(dtype=float)
+    provider_revenue = np.bincount(provider_codes, weights=revenue, minlength=len(provider_labels))
+
+    # Distinct patients (and VIP patients) per provider
+    patient_counts = np.zeros(len(provider_labels), dtype=int)
+    vip_counts = np.zeros(len(provider_labels), dtype=int)
+    if patient_id_col:
+        patient_ids = df_clean[patient_id_col].reset_index(drop=True)
+        has_patient = patient_ids.notna() & (patient_ids.astype(str) != '') & (patient_ids.astype(str) != '0')
+        pairs = pd.DataFrame({'provider': provider_codes, 'patient_id': patient_ids})[has_patient].drop_duplicates()
+        patient_counts = np.bincount(pairs['provider'], minlength=len(provider_labels))
+
+        # Track VIP concentration
+        if vip_patients:
+            vip_pairs = pairs[pairs['patient_id'].isin(vip_patients)]
+            vip_counts = np.bincount(vip_pairs['provider'], minlength=len(provider_labels))
 
     # Calculate total revenue
-    total_revenue = sum(provider_revenue.values())
+    total_revenue = sum(provider_revenue.tolist())
 
     if total_revenue == 0:
         return None
 
     # Build provider stats
     providers = []
-    for provider, rev in sorted(provider_revenue.items(), key=lambda x: x[1], reverse=True):
+    for i in sorted(range(len(provider_labels)), key=lambda i: provider_revenue[i], reverse=True):
+        rev = float(provider_revenue[i])
         revenue_pct = (rev / total_revenue * 100) if total_revenue > 0 else 0
-        patient_count = len(provider_patients[provider])
-        vip_count = len(provider_vip_patients[provider])
+        patient_count = int(patient_counts[i])
+        vip_count = int(vip_counts[i])
 
         providers.append({
-            'name': provider,
+            'name': provider_labels[i],
             'revenue': int(rev),
             'revenue_pct': round(revenue_pct, 1),
             'patient_count': patient_count,
@@ -100,7 +107,7 @@ def analyze_provider_concentration(df, vip_patients=None, min_risk_threshold=50)
                 'total_vips': total_vips
             }
 
-    return {
+    result = {
         'has_provider_data': True,
         'total_providers': len(providers),
         'providers': providers,
@@ -109,3 +116,78 @@ def analyze_provider_concentration(df, vip_patients=None, min_risk_threshold=50)
         'vip_concentration': vip_concentration,
         'risk_threshold': min_risk_threshold
     }
+
+    if trend:
+        result['trend'] = _provider_share_trend(
+            df_clean, provider_codes, provider_labels, revenue,
+            top_provider['name'] if top_provider else None, trend, trend_window
+        )
+
+    return result
+
+
+def _provider_share_trend(df_clean, provider_codes, provider_labels, revenue, top_provider_name,
+                          trend, trend_window=1):
+    """
+    Provider revenue share per month/quarter from the already-coded arrays.
+    Every period between the first and last visit gets a point (zero revenue
+    when nobody visited), so with trend_window > 1 each point is a trailing sum
+    over that many calendar periods. Returns None when the data has no usable visit dates.
+    """
+    freq = TREND_FREQUENCIES.get(trend)
+    date_col = next((c for c in ['visit_date', 'date', 'appointment_date'] if c in df_clean.columns), None)
+    if not freq or not date_col:
+        return None
+
+    dates = pd.to_datetime(df_clean[date_col], errors='coerce').to_numpy()
+    dated = ~pd.isna(dates)
+    if not dated.any():
+        return None
+
+    periods = pd.PeriodIndex(dates[dated], freq=freq)
+    period_labels = pd.period_range(periods.min(), periods.max(), freq=freq)
+    period_codes = periods.asi8 - period_labels[0].ordinal
+    n_periods, n_providers = len(period_labels), len(provider_labels)
+
+    # Period x provider revenue matrix in one bincount over combined codes
+    combined = period_codes * n_providers + provider_codes[dated]
+    matrix = np.bincount(combined, weights=revenue[dated], minlength=n_periods * n_providers)
+    matrix = matrix.reshape(n_periods, n_providers)
+
+    window = max(1, int(trend_window))
+    if window > 1:
+        cumulative = np.cumsum(matrix, axis=0)
+        shifted = np.vstack([np.zeros((window, n_providers)), cumulative[:-window]])[:n_periods]
+        matrix = cumulative - shifted
+
+    totals = matrix.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = np.where(totals[:, None] > 0, matrix / totals[:, None] * 100, 0.0)
+
+    top_idx = list(provider_labels).index(top_provider_name) if top_provider_name in list(provider_labels) else None
+
+    points = []
+    for t, period in enumerate(period_labels):
+        leader = int(np.argmax(shares[t]))
+        points.append({
+            'period': str(period),
+            'total_revenue': int(totals[t]),
+            'top_provider': provider_labels[leader] if totals[t] > 0 else None,
+            'top_provider_pct': round(float(shares[t, leader]), 1),
+            'overall_top_provider_pct': round(float(shares[t, top_idx]), 1) if top_idx is not None else None,
+            'provider_share': {
+                provider_labels[i]: round(float(shares[t, i]), 1)
+                for i in range(n_providers) if matrix[t, i] != 0
+            },
+        })
+
+    drift = None
+    if top_idx is not None and len(points) >= 2:
+        drift = round(points[-1]['overall_top_provider_pct'] - points[0]['overall_top_provider_pct'], 1)
+
+    return {
+        'frequency': trend,
+        'window': window,
+        'periods': points,
+        'top_provider_drift': drift,  # change in the overall top provider's share, first -> last period
+    }
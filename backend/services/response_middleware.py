@@ -0,0 +1,216 @@
+"""
+Response compression and payload metrics for Audience Mirror.
+CompressionMiddleware brotli- or gzip-encodes responses above a size
+threshold (brotli only when the package is installed and the client accepts
+it), streaming responses included, and records per-endpoint payload size,
+bytes sent and serialization time in ResponseMetrics.
+"""
+
+import os
+import re
+import threading
+import zlib
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+# Already compressed, or must reach the client unbuffered
+SKIP_CONTENT_TYPES = ("text/event-stream", "application/gzip", "application/zip",
+                      "application/vnd.apache.parquet", "image/", "audio/", "video/")
+
+SERVER_TIMING_PATTERN = re.compile(r"serialize;dur=([0-9.]+)")
+
+
+class ResponseMetrics:
+    """Thread-safe per-endpoint payload and serialization stats."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict] = {}
+
+    def record(self, endpoint: str, raw_bytes: int, sent_bytes: int, serialize_ms: Optional[float],
+               encoding: Optional[str]):
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, {
+                "requests": 0, "raw_bytes": 0, "sent_bytes": 0, "max_raw_bytes": 0,
+                "serialized": 0, "serialize_ms": 0.0, "max_serialize_ms": 0.0, "encodings": {},
+            })
+            stats["requests"] += 1
+            stats["raw_bytes"] += raw_bytes
+            stats["sent_bytes"] += sent_bytes
+            stats["max_raw_bytes"] = max(stats["max_raw_bytes"], raw_bytes)
+            if serialize_ms is not None:
+                stats["serialized"] += 1
+                stats["serialize_ms"] += serialize_ms
+                stats["max_serialize_ms"] = max(stats["max_serialize_ms"], serialize_ms)
+            key = encoding or "identity"
+            stats["encodings"][key] = stats["encodings"].get(key, 0) + 1
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            items = [(endpoint, dict(stats, encodings=dict(stats["encodings"])))
+                     for endpoint, stats in self._stats.items()]
+        report = {}
+        for endpoint, s in sorted(items, key=lambda item: -item[1]["raw_bytes"]):
+            report[endpoint] = {
+                "requests": s["requests"],
+                "avg_payload_bytes": round(s["raw_bytes"] / s["requests"]),
+                "max_payload_bytes": s["max_raw_bytes"],
+                "avg_sent_bytes": round(s["sent_bytes"] / s["requests"]),
+                "compression_ratio": round(s["raw_bytes"] / s["sent_bytes"], 2) if s["sent_bytes"] else None,
+                "avg_serialize_ms": round(s["serialize_ms"] / s["serialized"], 2) if s["serialized"] else None,
+                "max_serialize_ms": round(s["max_serialize_ms"], 2) if s["serialized"] else None,
+                "encodings": s["encodings"],
+            }
+        return report
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+RESPONSE_METRICS = ResponseMetrics()
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """br if accepted and available, else gzip if accepted."""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name] = quality
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0 or accepted.get("*", 0) > 0:
+        return "gzip"
+    return None
+
+
+class _Encoder:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._brotli.process(data) if self.encoding == "br" else self._zlib.compress(data)
+
+    def finish(self) -> bytes:
+        return self._brotli.finish() if self.encoding == "br" else self._zlib.flush()
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware so streaming responses stay streaming."""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MINIMUM_SIZE,
+                 metrics: ResponseMetrics = RESPONSE_METRICS):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        responder = _Responder(self, scope, send, encoding)
+        await self.app(scope, receive, responder.send)
+
+
+class _Responder:
+    def __init__(self, middleware: CompressionMiddleware, scope, send, encoding: Optional[str]):
+        self.middleware = middleware
+        self.scope = scope
+        self.downstream = send
+        self.encoding = encoding
+        self.start = None
+        self.encoder: Optional[_Encoder] = None
+        self.started = False
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body":
+            await self.downstream(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        self.raw_bytes += len(body)
+
+        if not self.started:
+            self.started = True
+            if self._should_compress(body, more_body):
+                self.encoder = _Encoder(self.encoding)
+                headers = self._encoding_headers()
+                body = self.encoder.compress(body)
+                if not more_body:
+                    # Whole body in one message, so Content-Length can be exact
+                    body += self.encoder.finish()
+                    headers.append((b"content-length", str(len(body)).encode("latin-1")))
+                self.start = dict(self.start, headers=headers)
+            await self.downstream(self.start)
+        elif self.encoder is not None:
+            body = self.encoder.compress(body)
+            if not more_body:
+                body += self.encoder.finish()
+
+        self.sent_bytes += len(body)
+        await self.downstream({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        if not more_body:
+            self._record()
+
+    def _should_compress(self, body: bytes, more_body: bool) -> bool:
+        if self.encoding is None or self.start is None:
+            return False
+        headers = {k.lower(): v for k, v in self.start.get("headers", [])}
+        if b"content-encoding" in headers:
+            return False
+        content_type = headers.get(b"content-type", b"").decode("latin-1")
+        if not content_type or content_type.startswith(SKIP_CONTENT_TYPES):
+            return False
+        return more_body or len(body) >= self.middleware.minimum_size
+
+    def _encoding_headers(self):
+        headers = [(k, v) for k, v in self.start.get("headers", []) if k.lower() != b"content-length"]
+        headers.append((b"content-encoding", self.encoding.encode("latin-1")))
+        for i, (key, value) in enumerate(headers):
+            if key.lower() == b"vary":
+                if b"accept-encoding" not in value.lower():
+                    headers[i] = (key, value + b", Accept-Encoding")
+                return headers
+        headers.append((b"vary", b"Accept-Encoding"))
+        return headers
+
+    def _record(self):
+        route = self.scope.get("route")
+        endpoint = getattr(route, "path", None) or "unmatched"
+        serialize_ms = None
+        for key, value in (self.start or {}).get("headers", []):
+            if key.lower() == b"server-timing":
+                match = SERVER_TIMING_PATTERN.search(value.decode("latin-1"))
+                if match:
+                    serialize_ms = float(match.group(1))
+        self.middleware.metrics.record(
+            f"{self.scope.get('method', 'GET')} {endpoint}", self.raw_bytes, self.sent_bytes, serialize_ms,
+            self.encoder.encoding if self.encoder else None
+        )
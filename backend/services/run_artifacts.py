@@ -0,0 +1,57 @@
+"""
+Per-run result artifacts for Audience Mirror.
+The large analysis outputs (top segments, map points, dominant profile,
+strategic insights, dataset summary) are stored zlib-compressed in analysis_run_artifacts, one
+row per (run, name), and only loaded by the endpoints that need them.
+"""
+
+import hashlib
+import json
+import zlib
+from typing import Any, Dict, Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from database import AnalysisRunArtifact
+
+RUN_ARTIFACTS = ("top_segments", "map_points", "dominant_profile", "strategic_insights", "dataset_summary")
+ENCODING = "json+zlib"
+
+
+def encode_artifact(value: Any) -> tuple:
+    """(compressed payload, uncompressed size, sha256 digest) for a JSON-serializable value"""
+    raw = json.dumps(value, separators=(",", ":"), default=str).encode("utf-8")
+    return zlib.compress(raw, 6), len(raw), hashlib.sha256(raw).hexdigest()
+
+
+def decode_artifact(payload: bytes, encoding: str = ENCODING) -> Any:
+    if encoding != ENCODING:
+        raise ValueError(f"Unknown artifact encoding: {encoding}")
+    return json.loads(zlib.decompress(payload))
+
+
+def save_run_artifacts(db: Session, run_id: str, artifacts: Dict[str, Any]):
+    """Insert or replace artifacts for a run (caller commits)."""
+    for name, value in artifacts.items():
+        if name not in RUN_ARTIFACTS:
+            raise ValueError(f"Unknown run artifact: {name}")
+        payload, raw_bytes, digest = encode_artifact(value)
+        db.merge(AnalysisRunArtifact(
+            run_id=run_id, name=name, encoding=ENCODING, payload=payload, raw_bytes=raw_bytes, digest=digest
+        ))
+
+
+def load_run_artifacts(db: Session, run_id: str, names: Iterable[str] = RUN_ARTIFACTS) -> Dict[str, Any]:
+    """Decoded artifacts by name; missing ones are None."""
+    names = list(names)
+    rows = db.query(AnalysisRunArtifact.name, AnalysisRunArtifact.encoding, AnalysisRunArtifact.payload).filter(
+        AnalysisRunArtifact.run_id == run_id,
+        AnalysisRunArtifact.name.in_(names)
+    ).all()
+    found = {name: decode_artifact(payload, encoding) for name, encoding, payload in rows}
+    return {name: found.get(name) for name in names}
+
+
+def load_run_artifact(db: Session, run_id: str, name: str, default: Optional[Any] = None) -> Any:
+    value = load_run_artifacts(db, run_id, [name])[name]
+    return default if value is None else value
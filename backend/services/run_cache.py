@@ -0,0 +1,85 @@
+"""
+HTTP caching for completed Audience Mirror runs.
+A run's results never change once it is done, so responses derived from it
+carry a weak ETag built from the run, its dataset and the digests of the
+artifacts they read. A matching If-None-Match gets a bodiless 304 before any
+artifact is decoded or CSV re-read, and Cache-Control lets the browser reuse
+its copy for RUN_CACHE_MAX_AGE seconds without asking at all.
+Responses that also depend on today's date (stale-preapproval counts) add
+the date to their ETag and are only reused until midnight.
+"""
+
+import hashlib
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from fastapi import Request, Response
+from sqlalchemy.orm import Session
+
+from database import AnalysisRun, AnalysisRunArtifact
+from .run_artifacts import RUN_ARTIFACTS
+
+# Bump when the shape of a cached response changes, so clients drop old copies
+ETAG_VERSION = "1"
+RUN_CACHE_MAX_AGE = int(os.getenv("RUN_CACHE_MAX_AGE", "3600"))
+
+
+def run_etag(db: Session, run_id: str, names: Iterable[str] = RUN_ARTIFACTS, *variant) -> Optional[str]:
+    """
+    Weak ETag for a response built from run_id's artifacts `names`, varied by
+    any extra values (endpoint, query parameters). None unless the run is done.
+    """
+    run = db.query(AnalysisRun.status, AnalysisRun.completed_at, AnalysisRun.dataset_id,
+                   AnalysisRun.filtered_dataset_path).filter(AnalysisRun.id == run_id).first()
+    if run is None or run.status != "done":
+        return None
+    digests = db.query(AnalysisRunArtifact.name, AnalysisRunArtifact.digest).filter(
+        AnalysisRunArtifact.run_id == run_id,
+        AnalysisRunArtifact.name.in_(list(names))
+    ).all()
+
+    h = hashlib.sha256()
+    for part in (ETAG_VERSION, run_id, run.completed_at, run.dataset_id, run.filtered_dataset_path,
+                 *sorted(f"{name}={digest}" for name, digest in digests), *variant):
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\0")
+    return f'W/"{h.hexdigest()[:32]}"'
+
+
+def daily_variant(now: Optional[datetime] = None) -> Tuple[str, int]:
+    """
+    (today's date, seconds left in the day) for responses computed against the
+    current date: pass the date as an ETag variant and the seconds as max_age.
+    """
+    now = now or datetime.now()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return now.date().isoformat(), max(1, min(RUN_CACHE_MAX_AGE, int((midnight - now).total_seconds())))
+
+
+def run_cache_headers(etag: Optional[str], max_age: int = RUN_CACHE_MAX_AGE) -> Dict[str, str]:
+    """ETag + Cache-Control for a completed run; no-cache while it can still change."""
+    if etag is None:
+        return {"Cache-Control": "no-cache"}
+    return {"ETag": etag, "Cache-Control": f"private, max-age={max_age}"}
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison against an If-None-Match header ('*' or a list of tags)."""
+    if not if_none_match:
+        return False
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+
+def not_modified(request: Request, etag: Optional[str], max_age: int = RUN_CACHE_MAX_AGE) -> Optional[Response]:
+    """A 304 response if the client already holds this version, else None."""
+    if etag is None or not etag_matches(request.headers.get("if-none-match"), etag):
+        return None
+    return Response(status_code=304, headers=run_cache_headers(etag, max_age))
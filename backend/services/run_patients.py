@@ -0,0 +1,103 @@
+"""
+Persisted labeled patients for Audience Mirror runs.
+A run's scored patients (segment, value score, cohort label) are written to
+run_patients once, and exports read them back in chunks ordered by value
+score instead of re-aggregating and re-scoring the upload on every request.
+The run records its patient count and export columns once they are written.
+Emails and phones are stored only as customer-match hashes.
+"""
+
+from typing import Callable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.orm import Session
+
+from database import AnalysisRun, RunPatient
+from .customer_match import HASH_COLUMNS, hash_pii
+
+RUN_PATIENT_COLUMNS = ("patient_id", "zip_code", "behavioral_segment", "value_score", "cohort",
+                       "revenue", "visits_per_year")
+# Exported only when the upload had them (the rest always are)
+OPTIONAL_RUN_PATIENT_COLUMNS = ("revenue", "visits_per_year")
+RUN_PATIENT_TYPES = {"patient_id": "string", "zip_code": "string", "behavioral_segment": "string",
+                     "value_score": "float", "cohort": "string", "revenue": "float", "visits_per_year": "float"}
+# Share of patients (by value score) labeled with the run's cohort
+TOP_COHORT_SHARE = 0.2
+INSERT_CHUNK = 5000
+EXPORT_CHUNK = 5000
+
+
+def label_patients(df: pd.DataFrame, cohort_label: str) -> pd.DataFrame:
+    """Top 20% by value_score get cohort_label, the rest General; sorted by score."""
+    if df.empty:
+        return df.assign(cohort=pd.Series(dtype=object))
+    top_count = max(1, int(len(df) * TOP_COHORT_SHARE))
+    df = df.sort_values("value_score", ascending=False).reset_index(drop=True)
+    df["cohort"] = np.where(df.index < top_count, cohort_label, "General")
+    return df
+
+
+def _clean(value, cast):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return cast(value)
+
+
+def persist_run_patients(db: Session, run_id: str, df: pd.DataFrame) -> int:
+    """
+    Replace the stored patients of run_id with a labeled patient frame and
+    record them on the run (commits). email / phone columns, if present, are
+    stored hashed.
+    """
+    columns = [c for c in RUN_PATIENT_COLUMNS if c in df.columns]
+    export_columns = [c for c in RUN_PATIENT_COLUMNS if c not in OPTIONAL_RUN_PATIENT_COLUMNS or c in df.columns]
+    casts = {name: str if RUN_PATIENT_TYPES[name] == "string" else float for name in columns}
+    if "email" in df.columns or "phone" in df.columns:
+        df = pd.concat([df[columns], hash_pii(df)], axis=1)
+        columns += list(HASH_COLUMNS)
+        casts.update(dict.fromkeys(HASH_COLUMNS, str))
+
+    db.execute(delete(RunPatient).where(RunPatient.run_id == run_id))
+    for start in range(0, len(df), INSERT_CHUNK):
+        chunk = df.iloc[start:start + INSERT_CHUNK][columns]
+        db.bulk_insert_mappings(RunPatient, [
+            {"run_id": run_id, **{name: _clean(row[i], casts[name]) for i, name in enumerate(columns)}}
+            for row in chunk.itertuples(index=False, name=None)
+        ])
+    db.execute(update(AnalysisRun).where(AnalysisRun.id == run_id).values(
+        run_patient_count=len(df), run_patient_columns=export_columns
+    ))
+    db.commit()
+    return len(df)
+
+
+def persisted_patient_columns(db: Session, run_id: str) -> Optional[List[str]]:
+    """Export columns of run_id's persisted patients, or None if they were never persisted."""
+    return db.query(AnalysisRun.run_patient_columns).filter(AnalysisRun.id == run_id).scalar()
+
+
+def iter_run_patient_chunks(session_factory: Callable[[], Session], run_id: str,
+                            chunk_size: int = EXPORT_CHUNK, columns: Optional[List[str]] = None,
+                            segment: Optional[str] = None, hashed_only: bool = False) -> Iterator[list]:
+    """
+    Row tuples of a run's patients (optionally one behavioral segment, or only
+    those with a hashed email/phone), highest value score first, chunk_size at
+    a time. Opens its own session so it can outlive the request's.
+    """
+    columns = columns or list(RUN_PATIENT_COLUMNS)
+    query = select(*[getattr(RunPatient, c) for c in columns]).where(RunPatient.run_id == run_id)
+    if segment:
+        query = query.where(RunPatient.behavioral_segment == segment)
+    if hashed_only:
+        query = query.where(or_(*[getattr(RunPatient, c).isnot(None) for c in HASH_COLUMNS]))
+    db = session_factory()
+    try:
+        result = db.execute(
+            query.order_by(RunPatient.value_score.desc(), RunPatient.id).execution_options(yield_per=chunk_size)
+        )
+        for partition in result.partitions():
+            yield [tuple(row) for row in partition]
+    finally:
+        db.close()
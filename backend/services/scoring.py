@@ -3,10 +3,12 @@ import pandas as pd
 from math import radians, cos, sin, asin, sqrt
 from sklearn.linear_model import Ridge
 from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.isotonic import IsotonicRegression
 from typing import Optional, Tuple, List
+import os
 import warnings
+from collections import OrderedDict
 from pydantic import BaseModel, Field
 from typing import List, Optional, Literal, Dict
 from datetime import datetime
@@ -125,10 +127,119 @@ def compute_accessibility_score(zip_demographics: pd.DataFrame, practice_zip: st
     
     return result
 
-def fit_lifestyle_cohorts(zip_features):
+COHORT_FEATURES = ['population', 'median_income', 'competitors', 'distance_miles']
+COHORT_NAMES = ['Luxury Clients', 'Comfort Spenders', 'Budget Conscious']
+
+# Above this many ZIPs we switch from full KMeans to MiniBatchKMeans
+MINIBATCH_ZIP_THRESHOLD = 5000
+# Fitted cohort models kept in memory, least recently used evicted first
+COHORT_MODEL_CACHE_SIZE = int(os.getenv("COHORT_MODEL_CACHE_SIZE", "32"))
+
+
+class LifestyleCohortModel:
+    """
+    Cached MiniBatchKMeans cohort model for large ZIP universes.
+
+    The scaler is frozen after the first fit so centroids stay in a stable
+    feature space; new ZIPs refine the centroids through partial_fit and are
+    labelled with predict instead of a full refit.
+    """
+
+    def __init__(self, n_clusters: int = 3, batch_size: int = 2048, random_state: int = 42):
+        self.n_clusters = n_clusters
+        self.scaler = StandardScaler()
+        self.kmeans = MiniBatchKMeans(
+            n_clusters=n_clusters,
+            random_state=random_state,
+            batch_size=batch_size,
+            n_init=3,
+            max_iter=100,
+            tol=1e-4
+        )
+        self.name_mapping: Dict[int, str] = {}
+        self.n_seen = 0
+
+    @staticmethod
+    def _features(zip_features: pd.DataFrame) -> np.ndarray:
+        return zip_features.reindex(columns=COHORT_FEATURES).fillna(0).to_numpy(dtype=float)
+
+    def _refresh_names(self):
+        # Rank centroids by income in original units (richest -> Luxury Clients)
+        centers = self.scaler.inverse_transform(self.kmeans.cluster_centers_)
+        income_idx = COHORT_FEATURES.index('median_income')
+        order = np.argsort(-centers[:, income_idx], kind='stable')
+        self.name_mapping = {int(cluster): COHORT_NAMES[rank] for rank, cluster in enumerate(order)}
+
+    def _names(self, cluster_labels: np.ndarray) -> List[str]:
+        return [self.name_mapping[int(label)] for label in cluster_labels]
+
+    def fit(self, zip_features: pd.DataFrame) -> List[str]:
+        X_scaled = self.scaler.fit_transform(self._features(zip_features))
+        cluster_labels = self.kmeans.fit_predict(X_scaled)
+        self.n_seen = len(X_scaled)
+        self._refresh_names()
+        return self._names(cluster_labels)
+
+    def partial_fit(self, zip_features: pd.DataFrame) -> List[str]:
+        """Update centroids with newly seen ZIPs and return their cohorts."""
+        if len(zip_features) == 0:
+            return []
+        X_scaled = self.scaler.transform(self._features(zip_features))
+        self.kmeans.partial_fit(X_scaled)
+        self.n_seen += len(X_scaled)
+        self._refresh_names()
+        return self._names(self.kmeans.predict(X_scaled))
+
+    def predict(self, zip_features: pd.DataFrame) -> List[str]:
+        if len(zip_features) == 0:
+            return []
+        X_scaled = self.scaler.transform(self._features(zip_features))
+        return self._names(self.kmeans.predict(X_scaled))
+
+
+# Fitted MiniBatch models keyed by caller-supplied cache key (e.g. dataset_id), LRU-bounded
+_cohort_model_cache: "OrderedDict[str, LifestyleCohortModel]" = OrderedDict()
+
+
+def get_cached_cohort_model(cache_key: str) -> Optional[LifestyleCohortModel]:
+    model = _cohort_model_cache.get(cache_key)
+    if model is not None:
+        _cohort_model_cache.move_to_end(cache_key)
+    return model
+
+
+def _cache_cohort_model(cache_key: str, model: LifestyleCohortModel):
+    _cohort_model_cache[cache_key] = model
+    _cohort_model_cache.move_to_end(cache_key)
+    while len(_cohort_model_cache) > COHORT_MODEL_CACHE_SIZE:
+        _cohort_model_cache.popitem(last=False)
+
+
+def assign_lifestyle_cohorts(zip_features: pd.DataFrame, cache_key: str,
+                             update: bool = False) -> Optional[List[str]]:
+    """
+    Assign cohorts to ZIPs using a cached MiniBatch model (predict, no refit).
+    Lookups leave the centroids alone; pass update=True to opt in to letting
+    the new ZIPs nudge them (partial_fit).
+    Returns None when no model has been cached for this key yet.
+    """
+    model = get_cached_cohort_model(cache_key)
+    if model is None:
+        return None
+    if update:
+        return model.partial_fit(zip_features)
+    return model.predict(zip_features)
+
+
+def fit_lifestyle_cohorts(zip_features, n_clusters=None, mode="auto", cache_key=None):
     """
     Adaptive clustering that handles variable dataset sizes robustly.
     Falls back to simpler methods when clustering isn't viable.
+
+    mode: "kmeans" (full KMeans), "minibatch" (MiniBatchKMeans with cached
+    centroids) or "auto" (minibatch above MINIBATCH_ZIP_THRESHOLD ZIPs).
+    When cache_key is given in minibatch mode, the fitted model is kept so
+    later calls can use assign_lifestyle_cohorts() instead of refitting.
     """
     n_samples = len(zip_features)
 
@@ -137,21 +248,30 @@ def fit_lifestyle_cohorts(zip_features):
         return _create_rule_based_cohorts(zip_features)
 
     # For small datasets, reduce cluster count appropriately
+    max_clusters = min(n_clusters or 3, len(COHORT_NAMES))
     if n_samples < 10:
-        n_clusters = min(3, n_samples - 1)
+        n_clusters = min(max_clusters, n_samples - 1)
     else:
-        n_clusters = min(3, len(zip_features))  # Use fewer clusters for small datasets
+        n_clusters = min(max_clusters, n_samples)  # Use fewer clusters for small datasets
 
-    features_to_cluster = [
-        'population', 'median_income', 'competitors', 'distance_miles'
-    ]
-
-    X = zip_features[features_to_cluster].fillna(0)
+    X = zip_features[COHORT_FEATURES].fillna(0)
 
     # Check for sufficient variance - clustering fails on identical data
     if X.std().sum() < 1e-10:
         return _create_rule_based_cohorts(zip_features)
 
+    use_minibatch = mode == "minibatch" or (mode == "auto" and n_samples >= MINIBATCH_ZIP_THRESHOLD)
+    if use_minibatch:
+        try:
+            model = LifestyleCohortModel(n_clusters=n_clusters)
+            cohort_names = model.fit(zip_features)
+            if cache_key is not None:
+                _cache_cohort_model(cache_key, model)
+            return model.kmeans, model.scaler, cohort_names
+        except Exception as e:
+            print(f"[WARNING] MiniBatch clustering failed: {e}. Falling back to rule-based segmentation.")
+            return _create_rule_based_cohorts(zip_features)
+
     scaler = StandardScaler()
     X_scaled = scaler.fit_transform(X)
 
@@ -177,21 +297,19 @@ def _create_rule_based_cohorts(zip_features):
     Rule-based segmentation for when clustering isn't viable.
     Uses income and competition thresholds to assign cohorts.
     """
-    cohort_labels = []
-
-    for _, row in zip_features.iterrows():
-        income = row.get('median_income', 0)
-        competitors = row.get('competitors', 0)
-
-        # Updated 3-cohort logic with new names
-        if income > 90000 and competitors <= 2:
-            cohort_labels.append('Luxury Clients')
-        elif income > 50000:
-            cohort_labels.append('Comfort Spenders') 
-        else:
-            cohort_labels.append('Budget Conscious')
+    income = zip_features['median_income'] if 'median_income' in zip_features.columns else pd.Series(0, index=zip_features.index)
+    competitors = zip_features['competitors'] if 'competitors' in zip_features.columns else pd.Series(0, index=zip_features.index)
+    income = pd.to_numeric(income, errors='coerce').to_numpy(dtype=float)
+    competitors = pd.to_numeric(competitors, errors='coerce').to_numpy(dtype=float)
+
+    # Updated 3-cohort logic with new names
+    cohort_labels = np.select(
+        [(income > 90000) & (competitors <= 2), income > 50000],
+        ['Luxury Clients', 'Comfort Spenders'],
+        default='Budget Conscious'
+    )
 
-    return None, None, cohort_labels  # Keep same return structure
+    return None, None, cohort_labels.tolist()  # Keep same return structure
 
 def _assign_cohort_names(zip_features, cluster_labels, n_clusters):
     """
@@ -217,10 +335,8 @@ def _assign_cohort_names(zip_features, cluster_labels, n_clusters):
     cluster_profiles.sort(key=lambda x: x['income'], reverse=True)
 
     name_mapping = {}
-    available_names = ['Luxury Clients', 'Comfort Spenders', 'Budget Conscious']
-    
     for idx, profile in enumerate(cluster_profiles):
-        name_mapping[profile['cluster']] = available_names[idx]
+        name_mapping[profile['cluster']] = COHORT_NAMES[idx]
 
     return [name_mapping[label] for label in cluster_labels]
 
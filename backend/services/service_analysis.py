@@ -3,9 +3,14 @@ Service Analysis for Audience Mirror
 Calculates service co-occurrence, bundles, cross-sell opportunities, and rebooking rates
 """
 
-from collections import defaultdict
 import pandas as pd
 import numpy as np
+from scipy import sparse
+
+from services.visit_index import build_visit_index, serviced_visits, patient_first_visits
+
+# Rebooking/gateway analyses don't read the procedure_type fallback column
+REBOOKING_TREATMENT_COLUMNS = ['treatment', 'procedure', 'service']
 
 
 def analyze_services(df, treatment_col='treatment', revenue_col='revenue', patient_id_col='patient_id'):
@@ -44,95 +49,103 @@ def analyze_services(df, treatment_col='treatment', revenue_col='revenue', patie
     
     df = df.copy()
     df['parsed_treatments'] = df[treatment_col].apply(parse_treatments)
-    
-    # Count patients per service and revenue per service
-    service_patients = defaultdict(set)
-    service_revenue = defaultdict(float)
-    
-    for idx, row in df.iterrows():
-        treatments = row['parsed_treatments']
-        patient_id = row.get(patient_id_col, idx)
-        patient_revenue = row.get(revenue_col, 0) if revenue_col else 0
-        
-        revenue_per_treatment = patient_revenue / len(treatments) if treatments else 0
-        
-        for treatment in treatments:
-            service_patients[treatment].add(patient_id)
-            service_revenue[treatment] += revenue_per_treatment
-    
-    service_patient_count = {s: len(patients) for s, patients in service_patients.items()}
-    
+
+    # Patient x service incidence matrix (sparse), plus revenue per service
+    incidence = build_service_incidence(df, 'parsed_treatments', revenue_col, patient_id_col)
+    services = incidence['services']
+    patient_keys = incidence['patient_keys']
+    X = incidence['matrix']
+    service_patient_counts = incidence['patient_counts']
+    service_revenue = {service: float(rev) for service, rev in zip(services, incidence['revenue'])}
+    service_patient_count = {service: int(n) for service, n in zip(services, service_patient_counts)}
+    service_index = {service: i for i, service in enumerate(services)}
+
     sorted_services = sorted(service_revenue.items(), key=lambda x: x[1], reverse=True)
     top_services = [s[0] for s in sorted_services[:5]]
 
     result['top_services'] = top_services
-    result['service_revenue'] = dict(service_revenue)
+    result['service_revenue'] = service_revenue
     result['service_patient_count'] = service_patient_count
 
     print(f"[SERVICE ANALYSIS] Top 5 services by revenue: {top_services}")
     print(f"[SERVICE ANALYSIS] Service revenue breakdown: {dict(sorted_services[:5])}")
-    
+
+    # Indexed first-row-per-patient frame for contact detail lookups
+    patient_lookup = _build_patient_lookup(df, patient_id_col)
+
     # Helper function to extract patient info
-    def extract_patient_info(patient_ids, df, patient_id_col, limit=500):
+    def extract_patient_info(patient_mask, limit=500):
         patients = []
-        for pid in list(patient_ids)[:limit]:
-            rows = df[df[patient_id_col] == pid] if patient_id_col else pd.DataFrame()
-            if len(rows) > 0:
-                row = rows.iloc[0]
-                patients.append({
-                    'patient_id': str(pid),
-                    'name': str(row.get('name', row.get('patient_name', row.get('first_name', '')))),
-                    'phone': str(row.get('phone', row.get('mobile', ''))),
-                    'email': str(row.get('email', '')),
-                })
+        for pid, row in _lookup_patient_rows(patient_lookup, patient_keys[patient_mask][:limit]):
+            patients.append({
+                'patient_id': str(pid),
+                'name': str(row.get('name', row.get('patient_name', row.get('first_name', '')))),
+                'phone': str(row.get('phone', row.get('mobile', ''))),
+                'email': str(row.get('email', '')),
+            })
         return patients
 
-    # Calculate co-occurrence matrix
-    significant_services = [s for s, count in service_patient_count.items() if count >= 5]
+    def service_column(service):
+        return X[:, service_index[service]].toarray().ravel() > 0
+
+    # Calculate co-occurrence matrix with a single sparse product
+    significant_idx = np.flatnonzero(service_patient_counts >= 5)
+    significant_services = [services[i] for i in significant_idx]
+
+    X_sig = X[:, significant_idx]
+    overlap_matrix = (X_sig.T @ X_sig).toarray()
+    n_sig = service_patient_counts[significant_idx].astype(float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct_a_also_b_matrix = np.rint(overlap_matrix / n_sig[:, None] * 100)  # % of A patients who also get B
+        pct_b_also_a_matrix = np.rint(overlap_matrix / n_sig[None, :] * 100)  # % of B patients who also get A
+
+    # Only include if at least one direction has 20%+ overlap
+    candidate_pairs = np.argwhere(
+        np.triu(overlap_matrix > 0, k=1) &
+        (np.maximum(pct_a_also_b_matrix, pct_b_also_a_matrix) >= 20)
+    )
 
     co_occurrence = {}
-    for i, service_a in enumerate(significant_services):
-        patients_a = service_patients[service_a]
-        for service_b in significant_services[i+1:]:
-            patients_b = service_patients[service_b]
-
-            overlap = len(patients_a & patients_b)
-            if overlap > 0:
-                # Calculate overlap in both directions
-                pct_a_also_b = round(overlap / len(patients_a) * 100)  # % of A patients who also get B
-                pct_b_also_a = round(overlap / len(patients_b) * 100)  # % of B patients who also get A
-
-                # Calculate untapped potential
-                a_only_count = len(patients_a - patients_b)
-                b_only_count = len(patients_b - patients_a)
-
-                # Only include if at least one direction has 20%+ overlap
-                if max(pct_a_also_b, pct_b_also_a) >= 20:
-                    # Calculate average revenue per service
-                    rev_a = service_revenue.get(service_a, 0) / max(len(patients_a), 1)
-                    rev_b = service_revenue.get(service_b, 0) / max(len(patients_b), 1)
-                    avg_bundle_value = rev_a + rev_b
-
-                    # Revenue score: prioritize high-value bundles with good overlap
-                    revenue_score = overlap * avg_bundle_value
-
-                    pair_key = f"{service_a}|{service_b}"
-                    co_occurrence[pair_key] = {
-                        'service_a': service_a,
-                        'service_b': service_b,
-                        'overlap_count': overlap,
-                        'pct_a_also_b': pct_a_also_b,
-                        'pct_b_also_a': pct_b_also_a,
-                        'patients_a': len(patients_a),
-                        'patients_b': len(patients_b),
-                        'a_only_count': a_only_count,
-                        'b_only_count': b_only_count,
-                        'total_opportunity': a_only_count + b_only_count,
-                        'avg_bundle_value': round(avg_bundle_value),
-                        'revenue_score': round(revenue_score),
-                        # Keep old field for backward compatibility
-                        'overlap_pct': max(pct_a_also_b, pct_b_also_a)
-                    }
+    for i, j in candidate_pairs:
+        service_a = significant_services[i]
+        service_b = significant_services[j]
+        n_a = int(n_sig[i])
+        n_b = int(n_sig[j])
+
+        overlap = int(overlap_matrix[i, j])
+        pct_a_also_b = int(pct_a_also_b_matrix[i, j])
+        pct_b_also_a = int(pct_b_also_a_matrix[i, j])
+
+        # Calculate untapped potential
+        a_only_count = n_a - overlap
+        b_only_count = n_b - overlap
+
+        # Calculate average revenue per service
+        rev_a = service_revenue.get(service_a, 0) / max(n_a, 1)
+        rev_b = service_revenue.get(service_b, 0) / max(n_b, 1)
+        avg_bundle_value = rev_a + rev_b
+
+        # Revenue score: prioritize high-value bundles with good overlap
+        revenue_score = overlap * avg_bundle_value
+
+        pair_key = f"{service_a}|{service_b}"
+        co_occurrence[pair_key] = {
+            'service_a': service_a,
+            'service_b': service_b,
+            'overlap_count': overlap,
+            'pct_a_also_b': pct_a_also_b,
+            'pct_b_also_a': pct_b_also_a,
+            'patients_a': n_a,
+            'patients_b': n_b,
+            'a_only_count': a_only_count,
+            'b_only_count': b_only_count,
+            'total_opportunity': a_only_count + b_only_count,
+            'avg_bundle_value': round(avg_bundle_value),
+            'revenue_score': round(revenue_score),
+            # Keep old field for backward compatibility
+            'overlap_pct': max(pct_a_also_b, pct_b_also_a)
+        }
 
     result['co_occurrence'] = co_occurrence
 
@@ -156,13 +169,12 @@ def analyze_services(df, treatment_col='treatment', revenue_col='revenue', patie
             service_b = best_bundle['service_b']
 
             # Get patient lists
-            both_patients = service_patients[service_a] & service_patients[service_b]
-            a_only = service_patients[service_a] - service_patients[service_b]
-            b_only = service_patients[service_b] - service_patients[service_a]
+            has_a = service_column(service_a)
+            has_b = service_column(service_b)
 
-            bundle_patients = extract_patient_info(both_patients, df, patient_id_col)
-            crosssell_a_to_b = extract_patient_info(a_only, df, patient_id_col)
-            crosssell_b_to_a = extract_patient_info(b_only, df, patient_id_col)
+            bundle_patients = extract_patient_info(has_a & has_b)
+            crosssell_a_to_b = extract_patient_info(has_a & ~has_b)
+            crosssell_b_to_a = extract_patient_info(has_b & ~has_a)
 
             # Calculate revenue potential for each segment
             rev_a_per_patient = service_revenue.get(service_a, 0) / max(best_bundle['patients_a'], 1)
@@ -226,21 +238,16 @@ def analyze_services(df, treatment_col='treatment', revenue_col='revenue', patie
     }
     
     total_patients = len(df)
-    category_patients = defaultdict(set)
-    
-    for idx, row in df.iterrows():
-        treatments = row['parsed_treatments']
-        patient_id = row.get(patient_id_col, idx)
-        
-        for treatment in treatments:
-            treatment_lower = treatment.lower()
-            for category, keywords in categories.items():
-                if any(kw in treatment_lower for kw in keywords):
-                    category_patients[category].add(patient_id)
+
+    # Match keywords once per distinct service, then project patients onto categories
+    category_patients = {}
+    for category, keywords in categories.items():
+        in_category = [i for i, service in enumerate(services) if any(kw in service.lower() for kw in keywords)]
+        category_patients[category] = X[:, in_category].getnnz(axis=1) > 0
     
     category_penetration = {}
     for category in categories.keys():
-        count = len(category_patients[category])
+        count = int(category_patients[category].sum())
         category_penetration[category] = {
             'count': count,
             'pct': round(count / total_patients * 100) if total_patients > 0 else 0
@@ -258,31 +265,28 @@ def analyze_services(df, treatment_col='treatment', revenue_col='revenue', patie
         for category, benchmark in industry_benchmarks.items():
             current_pct = category_penetration.get(category, {}).get('pct', 0)
             if current_pct < 10 and benchmark['expected_pct'] > 20:
-                injectable_patients = category_patients.get('injectables', set())
-                category_patients_set = category_patients.get(category, set())
-                eligible_patients = injectable_patients - category_patients_set
+                eligible_mask = category_patients['injectables'] & ~category_patients[category]
+                eligible_count = int(eligible_mask.sum())
                 
-                if len(eligible_patients) >= 10:
-                    potential_revenue = round(len(eligible_patients) * benchmark['upsell_value'] * 0.2)
+                if eligible_count >= 10:
+                    potential_revenue = round(eligible_count * benchmark['upsell_value'] * 0.2)
 
                     # Extract patient details for eligible patients
                     patient_list = []
-                    for pid in list(eligible_patients)[:500]:  # Limit to 500
-                        patient_row = df[df[patient_id_col] == pid].iloc[0] if patient_id_col and len(df[df[patient_id_col] == pid]) > 0 else None
-                        if patient_row is not None:
-                            patient_list.append({
-                                'patient_id': str(pid),
-                                'name': str(patient_row.get('name', patient_row.get('first_name', ''))) if 'name' in patient_row or 'first_name' in patient_row else str(pid),
-                                'phone': str(patient_row.get('phone', '')) if 'phone' in patient_row else '',
-                                'email': str(patient_row.get('email', '')) if 'email' in patient_row else '',
-                            })
+                    for pid, patient_row in _lookup_patient_rows(patient_lookup, patient_keys[eligible_mask][:500]):  # Limit to 500
+                        patient_list.append({
+                            'patient_id': str(pid),
+                            'name': str(patient_row.get('name', patient_row.get('first_name', ''))) if 'name' in patient_row or 'first_name' in patient_row else str(pid),
+                            'phone': str(patient_row.get('phone', '')) if 'phone' in patient_row else '',
+                            'email': str(patient_row.get('email', '')) if 'email' in patient_row else '',
+                        })
 
                     result['upsell_opportunity'] = {
                         'type': 'upsell',
                         'title': f"Introduce {category} to injectable patients",
                         'description': f"{current_pct}% of your patients buy {category}, but industry average is {benchmark['expected_pct']}% when offered alongside injectables.",
                         'potential_revenue': potential_revenue,
-                        'patient_count': len(eligible_patients),
+                        'patient_count': eligible_count,
                         'patients': patient_list,
                         'cta': f'Launch {category} intro',
                         'category': category,
@@ -300,7 +304,73 @@ def analyze_services(df, treatment_col='treatment', revenue_col='revenue', patie
     return result
 
 
-def analyze_service_rebooking(df, min_patients=10):
+def build_service_incidence(df, treatments_col, revenue_col=None, patient_id_col='patient_id'):
+    """
+    Build a sparse patient x service incidence matrix from a column of parsed
+    treatment lists. Services are ordered by first appearance; each row's
+    revenue is split evenly across its treatments.
+
+    Returns dict with 'matrix' (binary CSR, patients x services), 'services',
+    'patient_keys', 'patient_counts' and 'revenue' (per service).
+    """
+    treatment_lists = df[treatments_col].tolist()
+    lengths = np.fromiter((len(t) for t in treatment_lists), dtype=np.int64, count=len(treatment_lists))
+    flat_treatments = [t for treatments in treatment_lists for t in treatments]
+    row_positions = np.repeat(np.arange(len(df)), lengths)
+
+    service_codes, services = pd.factorize(pd.Series(flat_treatments, dtype=object))
+    services = list(services)
+
+    # Rows without a patient_id column fall back to their index label
+    keys = df[patient_id_col] if patient_id_col in df.columns else pd.Series(df.index, index=df.index)
+    patient_codes, patient_keys = pd.factorize(keys, use_na_sentinel=False)
+    patient_keys = np.asarray(patient_keys, dtype=object)
+
+    matrix = sparse.csr_matrix(
+        (np.ones(len(flat_treatments), dtype=np.int32), (patient_codes[row_positions], service_codes)),
+        shape=(len(patient_keys), len(services))
+    )
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+
+    if revenue_col:
+        row_revenue = df[revenue_col].to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            revenue_per_treatment = np.where(lengths > 0, row_revenue / np.maximum(lengths, 1), 0.0)
+        # bincount accumulates in row order, matching a sequential per-visit sum
+        revenue = np.bincount(service_codes, weights=revenue_per_treatment[row_positions], minlength=len(services))
+    else:
+        revenue = np.zeros(len(services))
+
+    return {
+        'matrix': matrix,
+        'services': services,
+        'patient_keys': patient_keys,
+        'patient_counts': matrix.getnnz(axis=0),
+        'revenue': revenue,
+    }
+
+
+def _build_patient_lookup(df, patient_id_col):
+    """First row per patient, indexed by patient id for O(1) detail lookups."""
+    if not patient_id_col or patient_id_col not in df.columns:
+        return None
+    first_rows = df[~df[patient_id_col].duplicated()]
+    return first_rows.set_index(patient_id_col, drop=False)
+
+
+def _lookup_patient_rows(patient_lookup, patient_ids):
+    """Yield (patient_id, row dict) for ids present in the lookup frame."""
+    if patient_lookup is None or len(patient_ids) == 0:
+        return
+    rows = patient_lookup.reindex(pd.Index(patient_ids, dtype=object))
+    present = pd.Index(patient_ids, dtype=object).isin(patient_lookup.index)
+    for pid, row, found in zip(patient_ids, rows.to_dict('records'), present):
+        if found:
+            yield pid, row
+
+
+def analyze_service_rebooking(df, min_patients=10, visit_index=None):
     """
     Analyze rebooking rates by service type to identify retention gaps.
 
@@ -310,66 +380,47 @@ def analyze_service_rebooking(df, min_patients=10):
     Args:
         df: Visit-level dataframe (one row per visit)
         min_patients: Minimum patients per service to include (default 10)
+        visit_index: Prebuilt index from build_visit_index (built from df if omitted)
 
     Returns:
         dict with service rebooking insight, or None
     """
 
-    # Find required columns
-    patient_id_col = next((c for c in ['patient_id'] if c in df.columns), None)
-    date_col = next((c for c in ['visit_date', 'date', 'appointment_date'] if c in df.columns), None)
-    treatment_col = next((c for c in ['treatment', 'procedure', 'service'] if c in df.columns), None)
-
-    if not all([patient_id_col, date_col, treatment_col]):
+    if visit_index is None:
+        visit_index = build_visit_index(df)
+    if visit_index is None or visit_index.attrs.get('treatment_col') not in REBOOKING_TREATMENT_COLUMNS:
         return None
 
-    # Clean and prepare data
-    df = df[[patient_id_col, date_col, treatment_col]].copy()
-    df = df[df[treatment_col].notna()].copy()
-    df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
-    df = df[df[date_col].notna()]
-
-    if len(df) == 0:
+    visits = serviced_visits(visit_index)
+    if len(visits) == 0:
         return None
 
-    # Sort by patient and date
-    df = df.sort_values([patient_id_col, date_col])
-
-    # Calculate time to next visit for each service
-    service_rebooking = defaultdict(lambda: {'rebooking_days': [], 'patient_count': 0})
-
-    for patient_id, patient_visits in df.groupby(patient_id_col):
-        if len(patient_visits) < 2:
-            continue  # Need at least 2 visits to measure rebooking
-
-        patient_visits = patient_visits.reset_index(drop=True)
+    # Time to next visit for each service (valid rebookings only)
+    rebookings = visits[visits['next_service_gap'] > 0]
+    gaps_by_service = rebookings.groupby('service', sort=False)['next_service_gap']
+    rebooking_counts = gaps_by_service.count()
+    rebooking_totals = gaps_by_service.sum()
+    rebooking_medians = gaps_by_service.median()
 
-        for i in range(len(patient_visits) - 1):
-            current_service = str(patient_visits.iloc[i][treatment_col]).strip()
-            current_date = patient_visits.iloc[i][date_col]
-            next_date = patient_visits.iloc[i + 1][date_col]
-
-            days_to_rebook = (next_date - current_date).days
-
-            if days_to_rebook > 0:  # Valid rebooking
-                service_rebooking[current_service]['rebooking_days'].append(days_to_rebook)
+    # Expected window varies by service type; look it up once per service
+    windows = {service: get_service_rebooking_window(service) for service in rebooking_counts.index}
+    on_time = rebookings['next_service_gap'] <= rebookings['service'].map(windows)
+    rebooked_on_time_counts = on_time.groupby(rebookings['service'], sort=False).sum()
 
     # Calculate stats for each service
     service_stats = []
-    for service, data in service_rebooking.items():
-        rebooking_days = data['rebooking_days']
-        patient_count = len(rebooking_days)
+    for service, patient_count in rebooking_counts.items():
+        patient_count = int(patient_count)
 
         if patient_count < min_patients:
             continue
 
-        median_days = int(np.median(rebooking_days))
-        avg_days = int(np.mean(rebooking_days))
+        median_days = int(rebooking_medians[service])
+        avg_days = int(rebooking_totals[service] / patient_count)
 
         # Calculate rebooking rate (% who rebook within expected window)
-        # Expected window varies by service type
-        expected_window = get_service_rebooking_window(service)
-        rebooked_on_time = sum(1 for d in rebooking_days if d <= expected_window)
+        expected_window = windows[service]
+        rebooked_on_time = int(rebooked_on_time_counts[service])
         rebooking_rate = round((rebooked_on_time / patient_count) * 100, 1)
 
         service_stats.append({
@@ -431,7 +482,7 @@ def get_service_rebooking_window(service_name):
     return 90  # 3 months
 
 
-def analyze_gateway_services(df, min_patients=15, min_multiplier=1.5):
+def analyze_gateway_services(df, min_patients=15, min_multiplier=1.5, visit_index=None):
     """
     Identify which starting services lead to higher lifetime value (gateway services).
 
@@ -442,69 +493,33 @@ def analyze_gateway_services(df, min_patients=15, min_multiplier=1.5):
         df: Visit-level dataframe (one row per visit)
         min_patients: Minimum patients who started with this service (default 15)
         min_multiplier: Minimum LTV multiplier to qualify (default 1.5)
+        visit_index: Prebuilt index from build_visit_index (built from df if omitted)
 
     Returns:
         dict with gateway service insight, or None
     """
 
-    # Find required columns
-    patient_id_col = next((c for c in ['patient_id'] if c in df.columns), None)
-    date_col = next((c for c in ['visit_date', 'date', 'appointment_date'] if c in df.columns), None)
-    treatment_col = next((c for c in ['treatment', 'procedure', 'service'] if c in df.columns), None)
-    revenue_col = next((c for c in ['revenue', 'amount', 'total'] if c in df.columns), None)
-
-    if not all([patient_id_col, date_col, treatment_col, revenue_col]):
+    if visit_index is None:
+        visit_index = build_visit_index(df)
+    if (visit_index is None
+            or visit_index.attrs.get('treatment_col') not in REBOOKING_TREATMENT_COLUMNS
+            or not visit_index.attrs.get('revenue_col')):
         return None
 
-    # Clean and prepare data
-    df = df[[patient_id_col, date_col, treatment_col, revenue_col]].copy()
-    df = df[df[treatment_col].notna()].copy()
-    df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
-    df = df[df[date_col].notna()]
-    df[revenue_col] = pd.to_numeric(df[revenue_col], errors='coerce').fillna(0)
-
-    if len(df) == 0:
+    # One row per patient carrying their first service and total LTV
+    patients = patient_first_visits(visit_index, serviced_only=True)
+    if len(patients) == 0:
         return None
 
-    # Sort by patient and date
-    df = df.sort_values([patient_id_col, date_col])
-
-    # Identify first service for each patient and calculate total LTV
-    first_services = {}
-    patient_ltv = defaultdict(float)
-
-    for patient_id, patient_visits in df.groupby(patient_id_col):
-        if len(patient_visits) == 0:
-            continue
-
-        patient_visits = patient_visits.reset_index(drop=True)
-
-        # First service
-        first_service = str(patient_visits.iloc[0][treatment_col]).strip()
-
-        # Total LTV
-        total_ltv = patient_visits[revenue_col].sum()
-
-        if patient_id not in first_services:
-            first_services[patient_id] = first_service
-
-        patient_ltv[patient_id] = total_ltv
-
-    # Calculate average LTV by first service
-    service_ltv = defaultdict(list)
-
-    for patient_id, first_service in first_services.items():
-        ltv = patient_ltv[patient_id]
-        service_ltv[first_service].append(ltv)
-
     # Calculate stats for each gateway service
-    overall_avg_ltv = np.mean(list(patient_ltv.values())) if patient_ltv else 0
+    overall_avg_ltv = np.mean(patients['patient_ltv'].to_numpy())
 
     if overall_avg_ltv == 0:
         return None
 
     gateway_services = []
-    for service, ltvs in service_ltv.items():
+    for service, ltvs in patients.groupby('first_service', sort=False)['patient_ltv']:
+        ltvs = ltvs.tolist()
         patient_count = len(ltvs)
 
         if patient_count < min_patients:
@@ -0,0 +1,398 @@
+"""
+Durable SMS outbox for Audience Mirror.
+Campaign messages are written as "queued" SMSMessage rows in one insert, then
+drained in batches by a dispatcher that claims rows, sends them and writes each
+status back in small groups as the sends finish, with every database step in a
+worker thread so the event loop never waits on a write. A worker heartbeats its claim
+while sending, so only claims of dead workers are re-queued. Resumable after a
+restart; one row per (campaign, recipient).
+"""
+
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, SMSCampaign, SMSMessage
+from services.sms_service import TWILIO_MESSAGES_PER_SECOND, TokenBucket, sms_service
+from services.sms_template import render_messages
+
+SMS_OUTBOX_BATCH_SIZE = int(os.getenv("SMS_OUTBOX_BATCH_SIZE", "100"))
+SMS_OUTBOX_POLL_SECONDS = float(os.getenv("SMS_OUTBOX_POLL_SECONDS", "5"))
+# A "sending" claim whose heartbeat is older than this belongs to a dead worker and is re-queued
+SMS_OUTBOX_CLAIM_TIMEOUT_SECONDS = int(os.getenv("SMS_OUTBOX_CLAIM_TIMEOUT_SECONDS", "600"))
+SMS_OUTBOX_HEARTBEAT_SECONDS = float(os.getenv("SMS_OUTBOX_HEARTBEAT_SECONDS", "30"))
+# Finished sends are written back this many at a time, so a crash loses at most this many statuses
+SMS_OUTBOX_RECORD_EVERY = int(os.getenv("SMS_OUTBOX_RECORD_EVERY", "10"))
+# Public URL of /api/sms/status-callback; delivery receipts are only requested when set
+SMS_STATUS_CALLBACK_URL = os.getenv("SMS_STATUS_CALLBACK_URL")
+
+PENDING_STATUSES = ("queued", "sending")
+
+# Campaigns a request is draining itself; the background dispatcher leaves them alone
+_foreground_campaigns = set()
+_wake_event = None
+_dispatch_bucket = None
+
+
+def recipient_key(recipient: Dict[str, str]) -> str:
+    """patient_id when present, otherwise the phone number's digits"""
+    if recipient.get("patient_id"):
+        return str(recipient["patient_id"])
+    return "tel:" + "".join(filter(str.isdigit, recipient.get("phone") or ""))
+
+
+def enqueue_sms_campaign(db: Session, campaign_id: str, message_template: str, recipients: List[Dict[str, str]],
+                         run_id: Optional[str] = None, name: Optional[str] = None,
+                         segment: Optional[str] = None) -> Dict[str, int]:
+    """
+    Write one "queued" row per new recipient in a single bulk insert.
+    Re-submitting a campaign only queues recipients it doesn't already have.
+    """
+    campaign = db.get(SMSCampaign, campaign_id)
+    if campaign is None:
+        campaign = SMSCampaign(
+            id=campaign_id,
+            run_id=run_id,
+            name=name,
+            segment=segment,
+            message_template=message_template,
+            total_recipients=0,
+            sent_count=0,
+            failed_count=0,
+            status="queued"
+        )
+        db.add(campaign)
+
+    seen = {key for (key,) in db.query(SMSMessage.recipient_key).filter(SMSMessage.campaign_id == campaign_id)}
+    new_recipients = []
+    for recipient in recipients:
+        key = recipient_key(recipient)
+        if key in seen:
+            continue
+        seen.add(key)
+        new_recipients.append((key, recipient))
+
+    bodies = render_messages(message_template, [recipient for _, recipient in new_recipients]).tolist()
+    now = datetime.utcnow()
+    rows = [
+        {
+            "id": str(uuid.uuid4()),
+            "campaign_id": campaign_id,
+            "patient_id": recipient.get("patient_id"),
+            "patient_name": recipient.get("name"),
+            "phone_number": recipient.get("phone") or "",
+            "recipient_key": key,
+            "message_body": body,
+            "status": "queued",
+            "attempts": 0,
+            "created_at": now,
+        }
+        for (key, recipient), body in zip(new_recipients, bodies)
+    ]
+
+    if rows:
+        db.bulk_insert_mappings(SMSMessage, rows)
+        campaign.total_recipients = (campaign.total_recipients or 0) + len(rows)
+        campaign.status = "queued"
+    db.commit()
+
+    print(f"[SMS OUTBOX] Campaign {campaign_id}: queued {len(rows)}, skipped {len(recipients) - len(rows)} duplicates")
+    return {"queued": len(rows), "duplicates": len(recipients) - len(rows)}
+
+
+def claim_batch(db: Session, limit: int, campaign_id: Optional[str] = None,
+                exclude_campaign_ids=()) -> List[SMSMessage]:
+    """
+    Atomically move up to `limit` queued rows to "sending" under a fresh token
+    and return them. The status guard in the UPDATE keeps concurrent
+    dispatchers from claiming the same row.
+    """
+    token = uuid.uuid4().hex
+    candidates = select(SMSMessage.id).where(SMSMessage.status == "queued")
+    if campaign_id is not None:
+        candidates = candidates.where(SMSMessage.campaign_id == campaign_id)
+    if exclude_campaign_ids:
+        candidates = candidates.where(SMSMessage.campaign_id.notin_(list(exclude_campaign_ids)))
+    candidates = candidates.order_by(SMSMessage.created_at, SMSMessage.id).limit(limit)
+
+    now = datetime.utcnow()
+    db.execute(
+        update(SMSMessage)
+        .where(SMSMessage.id.in_(candidates.scalar_subquery()), SMSMessage.status == "queued")
+        .values(status="sending", dispatch_token=token, claimed_at=now, heartbeat_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return db.query(SMSMessage).filter(SMSMessage.dispatch_token == token).all()
+
+
+def record_results(db: Session, rows: List[SMSMessage], results: List[Dict], token: str):
+    """
+    Write send results back in one executemany UPDATE and bump campaign
+    counters. Only rows still held under `token` are updated, so a claim that
+    was released (and maybe re-claimed by another worker) is never overwritten.
+    """
+    if not rows:
+        return
+    now = datetime.utcnow()
+    ids = [row.id for row in rows]
+    held_by_us = (SMSMessage.id.in_(ids), SMSMessage.dispatch_token == token, SMSMessage.status == "sending")
+    # Touch our rows first: the write lock keeps the claim from being released
+    # between reading which rows we still hold and writing their results
+    db.execute(update(SMSMessage).where(*held_by_us).values(heartbeat_at=now)
+               .execution_options(synchronize_session=False))
+    held = {row_id for (row_id,) in db.execute(select(SMSMessage.id).where(*held_by_us))}
+
+    updates = []
+    counts = {}
+    for row, result in zip(rows, results):
+        if row.id not in held:
+            print(f"[SMS OUTBOX] Claim on message {row.id} was lost, result not recorded")
+            continue
+        status = "sent" if result["success"] else "failed"
+        updates.append({
+            "b_id": row.id,
+            "status": status,
+            "twilio_sid": result.get("sid"),
+            "error_code": str(result["error_code"]) if result.get("error_code") is not None else None,
+            "error_message": result.get("error_message"),
+            "sent_at": now if result["success"] else None,
+        })
+        sent, failed = counts.get(row.campaign_id, (0, 0))
+        counts[row.campaign_id] = (sent + (status == "sent"), failed + (status == "failed"))
+
+    if updates:
+        message = SMSMessage.__table__
+        db.execute(
+            update(message)
+            .where(message.c.id == bindparam("b_id"), message.c.dispatch_token == token,
+                   message.c.status == "sending")
+            .values(
+                status=bindparam("status"),
+                twilio_sid=bindparam("twilio_sid"),
+                error_code=bindparam("error_code"),
+                error_message=bindparam("error_message"),
+                sent_at=bindparam("sent_at"),
+                attempts=func.coalesce(message.c.attempts, 0) + 1,
+                dispatch_token=None,
+            ),
+            updates,
+        )
+
+        campaign = SMSCampaign.__table__
+        db.execute(
+            update(campaign)
+            .where(campaign.c.id == bindparam("b_id"))
+            .values(
+                sent_count=func.coalesce(campaign.c.sent_count, 0) + bindparam("sent"),
+                failed_count=func.coalesce(campaign.c.failed_count, 0) + bindparam("failed"),
+                sent_at=func.coalesce(campaign.c.sent_at, now),
+            ),
+            [{"b_id": campaign_id, "sent": sent, "failed": failed} for campaign_id, (sent, failed) in counts.items()],
+        )
+    db.commit()
+    _finish_campaigns(db, list(counts))
+
+
+def _finish_campaigns(db: Session, campaign_ids: List[str]):
+    """Mark campaigns with nothing left queued or in flight as done"""
+    if not campaign_ids:
+        return
+    pending = {
+        campaign_id for (campaign_id,) in
+        db.query(SMSMessage.campaign_id)
+        .filter(SMSMessage.campaign_id.in_(campaign_ids), SMSMessage.status.in_(PENDING_STATUSES))
+        .distinct()
+    }
+    done = [c for c in campaign_ids if c not in pending]
+    if done:
+        db.execute(update(SMSCampaign).where(SMSCampaign.id.in_(done)).values(status="done"))
+    sending = [c for c in campaign_ids if c in pending]
+    if sending:
+        db.execute(update(SMSCampaign).where(SMSCampaign.id.in_(sending)).values(status="sending"))
+    db.commit()
+
+
+def heartbeat_claim(db: Session, token: str) -> int:
+    """Mark the rows still held under token as alive"""
+    touched = db.execute(
+        update(SMSMessage)
+        .where(SMSMessage.dispatch_token == token, SMSMessage.status == "sending")
+        .values(heartbeat_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return touched
+
+
+def release_stale_claims(db: Session, timeout_seconds: int = SMS_OUTBOX_CLAIM_TIMEOUT_SECONDS) -> int:
+    """Re-queue rows left in "sending" by a worker that stopped heartbeating (died mid-batch)"""
+    cutoff = datetime.utcnow() - timedelta(seconds=timeout_seconds)
+    released = db.execute(
+        update(SMSMessage)
+        .where(SMSMessage.status == "sending", SMSMessage.heartbeat_at < cutoff)
+        .values(status="queued", dispatch_token=None, claimed_at=None, heartbeat_at=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    if released:
+        print(f"[SMS OUTBOX] Re-queued {released} messages from stale claims")
+    return released
+
+
+def campaign_progress(db: Session, campaign_id: str) -> Dict[str, int]:
+    """Message counts by outbox status for one campaign"""
+    counts = dict(
+        db.query(SMSMessage.status, func.count(SMSMessage.id))
+        .filter(SMSMessage.campaign_id == campaign_id)
+        .group_by(SMSMessage.status)
+        .all()
+    )
+    return {status: counts.get(status, 0) for status in ("queued", "sending", "sent", "failed", "delivered", "undelivered")}
+
+
+def _get_dispatch_bucket() -> TokenBucket:
+    # One bucket per process so the account rate holds across concurrent drains
+    global _dispatch_bucket
+    if _dispatch_bucket is None:
+        _dispatch_bucket = TokenBucket(TWILIO_MESSAGES_PER_SECOND)
+    return _dispatch_bucket
+
+
+def _in_session(session_factory, fn, *args, **kwargs):
+    """Run a blocking outbox step in its own session (called from a worker thread)"""
+    db = session_factory()
+    try:
+        return fn(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+async def _heartbeat(session_factory, token: str, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(_in_session, session_factory, heartbeat_claim, token)
+        except Exception as e:
+            print(f"[SMS OUTBOX] Heartbeat failed: {e}")
+
+
+async def _send_batch(rows: List[SMSMessage], sender, bucket: TokenBucket, session_factory) -> List[Dict]:
+    """
+    Send one claimed batch. The sender's on_result callback only buffers
+    finished sends; a recorder task writes them back from a worker thread
+    every SMS_OUTBOX_RECORD_EVERY results, so the event loop never waits on
+    a database write.
+    """
+    token = rows[0].dispatch_token
+    finished = []
+    recorded = set()
+    due = asyncio.Event()
+    sending = True
+
+    def on_result(i, result):
+        finished.append((i, result))
+        if len(finished) >= SMS_OUTBOX_RECORD_EVERY:
+            due.set()
+
+    async def record():
+        batch = finished[:]
+        del finished[:len(batch)]
+        if not batch:
+            return
+        try:
+            await asyncio.to_thread(_in_session, session_factory, record_results,
+                                    [rows[i] for i, _ in batch], [r for _, r in batch], token)
+        except Exception:
+            finished[:0] = batch
+            raise
+        recorded.update(i for i, _ in batch)
+
+    async def recorder():
+        while sending:
+            await due.wait()
+            due.clear()
+            try:
+                await record()
+            except Exception as e:
+                print(f"[SMS OUTBOX] Recording results failed, will retry: {e}")
+
+    heartbeat = asyncio.create_task(_heartbeat(session_factory, token, SMS_OUTBOX_HEARTBEAT_SECONDS))
+    recording = asyncio.create_task(recorder())
+    try:
+        results = await sender.send_messages_async(
+            [{"to": row.phone_number, "body": row.message_body} for row in rows],
+            status_callback=SMS_STATUS_CALLBACK_URL, bucket=bucket, on_result=on_result
+        )
+    finally:
+        sending = False
+        due.set()
+        await recording
+        heartbeat.cancel()
+        await record()
+    # Senders that don't report per result are recorded here in one go
+    finished.extend((i, r) for i, r in enumerate(results) if i not in recorded)
+    await record()
+    return results
+
+
+async def drain_outbox(campaign_id: Optional[str] = None, batch_size: int = SMS_OUTBOX_BATCH_SIZE,
+                       session_factory=SessionLocal, sender=None, bucket: Optional[TokenBucket] = None) -> Dict[str, int]:
+    """
+    Claim, send and record batches until nothing queued is left (for one
+    campaign, or for every campaign not being drained by a request).
+    Database steps run in worker threads, off the event loop.
+    """
+    sender = sender or sms_service
+    bucket = bucket or _get_dispatch_bucket()
+    totals = {"sent": 0, "failed": 0}
+    if campaign_id is not None:
+        _foreground_campaigns.add(campaign_id)
+    try:
+        while True:
+            rows = await asyncio.to_thread(
+                _in_session, session_factory, claim_batch, batch_size, campaign_id=campaign_id,
+                exclude_campaign_ids=() if campaign_id is not None else tuple(_foreground_campaigns)
+            )
+            if not rows:
+                return totals
+            for result in await _send_batch(rows, sender, bucket, session_factory):
+                totals["sent" if result["success"] else "failed"] += 1
+    finally:
+        if campaign_id is not None:
+            _foreground_campaigns.discard(campaign_id)
+
+
+def _get_wake_event() -> asyncio.Event:
+    global _wake_event
+    if _wake_event is None:
+        _wake_event = asyncio.Event()
+    return _wake_event
+
+
+def notify_outbox():
+    """Wake the background dispatcher (new rows were queued)"""
+    _get_wake_event().set()
+
+
+async def run_outbox_dispatcher(poll_seconds: float = SMS_OUTBOX_POLL_SECONDS, session_factory=SessionLocal):
+    """Background task: resume anything left from a previous process, then keep draining"""
+    wake = _get_wake_event()
+    while True:
+        try:
+            await asyncio.to_thread(_in_session, session_factory, release_stale_claims)
+            totals = await drain_outbox(session_factory=session_factory)
+            if totals["sent"] or totals["failed"]:
+                print(f"[SMS OUTBOX] Dispatched {totals['sent']} sent, {totals['failed']} failed")
+        except Exception as e:
+            print(f"[SMS OUTBOX] Dispatch failed: {e}")
+        try:
+            await asyncio.wait_for(wake.wait(), timeout=poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+        wake.clear()
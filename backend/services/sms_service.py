@@ -3,12 +3,51 @@ SMS Service using Twilio
 Handles sending SMS campaigns and tracking delivery status
 """
 
+import asyncio
 import os
-from typing import Optional, List, Dict, Any
+import random
+import time
+from typing import Optional, List, Dict, Any, Callable
 from datetime import datetime
+
+import httpx
 from twilio.rest import Client
 from twilio.base.exceptions import TwilioRestException
 
+from .sms_template import render_messages
+
+# Account send rate (Twilio queues anything faster): 1/s for a long code, 3/s toll-free, higher for short codes
+TWILIO_MESSAGES_PER_SECOND = float(os.getenv("TWILIO_MESSAGES_PER_SECOND", "1"))
+SMS_SEND_CONCURRENCY = int(os.getenv("SMS_SEND_CONCURRENCY", "10"))
+SMS_MAX_RETRIES = int(os.getenv("SMS_MAX_RETRIES", "3"))
+SMS_BACKOFF_BASE_SECONDS = float(os.getenv("SMS_BACKOFF_BASE_SECONDS", "1"))
+TWILIO_API_BASE_URL = os.getenv("TWILIO_API_BASE_URL", "https://api.twilio.com")
+
+# Twilio REST error codes worth retrying: rate limited, internal error, service unavailable
+RETRYABLE_TWILIO_CODES = {20429, 20500, 20503}
+
+
+class TokenBucket:
+    """Async token bucket: refills at `rate` tokens/second up to `capacity`."""
+    
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
 
 class SMSService:
     def __init__(self):
@@ -114,17 +153,10 @@ class SMSService:
             "details": []
         }
         
-        for recipient in recipients:
-            # Personalize message
-            message = message_template
-            if "{name}" in message and recipient.get("name"):
-                # Use first name only
-                first_name = recipient["name"].split()[0] if recipient.get("name") else ""
-                message = message.replace("{name}", first_name)
-            
-            # Remove any remaining placeholders
-            message = message.replace("{name}", "there")
-            
+        # Personalize every message up front
+        bodies = render_messages(message_template, recipients).tolist()
+        
+        for recipient, message in zip(recipients, bodies):
             result = self.send_sms(
                 to_number=recipient["phone"],
                 message=message,
@@ -143,6 +175,158 @@ class SMSService:
         
         return results
     
+    async def send_bulk_sms_async(
+        self,
+        recipients: List[Dict[str, str]],
+        message_template: str,
+        status_callback: Optional[str] = None,
+        messages_per_second: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        on_progress: Optional[Callable[[Dict[str, int]], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Concurrent version of send_bulk_sms for large campaigns.
+        
+        See send_messages_async for rate limiting, concurrency and retries.
+        on_progress(counts) is called after each recipient finishes.
+        
+        Returns the same shape as send_bulk_sms, details in recipient order.
+        """
+        results = {
+            "total": len(recipients),
+            "sent": 0,
+            "failed": 0,
+            "details": []
+        }
+        
+        def count(_, result):
+            results["sent" if result["success"] else "failed"] += 1
+            if on_progress:
+                on_progress({"total": results["total"], "done": results["sent"] + results["failed"],
+                             "sent": results["sent"], "failed": results["failed"]})
+        
+        bodies = render_messages(message_template, recipients).tolist()
+        messages = [{"to": r["phone"], "body": body} for r, body in zip(recipients, bodies)]
+        details = await self.send_messages_async(
+            messages, status_callback, messages_per_second=messages_per_second,
+            max_concurrency=max_concurrency, on_result=count
+        )
+        for recipient, result in zip(recipients, details):
+            result["patient_id"] = recipient.get("patient_id")
+            result["recipient_name"] = recipient.get("name")
+        results["details"] = details
+        return results
+    
+    async def send_messages_async(
+        self,
+        messages: List[Dict[str, str]],
+        status_callback: Optional[str] = None,
+        bucket: Optional[TokenBucket] = None,
+        messages_per_second: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Send already-personalized messages ({"to", "body"}) concurrently.
+        
+        Sends through the Twilio REST API without blocking the event loop:
+        a token bucket holds the send rate to messages_per_second (pass a shared
+        bucket to pace across calls), at most max_concurrency requests are in
+        flight, and rate-limit/5xx/connection failures are retried with jittered
+        backoff (honoring Retry-After). Errors after the request went out (read
+        timeouts) are reported as failed, never resent. on_result(index, result) fires as each
+        message finishes. Returns send_sms-style result dicts in input order.
+        """
+        if not self.is_configured():
+            return [
+                {"success": False, "sid": None, "status": "failed", "to": m["to"], "error_code": None,
+                 "error_message": "Twilio not configured. Add credentials in Settings."}
+                for m in messages
+            ]
+        
+        bucket = bucket or TokenBucket(messages_per_second or TWILIO_MESSAGES_PER_SECOND)
+        semaphore = asyncio.Semaphore(max_concurrency or SMS_SEND_CONCURRENCY)
+        url = f"{TWILIO_API_BASE_URL}/2010-04-01/Accounts/{self.account_sid}/Messages.json"
+        results = [None] * len(messages)
+        
+        async with httpx.AsyncClient(auth=(self.account_sid, self.auth_token), timeout=30) as http:
+            async def send_one(i, message):
+                async with semaphore:
+                    result = await self._send_sms_async(http, url, bucket, message["to"], message["body"], status_callback)
+                results[i] = result
+                if on_result:
+                    on_result(i, result)
+            
+            await asyncio.gather(*[send_one(i, m) for i, m in enumerate(messages)])
+        
+        return results
+    
+    async def _send_sms_async(self, http, url, bucket, to_number, message, status_callback=None) -> Dict[str, Any]:
+        """One message over the REST API, with retries; same result dict as send_sms"""
+        to_number = self._format_phone(to_number)
+        data = {"To": to_number, "From": self.from_number, "Body": message}
+        if status_callback:
+            data["StatusCallback"] = status_callback
+        
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            retry_after = None
+            try:
+                response = await http.post(url, data=data)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                # Never reached Twilio, so sending again can't duplicate the message
+                error_code, error_message, retryable = None, str(e), True
+            except httpx.TransportError as e:
+                # The request may already have been accepted (e.g. read timeout): don't send it twice
+                return {
+                    "success": False,
+                    "sid": None,
+                    "status": "failed",
+                    "to": to_number,
+                    "error_code": None,
+                    "error_message": f"Outcome unknown, not resent: {e.__class__.__name__} {e}".strip()
+                }
+            else:
+                try:
+                    body = response.json() if response.content else {}
+                except ValueError:
+                    body = {}
+                if response.status_code < 300:
+                    # Accepted, even if the body couldn't be parsed
+                    return {
+                        "success": True,
+                        "sid": body.get("sid"),
+                        "status": body.get("status") or "queued",
+                        "to": to_number,
+                        "error_code": None,
+                        "error_message": None
+                    }
+                error_code = body.get("code")
+                error_message = body.get("message") or response.text
+                retryable = (response.status_code == 429 or response.status_code >= 500
+                             or error_code in RETRYABLE_TWILIO_CODES)
+                retry_after = response.headers.get("Retry-After")
+            
+            if not retryable or attempt >= SMS_MAX_RETRIES:
+                return {
+                    "success": False,
+                    "sid": None,
+                    "status": "failed",
+                    "to": to_number,
+                    "error_code": error_code,
+                    "error_message": error_message
+                }
+            
+            delay = random.uniform(0, SMS_BACKOFF_BASE_SECONDS * (2 ** attempt))
+            if retry_after:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+            await asyncio.sleep(delay)
+            attempt += 1
+    
     def _format_phone(self, phone: str) -> str:
         """Format phone number to E.164 format"""
         # Remove all non-digits
@@ -0,0 +1,205 @@
+"""
+Batched SMS delivery-status ingestion for Audience Mirror.
+Twilio status callbacks are buffered in memory (latest status per message SID)
+and flushed periodically: one SELECT for the prior statuses, one executemany
+UPDATE keyed by twilio_sid, and incremental SMSCampaign counter updates.
+"""
+
+import asyncio
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, SMSCampaign, SMSMessage
+
+SMS_STATUS_FLUSH_SECONDS = float(os.getenv("SMS_STATUS_FLUSH_SECONDS", "2"))
+# Flush early once this many distinct messages are waiting
+SMS_STATUS_MAX_BUFFER = int(os.getenv("SMS_STATUS_MAX_BUFFER", "5000"))
+# SQL IN-list size when loading prior statuses
+SMS_STATUS_LOOKUP_CHUNK = 500
+# A callback can beat the outbox writing the SID back; unknown SIDs are retried this long
+SMS_STATUS_UNKNOWN_RETENTION_SECONDS = int(os.getenv("SMS_STATUS_UNKNOWN_RETENTION_SECONDS", "120"))
+
+# Callbacks can arrive out of order; a status never moves to a lower rank
+STATUS_RANK = {
+    "accepted": 0, "queued": 0, "sending": 1, "sent": 2,
+    "delivered": 3, "undelivered": 3, "failed": 3, "read": 4,
+}
+DELIVERED_STATUSES = {"delivered", "read"}
+FAILED_STATUSES = {"undelivered", "failed"}
+
+
+class SMSStatusBuffer:
+    """Thread-safe map of twilio_sid -> highest-ranked status seen since the last flush."""
+
+    def __init__(self, max_size: int = SMS_STATUS_MAX_BUFFER):
+        self.max_size = max_size
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def add(self, sid: str, status: str, error_code: Optional[str] = None,
+            error_message: Optional[str] = None, received_at: Optional[datetime] = None) -> bool:
+        """Buffer one callback; returns True once the buffer is due for an early flush."""
+        status = (status or "").lower()
+        if not sid or status not in STATUS_RANK:
+            return False
+        entry = {
+            "status": status,
+            "error_code": str(error_code) if error_code else None,
+            "error_message": error_message,
+            "received_at": received_at or datetime.utcnow(),
+        }
+        with self._lock:
+            current = self._pending.get(sid)
+            if current is None or STATUS_RANK[status] >= STATUS_RANK[current["status"]]:
+                self._pending[sid] = entry
+            return len(self._pending) >= self.max_size
+
+    def drain(self) -> Dict[str, dict]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def restore(self, pending: Dict[str, dict]):
+        """Put back a batch whose flush failed, without overriding newer callbacks."""
+        with self._lock:
+            for sid, entry in pending.items():
+                current = self._pending.get(sid)
+                if current is None or STATUS_RANK[entry["status"]] > STATUS_RANK[current["status"]]:
+                    self._pending[sid] = entry
+
+    def __len__(self):
+        return len(self._pending)
+
+
+def apply_status_updates(db: Session, pending: Dict[str, dict]) -> Dict[str, int]:
+    """
+    Write buffered statuses in bulk. Only forward transitions are applied, and
+    campaign delivered/failed counters move by the transitions actually made.
+    Entries for SIDs not in the table are returned under "unknown".
+    """
+    if not pending:
+        return {"updated": 0, "ignored": 0, "unknown": {}}
+
+    sids = list(pending)
+    current = {}
+    for start in range(0, len(sids), SMS_STATUS_LOOKUP_CHUNK):
+        chunk = sids[start:start + SMS_STATUS_LOOKUP_CHUNK]
+        rows = db.execute(
+            select(SMSMessage.twilio_sid, SMSMessage.campaign_id, SMSMessage.status)
+            .where(SMSMessage.twilio_sid.in_(chunk))
+        )
+        current.update({sid: (campaign_id, status) for sid, campaign_id, status in rows})
+
+    updates = []
+    unknown = {}
+    deltas = {}  # campaign_id -> [delivered, failed]
+    for sid, entry in pending.items():
+        if sid not in current:
+            unknown[sid] = entry
+            continue
+        campaign_id, old_status = current[sid]
+        new_status = entry["status"]
+        if STATUS_RANK[new_status] <= STATUS_RANK.get(old_status, -1):
+            continue
+        updates.append({
+            "b_sid": sid,
+            "status": new_status,
+            "error_code": entry["error_code"],
+            "error_message": entry["error_message"],
+            "delivered_at": entry["received_at"] if new_status in DELIVERED_STATUSES else None,
+        })
+        delta = deltas.setdefault(campaign_id, [0, 0])
+        delta[0] += (new_status in DELIVERED_STATUSES) - (old_status in DELIVERED_STATUSES)
+        delta[1] += (new_status in FAILED_STATUSES) - (old_status in FAILED_STATUSES)
+
+    if updates:
+        message = SMSMessage.__table__
+        db.execute(
+            update(message)
+            .where(message.c.twilio_sid == bindparam("b_sid"))
+            .values(
+                status=bindparam("status"),
+                error_code=func.coalesce(bindparam("error_code"), message.c.error_code),
+                error_message=func.coalesce(bindparam("error_message"), message.c.error_message),
+                delivered_at=func.coalesce(bindparam("delivered_at"), message.c.delivered_at),
+            ),
+            updates,
+        )
+
+        campaign = SMSCampaign.__table__
+        counter_updates = [
+            {"b_id": campaign_id, "delivered": delivered, "failed": failed}
+            for campaign_id, (delivered, failed) in deltas.items() if delivered or failed
+        ]
+        if counter_updates:
+            db.execute(
+                update(campaign)
+                .where(campaign.c.id == bindparam("b_id"))
+                .values(
+                    delivered_count=func.coalesce(campaign.c.delivered_count, 0) + bindparam("delivered"),
+                    failed_count=func.coalesce(campaign.c.failed_count, 0) + bindparam("failed"),
+                ),
+                counter_updates,
+            )
+    db.commit()
+    return {"updated": len(updates), "ignored": len(pending) - len(updates) - len(unknown), "unknown": unknown}
+
+
+status_buffer = SMSStatusBuffer()
+_flush_event = None
+
+
+def _get_flush_event() -> asyncio.Event:
+    global _flush_event
+    if _flush_event is None:
+        _flush_event = asyncio.Event()
+    return _flush_event
+
+
+def record_status_callback(sid: str, status: str, error_code: Optional[str] = None,
+                           error_message: Optional[str] = None):
+    """Buffer a callback from the webhook; wakes the flusher early when the buffer is full."""
+    if status_buffer.add(sid, status, error_code, error_message):
+        _get_flush_event().set()
+
+
+def flush_status_buffer(session_factory=SessionLocal, buffer: SMSStatusBuffer = status_buffer) -> Dict[str, int]:
+    pending = buffer.drain()
+    if not pending:
+        return {"updated": 0, "ignored": 0, "unknown": {}}
+    db = session_factory()
+    try:
+        result = apply_status_updates(db, pending)
+    except Exception:
+        db.rollback()
+        buffer.restore(pending)
+        raise
+    finally:
+        db.close()
+
+    cutoff = datetime.utcnow() - timedelta(seconds=SMS_STATUS_UNKNOWN_RETENTION_SECONDS)
+    retry = {sid: entry for sid, entry in result["unknown"].items() if entry["received_at"] >= cutoff}
+    buffer.restore(retry)
+    print(f"[SMS STATUS] Flushed {len(pending)} callbacks: {result['updated']} updated, "
+          f"{result['ignored']} ignored, {len(retry)} unknown SIDs kept for retry")
+    return result
+
+
+async def run_status_flusher(interval_seconds: float = SMS_STATUS_FLUSH_SECONDS):
+    """Background task: flush buffered callbacks every interval (or sooner when the buffer fills)."""
+    event = _get_flush_event()
+    while True:
+        try:
+            await asyncio.wait_for(event.wait(), timeout=interval_seconds)
+        except asyncio.TimeoutError:
+            pass
+        event.clear()
+        try:
+            await asyncio.to_thread(flush_status_buffer)
+        except Exception as e:
+            print(f"[SMS STATUS] Flush failed, will retry: {e}")
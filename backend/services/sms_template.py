@@ -0,0 +1,139 @@
+"""
+SMS template rendering and cost estimation for Audience Mirror.
+Renders a message template for a whole recipient DataFrame in column
+operations, and works out GSM-7 / UCS-2 encoding, segment counts and cost
+per message so a campaign can be previewed before it is sent.
+"""
+
+import os
+import re
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+# Twilio US outbound price per segment; override per account/country
+SMS_COST_PER_SEGMENT = float(os.getenv("SMS_COST_PER_SEGMENT", "0.0083"))
+
+# GSM 03.38 basic character set (escape excluded) and extension table; extension chars take 2 septets
+GSM7_BASIC = (
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM7_EXTENSION = "\f^{}\\[~]|€"
+
+# (single-segment limit, per-segment limit once concatenated)
+SEGMENT_LIMITS = {"GSM-7": (160, 153), "UCS-2": (70, 67)}
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+_NON_GSM7 = re.compile("[^" + re.escape(GSM7_BASIC + GSM7_EXTENSION) + "]")
+_GSM7_EXTENSION = re.compile("[" + re.escape(GSM7_EXTENSION) + "]")
+# Characters outside the BMP are two UTF-16 code units
+_ASTRAL = re.compile("[\U00010000-\U0010FFFF]")
+
+
+class CompiledTemplate:
+    """
+    A template split once into literals and placeholders. {name} becomes the
+    recipient's first name (or 'there'); other placeholders are left as
+    written.
+    """
+
+    def __init__(self, template: str):
+        self.template = template
+        pieces = _PLACEHOLDER.split(template)
+        self.literals = pieces[0::2]
+        self.fields = pieces[1::2]
+
+    def render(self, recipients: pd.DataFrame) -> pd.Series:
+        messages = pd.Series(self.literals[0], index=recipients.index, dtype=object)
+        for field, literal in zip(self.fields, self.literals[1:]):
+            messages = messages + self._field_values(recipients, field) + literal
+        return messages
+
+    @staticmethod
+    def _field_values(recipients: pd.DataFrame, field: str):
+        if field != "name":
+            return "{" + field + "}"
+        if "name" not in recipients.columns:
+            return "there"
+        first_names = recipients["name"].fillna("").astype(str).str.split().str[0]
+        return first_names.fillna("there")
+
+
+def _as_frame(recipients: Union[pd.DataFrame, List[Dict[str, str]]]) -> pd.DataFrame:
+    return recipients if isinstance(recipients, pd.DataFrame) else pd.DataFrame(list(recipients))
+
+
+def render_messages(message_template: str, recipients: Union[pd.DataFrame, List[Dict[str, str]]]) -> pd.Series:
+    """Personalized body for every recipient (index-aligned with the input)"""
+    return CompiledTemplate(message_template).render(_as_frame(recipients))
+
+
+def segment_messages(messages: pd.Series) -> pd.DataFrame:
+    """Per-message encoding, length in encoding units and segment count"""
+    messages = messages.fillna("").astype(str)
+    characters = messages.str.len().to_numpy()
+    is_gsm7 = ~messages.str.contains(_NON_GSM7).to_numpy(dtype=bool)
+    units = np.where(
+        is_gsm7,
+        characters + messages.str.count(_GSM7_EXTENSION).to_numpy(),
+        characters + messages.str.count(_ASTRAL).to_numpy(),
+    )
+    single = np.where(is_gsm7, SEGMENT_LIMITS["GSM-7"][0], SEGMENT_LIMITS["UCS-2"][0])
+    multi = np.where(is_gsm7, SEGMENT_LIMITS["GSM-7"][1], SEGMENT_LIMITS["UCS-2"][1])
+    segments = np.where(units <= single, 1, -(-units // multi))
+    segments = np.where(units == 0, 0, segments)
+    return pd.DataFrame({
+        "encoding": np.where(is_gsm7, "GSM-7", "UCS-2"),
+        "characters": characters,
+        "units": units,
+        "segments": segments,
+    }, index=messages.index)
+
+
+def preview_sms_campaign(message_template: str, recipients: Union[pd.DataFrame, List[Dict[str, str]]],
+                         cost_per_segment: Optional[float] = None, sample_size: int = 5) -> Dict:
+    """
+    Render every message and summarize encoding, segments and estimated cost
+    before anything is sent.
+    """
+    cost_per_segment = SMS_COST_PER_SEGMENT if cost_per_segment is None else cost_per_segment
+    frame = _as_frame(recipients)
+    messages = render_messages(message_template, frame)
+    stats = segment_messages(messages)
+
+    total_segments = int(stats["segments"].sum())
+    warnings = []
+    non_gsm = sorted(set(_NON_GSM7.findall(message_template)))
+    if non_gsm:
+        warnings.append(
+            f"Template uses characters outside GSM-7 ({''.join(non_gsm)}); messages are sent as UCS-2 "
+            f"at {SEGMENT_LIMITS['UCS-2'][0]} characters per segment"
+        )
+    ucs2_from_names = int((stats["encoding"] == "UCS-2").sum()) if not non_gsm else 0
+    if ucs2_from_names:
+        warnings.append(f"{ucs2_from_names} messages switch to UCS-2 because of characters in recipient names")
+    multi_segment = int((stats["segments"] > 1).sum())
+    if multi_segment:
+        warnings.append(f"{multi_segment} messages are longer than one segment")
+
+    names = frame["name"] if "name" in frame.columns else pd.Series(None, index=frame.index, dtype=object)
+    sample = [
+        {"name": None if pd.isna(names.at[i]) else names.at[i], "message": messages.at[i],
+         "encoding": stats.at[i, "encoding"], "segments": int(stats.at[i, "segments"])}
+        for i in frame.index[:sample_size]
+    ]
+
+    return {
+        "total_recipients": len(frame),
+        "total_segments": total_segments,
+        "segments_per_message": {str(k): int(v) for k, v in stats["segments"].value_counts().sort_index().items()},
+        "encoding": {str(k): int(v) for k, v in stats["encoding"].value_counts().items()},
+        "max_characters": int(stats["characters"].max()) if len(stats) else 0,
+        "avg_characters": round(float(stats["characters"].mean()), 1) if len(stats) else 0,
+        "cost_per_segment": cost_per_segment,
+        "estimated_cost": round(total_segments * cost_per_segment, 2),
+        "sample": sample,
+        "warnings": warnings,
+    }
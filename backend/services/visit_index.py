@@ -0,0 +1,100 @@
+"""
+Shared visit-sequence index for Audience Mirror
+Sorts visit-level data once and derives per-visit sequence features that the
+rebooking, gateway, journey and churn-interval analyses all reduce over.
+"""
+
+from typing import Optional
+
+import pandas as pd
+
+PATIENT_ID_COLUMNS = ['patient_id']
+DATE_COLUMNS = ['visit_date', 'date', 'appointment_date']
+TREATMENT_COLUMNS = ['treatment', 'procedure', 'service', 'procedure_type']
+REVENUE_COLUMNS = ['revenue', 'amount', 'total']
+
+
+def _first_present(df, candidates):
+    return next((c for c in candidates if c in df.columns), None)
+
+
+def build_visit_index(df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """
+    Sort visits by (patient, date) once and derive sequence columns.
+
+    Over every dated visit:
+        visit_seq          1-based position in the patient's history
+        visit_count        total dated visits for the patient
+        next_visit_gap     days until the patient's next visit (NaN for last)
+
+    Over visits with a recorded service (NaN on rows without one):
+        service            treatment name, stripped
+        service_seq        1-based position among the patient's serviced visits
+        next_service       service at the patient's next serviced visit
+        next_service_gap   days until that next serviced visit
+        first_service      the patient's first service
+        patient_ltv        revenue summed over the patient's serviced visits
+
+    Source column names are kept in .attrs. Returns None when there is no
+    patient_id or date column.
+    """
+    patient_id_col = _first_present(df, PATIENT_ID_COLUMNS)
+    date_col = _first_present(df, DATE_COLUMNS)
+    if not all([patient_id_col, date_col]):
+        return None
+
+    treatment_col = _first_present(df, TREATMENT_COLUMNS)
+    revenue_col = _first_present(df, REVENUE_COLUMNS)
+
+    # Fresh positional index so duplicate labels in the source frame can't misalign
+    source_cols = [c for c in [patient_id_col, date_col, treatment_col, revenue_col] if c]
+    df = df[list(dict.fromkeys(source_cols))].reset_index(drop=True)
+    index = pd.DataFrame({
+        'patient_id': df[patient_id_col],
+        'visit_date': pd.to_datetime(df[date_col], errors='coerce'),
+    })
+    if treatment_col:
+        treatments = df[treatment_col]
+        index['service'] = treatments.astype(str).str.strip().where(treatments.notna())
+    else:
+        index['service'] = None
+    if revenue_col:
+        index['revenue'] = pd.to_numeric(df[revenue_col], errors='coerce').fillna(0)
+    else:
+        index['revenue'] = 0.0
+
+    index = index[index['patient_id'].notna() & index['visit_date'].notna()]
+    index = index.sort_values(['patient_id', 'visit_date']).reset_index(drop=True)
+
+    by_patient = index.groupby('patient_id', sort=False)
+    index['visit_seq'] = by_patient.cumcount() + 1
+    index['visit_count'] = by_patient['visit_date'].transform('size')
+    index['next_visit_gap'] = (by_patient['visit_date'].shift(-1) - index['visit_date']).dt.days
+
+    serviced = index[index['service'].notna()]
+    by_serviced_patient = serviced.groupby('patient_id', sort=False)
+    index['service_seq'] = by_serviced_patient.cumcount() + 1
+    index['next_service'] = by_serviced_patient['service'].shift(-1)
+    index['next_service_gap'] = (by_serviced_patient['visit_date'].shift(-1) - serviced['visit_date']).dt.days
+    index['first_service'] = by_serviced_patient['service'].transform('first')
+    index['patient_ltv'] = by_serviced_patient['revenue'].transform('sum')
+
+    index.attrs.update({
+        'patient_id_col': patient_id_col,
+        'date_col': date_col,
+        'treatment_col': treatment_col,
+        'revenue_col': revenue_col,
+    })
+    return index
+
+
+def serviced_visits(visit_index: pd.DataFrame) -> pd.DataFrame:
+    """Rows of the index that carry a service (the sequence rebooking/gateway use)."""
+    return visit_index[visit_index['service'].notna()]
+
+
+def patient_first_visits(visit_index: pd.DataFrame, serviced_only: bool = False) -> pd.DataFrame:
+    """One row per patient (their first visit), in patient order."""
+    if serviced_only:
+        return visit_index[visit_index['service_seq'] == 1]
+    return visit_index[visit_index['visit_seq'] == 1]
@@ -0,0 +1,44 @@
+import asyncio
+import json
+import re
+
+from services import campaign_generator
+from services.llm_cache import TieredLLMCache
+
+
+def _segment(cohort, zip_code, procedure=None):
+    return {"cohort": cohort, "zip_code": zip_code, "competitors": 2, "reasons": ["High income"],
+            "match_score": 0.8, "procedure": procedure}
+
+
+def test_batch_groups_by_cohort_fans_out_and_caches_per_zip(tmp_path, monkeypatch):
+    cache = TieredLLMCache(disk_path=str(tmp_path / "cache.db"), redis_url=None)
+    monkeypatch.setattr(campaign_generator, "get_llm_cache", lambda: cache)
+    calls = []
+
+    async def fake_complete(prompt, max_tokens=1024, temperature=0.7, model=None, use_cache=True):
+        assert not use_cache  # chunk replies are cached per ZIP, not whole
+        zips = re.findall(r"- ZIP (\d+):", prompt)
+        calls.append(zips)
+        campaigns = [{"zip_code": z, "adCopy": [{"headline": f"Ad {z}", "description": "d"}]}
+                     for z in zips if z != "99999"]  # model skips one ZIP
+        return json.dumps({"campaigns": campaigns})
+
+    monkeypatch.setattr(campaign_generator, "complete", fake_complete)
+
+    segments = [_segment("Luxury Clients", str(10000 + i)) for i in range(6)]
+    segments.insert(2, _segment("Budget Conscious", "99999"))
+    segments.append(_segment("Luxury Clients", "20000", procedure="Botox"))
+
+    results = asyncio.run(campaign_generator.generate_campaign_content_batch(segments))
+
+    assert [r["zip_code"] for r in results] == [s["zip_code"] for s in segments]
+    assert sorted(len(c) for c in calls) == [1, 1, 1, 5]  # 6 luxury ZIPs -> 5 + 1, plus two singleton groups
+    assert results[0]["adCopy"][0]["headline"] == "Ad 10000"
+    assert results[2]["source"] == "fallback"
+    assert {r["source"] for i, r in enumerate(results) if i != 2} == {"llm"}
+
+    calls.clear()
+    again = asyncio.run(campaign_generator.generate_campaign_content_batch(segments))
+    assert calls == [["99999"]]  # only the ZIP that fell back is retried
+    assert again[0] == {**results[0], "source": "cache"}
@@ -0,0 +1,67 @@
+from datetime import date
+
+import pandas as pd
+from services.churn_scoring import analyze_patient_churn, calculate_churn_risk, score_churn_arrays
+
+REF = date(2025, 6, 1)
+
+
+def test_scalar_wrapper_buckets_and_types():
+    risk = calculate_churn_risk("2025-03-03", "botox", procedure_intervals={"botox": 60, "default": 90},
+                                reference_date=REF)
+    assert risk == {
+        "risk_level": "medium",
+        "risk_score": 50,
+        "days_since_visit": 90,
+        "days_overdue": 30,
+        "expected_interval": 60,
+        "overdue_ratio": 1.5,
+    }
+
+    # Repeat visitors blend their own cadence (60%) with the procedure median (40%)
+    blended = calculate_churn_risk("2025-03-03", "botox", visit_number=3, days_since_last_visit=30,
+                                   procedure_intervals={"botox": 61.0, "default": 90.0}, reference_date=REF)
+    assert blended["expected_interval"] == 42 and isinstance(blended["expected_interval"], int)
+    assert blended["risk_level"] == "critical"
+
+    # Unparseable dates fall back to the reference date
+    assert calculate_churn_risk("03/03/2025", "x", reference_date=REF)["days_since_visit"] == 0
+
+
+def test_vectorized_scores_fixed_rows():
+    df = pd.DataFrame({
+        "patient_id": ["a", "b", "c", "d"],
+        "procedure": ["botox", "filler", "botox", "laser"],
+        "encounter_date": ["2025-05-20", "2024-12-01", "bad-date", "2025-01-15"],
+        "visit_number": [1, 2, 4, 1],
+        "days_since_last_visit": [0, 45, 120, 0],
+    })
+    intervals = {"botox": 70.0, "filler": 150.0, "default": 90.0}
+    churn = analyze_patient_churn(df, REF, procedure_intervals=intervals)
+
+    assert list(churn.columns) == [
+        "patient_id", "procedure", "last_visit", "visit_number", "risk_level", "risk_score",
+        "days_since_visit", "days_overdue", "expected_interval", "overdue_ratio",
+    ]
+    # a: 12 days into a 70-day botox interval
+    # b: repeat visitor, int(0.4 * 150 + 0.6 * 45) = 87-day interval, 182 days since
+    # c: unparseable date counts as a visit on REF; interval int(0.4 * 70 + 0.6 * 120) = 100
+    # d: no laser interval, so the 90-day default; 137 days since
+    assert churn[["risk_level", "risk_score", "days_since_visit", "days_overdue", "expected_interval",
+                  "overdue_ratio"]].to_dict("records") == [
+        {"risk_level": "on_schedule", "risk_score": 0, "days_since_visit": 12, "days_overdue": -58,
+         "expected_interval": 70, "overdue_ratio": 0.17},
+        {"risk_level": "critical", "risk_score": 100, "days_since_visit": 182, "days_overdue": 95,
+         "expected_interval": 87, "overdue_ratio": 2.09},
+        {"risk_level": "on_schedule", "risk_score": 0, "days_since_visit": 0, "days_overdue": -100,
+         "expected_interval": 100, "overdue_ratio": 0.0},
+        {"risk_level": "medium", "risk_score": 50, "days_since_visit": 137, "days_overdue": 47,
+         "expected_interval": 90, "overdue_ratio": 1.52},
+    ]
+
+
+def test_score_churn_arrays_accepts_datetime_columns():
+    dates = pd.to_datetime(pd.Series(["2025-01-01", None]))
+    scored = score_churn_arrays(dates, ["botox", "botox"], reference_date=REF)
+    assert scored["days_since_visit"].tolist() == [151, 0]
+    assert scored["risk_level"].tolist() == ["high", "on_schedule"]
@@ -0,0 +1,50 @@
+from datetime import date, timedelta
+
+import pandas as pd
+
+from services.churn_scoring import get_churn_summary
+from services.churn_store import get_stored_churn_summary, persist_churn_scores, rescore_all_churn_runs
+
+REF = date(2025, 6, 1)
+
+
+def _patients(n=200):
+    last_visits = [pd.Timestamp("2025-05-30") - pd.Timedelta(days=3 * i) for i in range(n)]
+    return pd.DataFrame({
+        "patient_id": [f"P{i}" for i in range(n)],
+        "last_visit": last_visits,
+        "visit_number": [1 + i % 4 for i in range(n)],
+        "days_since_last_visit": [(i * 7) % 150 for i in range(n)],
+    })
+
+
+def _without_patient_lists(summary):
+    return {k: v for k, v in summary.items() if k not in ("scored_as_of", "high_risk_patients")}
+
+
+def test_stored_summary_matches_full_scoring(db):
+    df = _patients()
+    persist_churn_scores(db, "run-1", df, reference_date=REF)
+
+    stored = get_stored_churn_summary(db, "run-1", reference_date=REF)
+    fresh = get_churn_summary(df, REF)
+    assert stored["scored_as_of"] == REF.isoformat()
+    assert _without_patient_lists(stored) == _without_patient_lists(fresh)
+    assert {p["risk_score"] for p in stored["high_risk_patients"]} == \
+        {p["risk_score"] for p in fresh["high_risk_patients"]}
+    assert get_stored_churn_summary(db, "missing-run") is None
+
+
+def test_rescoring_advances_without_reloading_visits(db):
+    df = _patients()
+    persist_churn_scores(db, "run-1", df, reference_date=REF)
+
+    later = REF + timedelta(days=45)
+    assert rescore_all_churn_runs(db, reference_date=later) == ["run-1"]
+    assert rescore_all_churn_runs(db, reference_date=later) == []
+
+    stored = get_stored_churn_summary(db, "run-1", reference_date=later)
+    fresh = get_churn_summary(df, later)
+    for key in ("total_patients", "at_risk_count", "critical_count", "high_count", "medium_count",
+                "low_count", "on_schedule_count", "avg_days_overdue", "risk_distribution"):
+        assert stored[key] == fresh[key], key
@@ -0,0 +1,38 @@
+import hashlib
+
+import pandas as pd
+
+from services import customer_match
+from services.customer_match import hash_pii, normalize_emails, normalize_phones, shutdown_hash_pool
+
+
+def _sha(value):
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def test_normalization_follows_upload_specs():
+    emails = normalize_emails(pd.Series([" Jane.Doe@Example.COM ", "not-an-email", None]))
+    assert emails.tolist()[0] == "jane.doe@example.com"
+    assert emails.isna().tolist() == [False, True, True]
+
+    phones = normalize_phones(pd.Series(["(512) 555-0100", "1-512-555-0100", "+44 20 7946 0958", 5125550100.0, "12"]))
+    assert phones.tolist()[:4] == ["15125550100", "15125550100", "442079460958", "15125550100"]
+    assert phones.isna().tolist()[4]
+
+
+def test_hash_pii_chunks_across_processes_match_inline():
+    df = pd.DataFrame({
+        "email": [f"User{i}@Example.com" for i in range(10)] + [None],
+        "phone": [f"512-555-{i:04d}" for i in range(10)] + ["n/a"],
+    })
+
+    inline = hash_pii(df, workers=1, chunk_size=4)
+    try:
+        assert inline.equals(hash_pii(df, workers=2, chunk_size=4))
+        pool = customer_match._pool
+        assert inline.equals(hash_pii(df, workers=2, chunk_size=4))
+        assert customer_match._pool is pool  # reused, not re-created per call
+    finally:
+        shutdown_hash_pool()
+    assert inline.loc[0].tolist() == [_sha("user0@example.com"), _sha("15125550000"), _sha("+15125550000")]
+    assert inline.loc[10].isna().all()
@@ -0,0 +1,37 @@
+import asyncio
+
+from sqlalchemy import create_engine, text
+
+from database import async_database_url, configure_sqlite, engine_options
+
+
+def test_async_database_url_picks_async_drivers():
+    assert async_database_url("sqlite:///app.db") == "sqlite+aiosqlite:///app.db"
+    assert async_database_url("postgres://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+    assert async_database_url("postgresql://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+
+
+def test_file_sqlite_gets_wal_and_busy_timeout(tmp_path):
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    engine = configure_sqlite(create_engine(url, **engine_options(url)))
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() > 0
+    engine.dispose()
+
+
+def test_async_engine_applies_pragmas(tmp_path):
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    url = async_database_url(f"sqlite:///{tmp_path / 'app.db'}")
+
+    async def journal_mode():
+        engine = create_async_engine(url, **engine_options(url))
+        configure_sqlite(engine.sync_engine)
+        async with engine.connect() as conn:
+            mode = (await conn.execute(text("PRAGMA journal_mode"))).scalar()
+        await engine.dispose()
+        return mode
+
+    assert asyncio.run(journal_mode()) == "wal"
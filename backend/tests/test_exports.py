@@ -0,0 +1,58 @@
+import gzip
+import io
+
+import pandas as pd
+
+from database import AnalysisRun
+from services.exports import stream_csv, stream_parquet
+from services.run_patients import (
+    RUN_PATIENT_COLUMNS, RUN_PATIENT_TYPES, iter_run_patient_chunks, label_patients, persist_run_patients,
+    persisted_patient_columns
+)
+
+
+def _patients(n):
+    return pd.DataFrame({
+        "patient_id": [f"p{i}" for i in range(n)],
+        "zip_code": ["78701"] * n,
+        "behavioral_segment": ["VIP"] * n,
+        "value_score": [i / n for i in range(n)],
+        "revenue": [float(i) for i in range(n)],
+    })
+
+
+def test_run_patients_stream_in_score_order_and_chunks(session_factory):
+    persist_run_patients(session_factory(), "r1", label_patients(_patients(25), "Luxe"))
+
+    chunks = list(iter_run_patient_chunks(session_factory, "r1", chunk_size=10))
+    assert [len(c) for c in chunks] == [10, 10, 5]
+    rows = [row for chunk in chunks for row in chunk]
+    assert rows[0][0] == "p24" and rows[-1][0] == "p0"
+    assert [row[4] for row in rows].count("Luxe") == 5
+
+
+def test_persisting_is_recorded_on_the_run_even_without_patients(db):
+    db.add(AnalysisRun(id="r1", dataset_id="d1", status="done"))
+    db.commit()
+    assert persisted_patient_columns(db, "r1") is None
+
+    persist_run_patients(db, "r1", label_patients(_patients(0), "Luxe"))
+
+    # No visits_per_year in the upload, so the export leaves it out
+    assert persisted_patient_columns(db, "r1") == [
+        "patient_id", "zip_code", "behavioral_segment", "value_score", "cohort", "revenue"
+    ]
+    assert db.get(AnalysisRun, "r1").run_patient_count == 0
+
+
+def test_csv_gzip_and_parquet_match():
+    columns = list(RUN_PATIENT_COLUMNS)
+    chunks = [[("p1", "78701", "VIP", 0.9, "Luxe", 100.0, None)], [("p2", None, "New", 0.1, "General", None, 2.0)]]
+
+    plain = b"".join(stream_csv(chunks, columns))
+    assert gzip.decompress(b"".join(stream_csv(chunks, columns, gzip=True))) == plain
+    from_csv = pd.read_csv(io.BytesIO(plain), dtype={"zip_code": str})
+
+    from_parquet = pd.read_parquet(io.BytesIO(b"".join(stream_parquet(chunks, columns, RUN_PATIENT_TYPES))))
+    assert list(from_parquet.columns) == columns
+    pd.testing.assert_frame_equal(from_csv, from_parquet, check_dtype=False)
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+from services import scoring
+
+
+def _zip_universe(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'zip': [str(10000 + i) for i in range(n)],
+        'population': rng.integers(2000, 60000, n),
+        'median_income': rng.choice([40000, 75000, 140000], n) + rng.normal(0, 3000, n),
+        'competitors': rng.integers(0, 6, n),
+        'distance_miles': rng.uniform(0, 40, n),
+    })
+
+
+def test_rule_based_cohorts_match_thresholds():
+    zips = pd.DataFrame({
+        'median_income': [120000, 120000, 60000, 30000, np.nan],
+        'competitors': [1, 5, 0, 0, 0],
+    })
+    _, _, labels = scoring._create_rule_based_cohorts(zips)
+    assert labels == ['Luxury Clients', 'Comfort Spenders', 'Comfort Spenders',
+                      'Budget Conscious', 'Budget Conscious']
+
+
+def test_minibatch_cohorts_cached_and_predicted():
+    zips = _zip_universe(600)
+    kmeans, scaler, labels = scoring.fit_lifestyle_cohorts(zips, mode="minibatch", cache_key="test-run")
+    assert len(labels) == len(zips)
+    assert set(labels) <= set(scoring.COHORT_NAMES)
+
+    model = scoring.get_cached_cohort_model("test-run")
+    assert model.kmeans is kmeans
+
+    # Richest ZIPs land in the luxury cohort without refitting
+    new_zips = _zip_universe(50, seed=1)
+    seen, centers = model.n_seen, model.kmeans.cluster_centers_.copy()
+    predicted = scoring.assign_lifestyle_cohorts(new_zips, "test-run")
+    assert predicted == model.predict(new_zips)
+    rich = new_zips['median_income'] > 120000
+    assert {predicted[i] for i in np.flatnonzero(rich)} == {'Luxury Clients'}
+    # Plain lookups don't move the cached centroids
+    assert model.n_seen == seen
+    np.testing.assert_array_equal(model.kmeans.cluster_centers_, centers)
+
+    scoring.assign_lifestyle_cohorts(new_zips, "test-run", update=True)
+    assert model.n_seen == seen + len(new_zips)
+    assert scoring.assign_lifestyle_cohorts(new_zips, "unknown-run") is None
+
+
+def test_cohort_model_cache_is_lru_bounded(monkeypatch):
+    monkeypatch.setattr(scoring, "COHORT_MODEL_CACHE_SIZE", 2)
+    monkeypatch.setattr(scoring, "_cohort_model_cache", scoring.OrderedDict())
+    for key in ("a", "b"):
+        scoring._cache_cohort_model(key, object())
+    scoring.get_cached_cohort_model("a")  # now most recently used
+    scoring._cache_cohort_model("c", object())
+    assert list(scoring._cohort_model_cache) == ["a", "c"]
@@ -0,0 +1,100 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from services import llm_cache
+from services.llm_cache import MemoryLRU, SQLiteStore, TieredLLMCache, make_cache_key
+
+
+def test_cache_key_normalizes_whitespace_and_includes_params():
+    key = make_cache_key("Write  an ad\n for  Botox ", "model-a", 0.7, 200)
+
+    assert key == make_cache_key("Write an ad for Botox", "model-a", 0.7, 200)
+    assert key != make_cache_key("Write an ad for Botox", "model-b", 0.7, 200)
+    assert key != make_cache_key("Write an ad for Botox", "model-a", 0.2, 200)
+
+
+def test_memory_lru_evicts_least_recent_and_expired():
+    lru = MemoryLRU(max_entries=2)
+    lru.set("a", "1", expires_at=100)
+    lru.set("b", "2", expires_at=100)
+    assert lru.get("a", now=0) == "1"  # a is now most recent
+    lru.set("c", "3", expires_at=100)
+
+    assert lru.get("b", now=0) is None
+    assert lru.get("a", now=0) == "1"
+    assert lru.get("c", now=100) is None  # expired
+    assert len(lru) == 1
+
+
+def test_disk_tier_survives_a_fresh_process_and_evicts_by_size(tmp_path):
+    path = str(tmp_path / "cache.db")
+
+    async def scenario():
+        first = TieredLLMCache(memory_entries=8, disk_path=path, disk_max_bytes=10, redis_url=None)
+        await first.set("k1", "aaaa")
+        await first.set("k2", "bbbb")
+
+        second = TieredLLMCache(memory_entries=8, disk_path=path, disk_max_bytes=10, redis_url=None)
+        assert await second.get("k1") == "aaaa"
+        assert second.stats["disk_hits"] == 1
+        assert await second.get("k1") == "aaaa"
+        assert second.stats["memory_hits"] == 1
+
+        await second.set("k3", "cccc")  # 12 bytes > 10: least recently used (k2) goes
+        third = TieredLLMCache(memory_entries=8, disk_path=path, disk_max_bytes=10, redis_url=None)
+        assert await third.get("k2") is None
+        assert await third.get("k3") == "cccc"
+
+    asyncio.run(scenario())
+
+
+def test_disk_store_closes_its_connections(tmp_path, monkeypatch):
+    opened = []
+    connect = sqlite3.connect
+    monkeypatch.setattr(llm_cache.sqlite3, "connect", lambda *a, **k: opened.append(connect(*a, **k)) or opened[-1])
+
+    store = SQLiteStore(str(tmp_path / "cache.db"), max_bytes=100)
+    store.set("k1", "aaaa", expires_at=10, now=0)
+    assert store.get("k1", now=1)[0] == "aaaa"
+
+    assert len(opened) == 3
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+
+def test_ttl_expires_entries(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: clock[0])
+
+    async def scenario():
+        cache = TieredLLMCache(disk_path=str(tmp_path / "cache.db"), redis_url=None, ttl_seconds=60)
+        await cache.set("k", "v")
+        clock[0] += 59
+        assert await cache.get("k") == "v"
+        clock[0] += 2
+        assert await cache.get("k") is None
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_misses_share_one_upstream_call(tmp_path):
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "copy"
+
+    async def scenario():
+        cache = TieredLLMCache(disk_path=str(tmp_path / "cache.db"), redis_url=None)
+        results = await asyncio.gather(*[cache.get_or_compute("k", upstream) for _ in range(5)])
+        assert results == ["copy"] * 5
+        assert await cache.get_or_compute("k", upstream) == "copy"
+        return cache.stats
+
+    stats = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert stats["coalesced"] == 4
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from services import llm_client
+from services.llm_cache import TieredLLMCache
+
+
+class StubMessagesServer(ThreadingHTTPServer):
+    """Minimal /v1/messages endpoint; `statuses` is consumed one per request."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.statuses = []
+        self.delay = 0.0
+        self.stop_reason = "end_turn"
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            status = server.statuses.pop(0) if server.statuses else 200
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+
+        if status == 200 and body.get("stream"):
+            self._write_stream(body, ["echo", ": ", body["messages"][0]["content"]])
+            return
+        if status == 200:
+            payload = {
+                "id": "msg_stub", "type": "message", "role": "assistant", "model": body["model"],
+                "content": [{"type": "text", "text": "echo: " + body["messages"][0]["content"]}],
+                "stop_reason": server.stop_reason, "stop_sequence": None,
+                "usage": {"input_tokens": 1, "output_tokens": 1},
+            }
+        else:
+            payload = {"type": "error", "error": {"type": "overloaded_error", "message": "stub"}}
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_stream(self, body, pieces):
+        message = {
+            "id": "msg_stub", "type": "message", "role": "assistant", "model": body["model"], "content": [],
+            "stop_reason": None, "stop_sequence": None, "usage": {"input_tokens": 1, "output_tokens": 0},
+        }
+        events = [("message_start", {"type": "message_start", "message": message}),
+                  ("content_block_start", {"type": "content_block_start", "index": 0,
+                                           "content_block": {"type": "text", "text": ""}})]
+        events += [("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                            "delta": {"type": "text_delta", "text": piece}}) for piece in pieces]
+        events += [("content_block_stop", {"type": "content_block_stop", "index": 0}),
+                   ("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                      "usage": {"output_tokens": len(pieces)}}),
+                   ("message_stop", {"type": "message_stop"})]
+        data = "".join(f"event: {name}\ndata: {json.dumps(payload)}\n\n" for name, payload in events).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    server = StubMessagesServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("ANTHROPIC_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_BASE_SECONDS", 0.01)
+    monkeypatch.setattr(llm_client, "get_llm_cache", lambda: None)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _run(coro):
+    async def wrapper():
+        try:
+            return await coro
+        finally:
+            await llm_client.close_async_client()
+    return asyncio.run(wrapper())
+
+
+def test_complete_retries_transient_errors(stub_server):
+    stub_server.statuses = [529, 500]
+
+    assert _run(llm_client.complete("hello", deadline=5, temperature=None)) == "echo: hello"
+    assert stub_server.requests == 3
+
+
+def test_complete_does_not_retry_client_errors(stub_server):
+    stub_server.statuses = [400]
+
+    with pytest.raises(Exception) as excinfo:
+        _run(llm_client.complete("hello", deadline=5, temperature=None))
+    assert getattr(excinfo.value, "status_code", None) == 400
+    assert stub_server.requests == 1
+
+
+def test_complete_enforces_deadline(stub_server):
+    stub_server.delay = 1.0
+
+    started = time.monotonic()
+    with pytest.raises(llm_client.LLMDeadlineExceeded):
+        _run(llm_client.complete("slow", deadline=0.2, temperature=None))
+    assert time.monotonic() - started < 0.9
+
+
+def test_concurrency_is_limited(stub_server, monkeypatch):
+    monkeypatch.setattr(llm_client, "LLM_MAX_CONCURRENCY", 2)
+    stub_server.delay = 0.1
+
+    async def fan_out():
+        return await asyncio.gather(*[llm_client.complete(f"p{i}", deadline=5, temperature=None) for i in range(6)])
+
+    results = _run(fan_out())
+    assert results == [f"echo: p{i}" for i in range(6)]
+    assert stub_server.max_in_flight == 2
+
+
+def test_stream_complete_yields_text_deltas(stub_server):
+    stub_server.statuses = [529]
+
+    async def collect():
+        return [chunk async for chunk in llm_client.stream_complete("hi", deadline=5, temperature=None)]
+
+    assert _run(collect()) == ["echo", ": ", "hi"]
+    assert stub_server.requests == 2
+
+
+def test_truncated_and_invalid_replies_are_not_cached(stub_server, tmp_path, monkeypatch):
+    cache = TieredLLMCache(disk_path=str(tmp_path / "cache.db"), redis_url=None)
+    monkeypatch.setattr(llm_client, "get_llm_cache", lambda: cache)
+
+    async def twice(prompt, **kwargs):
+        for _ in range(2):
+            await llm_client.complete(prompt, deadline=5, temperature=None, **kwargs)
+
+    stub_server.stop_reason = "max_tokens"
+    _run(twice("cut off"))
+    assert stub_server.requests == 2
+
+    stub_server.stop_reason = "end_turn"
+    _run(twice("not json", validate=json.loads))
+    assert stub_server.requests == 4
+
+    _run(twice("plain text"))
+    assert stub_server.requests == 5
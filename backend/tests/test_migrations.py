@@ -0,0 +1,46 @@
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, inspect, text
+
+from database import Base, alembic_config
+
+
+def _upgrade(url, revision="head"):
+    config = alembic_config(url)
+    config.attributes["configure_logger"] = False
+    command.upgrade(config, revision)
+
+
+def test_migrations_match_models(tmp_path):
+    url = f"sqlite:///{tmp_path / 'fresh.db'}"
+    _upgrade(url)
+
+    engine = create_engine(url)
+    with engine.connect() as conn:
+        diff = compare_metadata(MigrationContext.configure(conn), Base.metadata)
+    assert diff == []
+
+
+def test_baseline_adopts_legacy_database(tmp_path):
+    url = f"sqlite:///{tmp_path / 'legacy.db'}"
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        # patient_outreach / sms_campaigns as created before their later columns existed
+        conn.execute(text("CREATE TABLE patient_outreach (id VARCHAR PRIMARY KEY, run_id VARCHAR NOT NULL, "
+                          "patient_id VARCHAR NOT NULL, contacted_at DATETIME, returned_at DATETIME, "
+                          "revenue_recovered FLOAT, days_stale_when_contacted INTEGER, outcome VARCHAR, "
+                          "loan_amount FLOAT, commission FLOAT)"))
+        conn.execute(text("INSERT INTO patient_outreach (id, run_id, patient_id) VALUES ('o1', 'r1', 'p1')"))
+        conn.execute(text("CREATE TABLE sms_campaigns (id VARCHAR PRIMARY KEY, message_template TEXT NOT NULL)"))
+        conn.execute(text("INSERT INTO sms_campaigns (id, message_template) VALUES ('c1', 'hi')"))
+
+    _upgrade(url)
+
+    inspector = inspect(engine)
+    assert {"segment", "campaign_name"} <= {c["name"] for c in inspector.get_columns("patient_outreach")}
+    assert "ix_patient_outreach_run_pending" in {i["name"] for i in inspector.get_indexes("patient_outreach")}
+    assert "sms_messages" in inspector.get_table_names()
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT patient_id FROM patient_outreach")).scalar() == "p1"
+        assert conn.execute(text("SELECT status FROM sms_campaigns")).scalar() == "done"
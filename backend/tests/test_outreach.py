@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import pandas as pd
+
+from database import PatientOutreach
+from services.outreach import find_outreach_returns, reconcile_outreach
+
+
+def _outreach(db, outreach_id, run_id, patient_id, contacted_at, returned_at=None):
+    db.add(PatientOutreach(id=outreach_id, run_id=run_id, patient_id=patient_id,
+                           contacted_at=contacted_at, returned_at=returned_at, outcome="pending"))
+
+
+VISITS = pd.DataFrame({
+    "patient_id": [1, 1, 2, 3, 3],
+    "visit_date": ["2025-01-05", "2025-03-01", "2025-01-01", "2025-02-10", "2025-02-20"],
+    "revenue": [100.0, 250.0, 80.0, 40.0, 60.0],
+})
+
+
+def test_find_returns_counts_only_visits_after_contact():
+    pending = pd.DataFrame({
+        "id": ["o1", "o2", "o3", "o4"],
+        "patient_id": ["1", "2", "3", "9"],
+        "contacted_at": pd.to_datetime(["2025-02-01", "2025-02-01", "2025-02-15", "2025-01-01"]),
+    })
+
+    returns = find_outreach_returns(pending, VISITS, "patient_id", "visit_date", "revenue")
+
+    assert dict(zip(returns["id"], returns["revenue"])) == {"o1": 250.0, "o3": 60.0}
+
+
+def test_reconcile_updates_pending_rows_in_bulk(db):
+    contacted = datetime(2025, 2, 1)
+    _outreach(db, "o1", "run-a", "1", contacted)
+    _outreach(db, "o2", "run-b", "1", contacted)
+    _outreach(db, "o3", "run-a", "3", contacted, returned_at=datetime(2025, 2, 5))
+    _outreach(db, "o4", "run-a", "2", contacted)
+    db.commit()
+
+    result = reconcile_outreach(db, VISITS, "patient_id", "visit_date", "revenue", run_id="run-a", outcome="closed")
+
+    assert result == {"checked": 2, "reconciled": 1, "revenue": 250.0}
+    db.expire_all()
+    rows = {o.id: o for o in db.query(PatientOutreach)}
+    assert (rows["o1"].outcome, rows["o1"].revenue_recovered) == ("closed", 250.0)
+    assert rows["o1"].returned_at is not None
+    assert rows["o2"].returned_at is None  # other run
+    assert rows["o4"].returned_at is None  # visit before contact
+
+
+def test_mark_contacted_upserts_in_bulk(db):
+    from services.outreach import mark_contacted
+
+    _outreach(db, "o1", "run-a", "1", datetime(2025, 1, 1))
+    db.commit()
+
+    result = mark_contacted(db, "run-a", [
+        {"patient_id": "1", "days_stale": 90},
+        {"patient_id": "2", "days_stale": 120, "loan_amount": 200000.0},
+        {"patient_id": 3},
+    ], segment="lapsed")
+
+    assert result == {"contacted": 3, "inserted": 2, "updated": 1}
+    rows = {o.patient_id: o for o in db.query(PatientOutreach).filter(PatientOutreach.run_id == "run-a")}
+    assert len(rows) == 3
+    assert (rows["1"].days_stale_when_contacted, rows["1"].contacted_at > datetime(2025, 1, 1)) == (90, True)
+    assert (rows["2"].segment, rows["2"].commission) == ("lapsed", 2000.0)
+    assert rows["3"].outcome == "pending"
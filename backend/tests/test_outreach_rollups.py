@@ -0,0 +1,40 @@
+from datetime import datetime
+
+import pandas as pd
+
+from database import OutreachRollup, PatientOutreach
+from services.outreach import mark_contacted, mark_returned, reconcile_outreach, set_outreach_outcome
+from services.outreach_rollups import MEASURES, rebuild_outreach_rollups
+
+
+def _rollups(db):
+    rows = db.query(OutreachRollup).all()
+    return {
+        (r.run_id, r.segment, r.day, r.stale_bucket): tuple(round(getattr(r, m), 2) for m in MEASURES)
+        for r in rows if any(getattr(r, m) for m in MEASURES)
+    }
+
+
+def test_incremental_rollups_match_full_rebuild(db):
+    mark_contacted(db, "r1", [{"patient_id": "1", "days_stale": 3}, {"patient_id": "2", "days_stale": 45},
+                              {"patient_id": "3", "loan_amount": 20000}],
+                   segment="lapsed", contacted_at=datetime(2025, 2, 1))
+    mark_contacted(db, "r2", [{"patient_id": "1", "days_stale": 10}], contacted_at=datetime(2025, 2, 2))
+    # Re-contact moves patient 2 to a new day and bucket
+    mark_contacted(db, "r1", [{"patient_id": "2", "days_stale": 90}], segment="lapsed",
+                   contacted_at=datetime(2025, 2, 3))
+
+    visits = pd.DataFrame({"patient_id": [1], "visit_date": ["2025-02-10"], "revenue": [120.0]})
+    reconcile_outreach(db, visits, "patient_id", "visit_date", "revenue", run_id="r1")
+    mark_returned(db, "r2", "1", 75.0)
+    outreach_id = db.query(PatientOutreach.id).filter(PatientOutreach.patient_id == "3").scalar()
+    set_outreach_outcome(db, outreach_id, "closed")
+    set_outreach_outcome(db, outreach_id, "lost")
+
+    incremental = _rollups(db)
+    rebuild_outreach_rollups(db)
+    assert incremental == _rollups(db)
+
+    lapsed = [v for k, v in incremental.items() if k[1] == "lapsed"]
+    contacted, returned, revenue = (sum(v[i] for v in lapsed) for i in range(3))
+    assert (contacted, returned, revenue) == (3, 2, 320.0)
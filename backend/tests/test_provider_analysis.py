@@ -0,0 +1,45 @@
+import pandas as pd
+
+from services.provider_analysis import analyze_provider_concentration
+
+
+def _visits():
+    return pd.DataFrame({
+        "patient_id": ["P1", "P2", "P1", "P3", "P4", "P2"],
+        "provider": ["Dr A", " Dr B", "Dr A", "Dr A", "Dr B", None],
+        "revenue": [100.0, 50.0, 200.0, 300.0, 150.0, 999.0],
+        "visit_date": ["2024-01-05", "2024-01-20", "2024-02-03", "2024-02-10", "2024-02-15", "2024-02-20"],
+    })
+
+
+def test_provider_concentration_aggregates_per_provider():
+    result = analyze_provider_concentration(_visits(), vip_patients={"P1"}, min_risk_threshold=50)
+
+    assert [p["name"] for p in result["providers"]] == ["Dr A", "Dr B"]
+    dr_a, dr_b = result["providers"]
+    assert (dr_a["revenue"], dr_a["revenue_pct"], dr_a["patient_count"], dr_a["vip_count"]) == (600, 75.0, 2, 1)
+    assert (dr_b["revenue"], dr_b["patient_count"], dr_b["avg_revenue_per_patient"]) == (200, 2, 100)
+    assert result["has_concentration_risk"] is True
+    assert "trend" not in result
+
+
+def test_provider_share_trend_monthly_and_rolling():
+    monthly = analyze_provider_concentration(_visits(), trend="monthly")["trend"]
+    assert [p["period"] for p in monthly["periods"]] == ["2024-01", "2024-02"]
+    assert monthly["periods"][0]["provider_share"] == {"Dr A": 66.7, "Dr B": 33.3}
+    assert monthly["periods"][1]["overall_top_provider_pct"] == 76.9
+    assert monthly["top_provider_drift"] == 10.2
+
+    rolling = analyze_provider_concentration(_visits(), trend="monthly", trend_window=2)["trend"]
+    assert rolling["periods"][1]["total_revenue"] == 800
+    assert rolling["periods"][1]["top_provider_pct"] == 75.0
+
+
+def test_provider_share_trend_keeps_empty_periods_in_window():
+    visits = _visits()
+    visits.loc[visits["visit_date"] >= "2024-02-01", "visit_date"] = "2024-04-10"
+    trend = analyze_provider_concentration(visits, trend="monthly", trend_window=2)["trend"]
+
+    assert [p["period"] for p in trend["periods"]] == ["2024-01", "2024-02", "2024-03", "2024-04"]
+    assert [p["total_revenue"] for p in trend["periods"]] == [150, 150, 0, 650]
+    assert trend["periods"][2]["top_provider"] is None
@@ -0,0 +1,60 @@
+import gzip
+
+import numpy as np
+import pandas as pd
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from services.json_response import ORJSONResponse
+from services.response_middleware import CompressionMiddleware, ResponseMetrics, choose_encoding
+
+
+def _app(metrics):
+    app = FastAPI(default_response_class=ORJSONResponse)
+    app.add_middleware(CompressionMiddleware, minimum_size=500, metrics=metrics)
+
+    @app.get("/big/{n}")
+    async def big(n: int):
+        return ORJSONResponse({"values": np.arange(n, dtype=np.float64), "nan": np.float64("nan"),
+                               "when": pd.Timestamp("2025-01-01"), "count": np.int64(n)})
+
+    @app.get("/stream")
+    async def stream():
+        return StreamingResponse((b"row,%d\n" % i * 50 for i in range(20)), media_type="text/csv")
+
+    return app
+
+
+def test_orjson_response_handles_numpy_and_pandas():
+    body = ORJSONResponse({"a": np.float64("nan"), "b": np.int64(3), "c": pd.NaT, "d": pd.Series([1, 2])}).body
+    assert body == b'{"a":null,"b":3,"c":null,"d":[1,2]}'
+
+
+def test_compresses_above_threshold_and_records_metrics():
+    metrics = ResponseMetrics()
+    client = TestClient(_app(metrics))
+
+    small = client.get("/big/3", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+    assert small.json()["nan"] is None and small.json()["when"] == "2025-01-01T00:00:00"
+
+    with client.stream("GET", "/big/500", headers={"Accept-Encoding": "gzip"}) as response:
+        raw = b"".join(response.iter_raw())
+    assert response.headers["content-encoding"] == "gzip"
+    assert int(response.headers["content-length"]) == len(raw)
+    assert gzip.decompress(raw).startswith(b'{"values":[0.0,1.0')
+
+    with client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as response:
+        raw = b"".join(response.iter_raw())
+    assert gzip.decompress(raw) == b"".join(b"row,%d\n" % i * 50 for i in range(20))
+
+    report = metrics.snapshot()
+    assert report["GET /big/{n}"]["requests"] == 2
+    assert report["GET /big/{n}"]["avg_serialize_ms"] is not None
+    assert report["GET /stream"]["compression_ratio"] > 1
+
+
+def test_choose_encoding_respects_quality():
+    assert choose_encoding("gzip;q=0, identity") is None
+    assert choose_encoding("deflate, gzip") == "gzip"
@@ -0,0 +1,52 @@
+from alembic import command
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+
+from database import AnalysisRun, Base, alembic_config
+from services.run_artifacts import load_run_artifact, load_run_artifacts, save_run_artifacts
+
+
+def _upgrade(url, revision):
+    config = alembic_config(url)
+    config.attributes["configure_logger"] = False
+    command.upgrade(config, revision)
+
+
+def test_artifacts_round_trip_and_stay_out_of_run_queries():
+    engine = create_engine("sqlite://", future=True)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    segments = [{"zip": f"{i:05d}", "match_score": i / 100} for i in range(500)]
+    db.add(AnalysisRun(id="r1", dataset_id="d1", status="done", headline_metrics={"total": 1}))
+    save_run_artifacts(db, "r1", {"top_segments": segments, "dominant_profile": {"label": "VIP"}})
+    db.commit()
+    db.expunge_all()
+
+    run = db.query(AnalysisRun).filter(AnalysisRun.id == "r1").first()
+    assert "headline_metrics" not in run.__dict__  # deferred until accessed
+    assert load_run_artifacts(db, "r1", ["top_segments", "map_points"]) == {"top_segments": segments, "map_points": None}
+    assert load_run_artifact(db, "r1", "strategic_insights", []) == []
+
+    save_run_artifacts(db, "r1", {"dominant_profile": {"label": "Lapsed"}})
+    db.commit()
+    assert load_run_artifact(db, "r1", "dominant_profile") == {"label": "Lapsed"}
+
+
+def test_migration_moves_existing_blobs(tmp_path):
+    url = f"sqlite:///{tmp_path / 'runs.db'}"
+    _upgrade(url, "0002_hot_path_indexes")
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO analysis_runs (id, dataset_id, status, top_segments, dominant_profile, strategic_insights) "
+            "VALUES ('r1', 'd1', 'done', :segments, :profile, NULL)"
+        ), {"segments": '[{"zip": "06830"}]', "profile": '{"label": "VIP"}'})
+
+    _upgrade(url, "head")
+
+    assert "top_segments" not in {c["name"] for c in inspect(engine).get_columns("analysis_runs")}
+    db = sessionmaker(bind=engine)()
+    assert load_run_artifacts(db, "r1") == {
+        "top_segments": [{"zip": "06830"}], "map_points": None,
+        "dominant_profile": {"label": "VIP"}, "strategic_insights": None, "dataset_summary": None,
+    }
@@ -0,0 +1,82 @@
+from datetime import datetime
+
+from alembic import command
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from database import AnalysisRun, AnalysisRunArtifact, alembic_config
+from services.run_artifacts import encode_artifact, save_run_artifacts
+from services.run_cache import (RUN_CACHE_MAX_AGE, daily_variant, etag_matches, not_modified, run_cache_headers,
+                                run_etag)
+
+
+def test_run_etag_tracks_status_artifacts_and_variant(db):
+    db.add(AnalysisRun(id="r1", dataset_id="d1", status="processing"))
+    save_run_artifacts(db, "r1", {"top_segments": [{"zip": "78701"}], "dominant_profile": {"label": "VIP"}})
+    db.commit()
+    assert run_etag(db, "r1") is None
+    assert run_etag(db, "missing") is None
+
+    db.query(AnalysisRun).filter(AnalysisRun.id == "r1").update({"status": "done", "completed_at": datetime(2026, 1, 1)})
+    db.commit()
+    etag = run_etag(db, "r1", ["top_segments"], "export", "full")
+    assert etag.startswith('W/"') and etag == run_etag(db, "r1", ["top_segments"], "export", "full")
+    assert etag != run_etag(db, "r1", ["top_segments"], "export", "google")
+
+    # Only the artifacts a response reads version it
+    save_run_artifacts(db, "r1", {"dominant_profile": {"label": "Lapsed"}})
+    db.commit()
+    assert etag == run_etag(db, "r1", ["top_segments"], "export", "full")
+    save_run_artifacts(db, "r1", {"top_segments": [{"zip": "10001"}]})
+    db.commit()
+    assert etag != run_etag(db, "r1", ["top_segments"], "export", "full")
+
+
+def test_daily_variant_expires_at_midnight(db):
+    db.add(AnalysisRun(id="r1", dataset_id="d1", status="done", completed_at=datetime(2026, 1, 1)))
+    db.commit()
+    today, max_age = daily_variant(datetime(2026, 3, 1, 23, 59, 30))
+    tomorrow, _ = daily_variant(datetime(2026, 3, 2, 0, 0, 1))
+    assert (today, max_age) == ("2026-03-01", 30)
+    assert daily_variant(datetime(2026, 3, 1, 0, 0))[1] == min(RUN_CACHE_MAX_AGE, 86400)
+    assert run_etag(db, "r1", [], "results", today) != run_etag(db, "r1", [], "results", tomorrow)
+    assert run_cache_headers('W/"x"', max_age)["Cache-Control"] == "private, max-age=30"
+
+
+def test_if_none_match_gets_304():
+    etag = 'W/"abc"'
+    assert etag_matches('"abc"', etag) and etag_matches('W/"x", W/"abc"', etag) and etag_matches("*", etag)
+    assert not etag_matches('"abcd"', etag) and not etag_matches(None, etag)
+    assert run_cache_headers(None) == {"Cache-Control": "no-cache"}
+
+    app = FastAPI()
+
+    @app.get("/thing")
+    def thing(request: Request):
+        return not_modified(request, etag) or {"ok": True}
+
+    client = TestClient(app)
+    assert client.get("/thing").status_code == 200
+    cached = client.get("/thing", headers={"If-None-Match": etag})
+    assert cached.status_code == 304 and cached.content == b""
+    assert cached.headers["etag"] == etag and cached.headers["cache-control"].startswith("private, max-age=")
+
+
+def test_migration_backfills_artifact_digests(tmp_path):
+    url = f"sqlite:///{tmp_path / 'runs.db'}"
+    config = alembic_config(url)
+    config.attributes["configure_logger"] = False
+    command.upgrade(config, "0006_run_patient_hashes")
+    payload, raw_bytes, digest = encode_artifact({"label": "VIP"})
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO analysis_run_artifacts (run_id, name, encoding, payload, raw_bytes) "
+                          "VALUES ('r1', 'dominant_profile', 'json+zlib', :payload, :raw_bytes)"),
+                     {"payload": payload, "raw_bytes": raw_bytes})
+
+    command.upgrade(config, "head")
+
+    db = sessionmaker(bind=engine)()
+    assert db.query(AnalysisRunArtifact.digest).scalar() == digest
@@ -0,0 +1,58 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+from fastapi.testclient import TestClient
+
+import main
+from database import AnalysisRun, Dataset, get_db
+from services import llm_cache, llm_client
+
+
+class SlowLapsedMessages:
+    """Answers every card instantly except lapsed regulars, which hangs."""
+
+    async def create(self, **params):
+        prompt = params["messages"][0]["content"]
+        if "LAPSED REGULARS" in prompt:
+            await asyncio.sleep(5)
+        cta = prompt.split("CTA action: ")[-1].split("\n")[0]
+        return SimpleNamespace(content=[SimpleNamespace(text=f"Fresh copy: {cta}.")])
+
+
+def _visits(path):
+    rows = []
+    for i in range(12):
+        visits = 6 if i < 4 else (1 if i < 8 else 3)
+        gap = 300 if i >= 8 else (200 if i >= 4 else 0)
+        for v in range(visits):
+            day = pd.Timestamp("2025-09-01") - pd.Timedelta(days=30 * v + gap)
+            rows.append({"patient_id": f"P{i}", "visit_date": day.date().isoformat(), "revenue": 200.0,
+                         "zip_code": "78701", "treatment": "Botox"})
+    pd.DataFrame(rows).to_csv(path, index=False)
+
+
+def test_slow_card_falls_back_without_holding_up_the_others(db, tmp_path, monkeypatch):
+    _visits(tmp_path / "visits.csv")
+    db.add(Dataset(id="d1", patients_path=str(tmp_path / "visits.csv"), practice_zip="78701"))
+    db.add(AnalysisRun(id="r1", dataset_id="d1", status="done"))
+    db.commit()
+
+    monkeypatch.setattr(main, "SEGMENT_INSIGHT_DEADLINE_SECONDS", 0.5)
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_ENABLED", False)
+    monkeypatch.setattr(llm_client, "get_async_client", lambda: SimpleNamespace(messages=SlowLapsedMessages()))
+    main.app.dependency_overrides[get_db] = lambda: db
+    try:
+        started = time.monotonic()
+        response = TestClient(main.app).post("/api/v1/segments/segment-insights", data={"run_id": "r1"})
+        elapsed = time.monotonic() - started
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    cards = {card["id"]: card["insight"] for group in response.json()["segments"].values() for card in group}
+    assert cards["lapsed_regulars"].startswith("They were consistent, then stopped")
+    assert cards["high_frequency"] == "Fresh copy: Send VIP reward."
+    assert cards["one_and_done"] == "Fresh copy: Send win-back text."
+    assert elapsed < 3  # cards run concurrently, bounded by the deadline, not the slow call
@@ -0,0 +1,50 @@
+import pandas as pd
+from services.service_analysis import analyze_services, build_service_incidence
+
+
+def _patients():
+    rows = []
+    for i in range(40):
+        treatments = ['Botox']
+        if i % 2 == 0:
+            treatments.append('Filler')
+        if i % 5 == 0:
+            treatments.append('HydraFacial')
+        rows.append({
+            'patient_id': f'P{i}',
+            'treatments_received': ', '.join(treatments),
+            'revenue': 1000.0,
+            'name': f'Patient {i}',
+            'phone': f'555-01{i:02d}',
+        })
+    return pd.DataFrame(rows)
+
+
+def test_incidence_matrix_counts_patients_and_splits_revenue():
+    df = pd.DataFrame({
+        'patient_id': ['a', 'a', 'b'],
+        'treatments': [['Botox', 'Filler'], ['Botox'], ['Filler']],
+        'revenue': [300.0, 100.0, 50.0],
+    })
+    incidence = build_service_incidence(df, 'treatments', 'revenue')
+    assert incidence['services'] == ['Botox', 'Filler']
+    assert incidence['matrix'].toarray().tolist() == [[1, 1], [0, 1]]
+    assert incidence['patient_counts'].tolist() == [1, 2]
+    assert incidence['revenue'].tolist() == [250.0, 200.0]
+
+
+def test_bundle_and_category_outputs():
+    result = analyze_services(_patients())
+
+    pair = result['co_occurrence']['Botox|Filler']
+    assert pair['overlap_count'] == 20
+    assert pair['pct_a_also_b'] == 50 and pair['pct_b_also_a'] == 100
+    assert pair['a_only_count'] == 20 and pair['b_only_count'] == 0
+
+    bundle = result['bundle_opportunity']
+    assert bundle['services'] == ['Botox', 'Filler']
+    assert {p['patient_id'] for p in bundle['bundle_patients']['patients']} == {f'P{i}' for i in range(0, 40, 2)}
+    assert bundle['crosssell_a_to_b']['patients'][0]['name'] == 'Patient 1'
+
+    assert result['category_penetration']['injectables'] == {'count': 40, 'pct': 100}
+    assert result['category_penetration']['skincare'] == {'count': 8, 'pct': 20}
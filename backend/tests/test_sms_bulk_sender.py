@@ -0,0 +1,146 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+from services import sms_service as sms_module
+from services.sms_service import SMSService, TokenBucket
+
+
+class FakeTwilio(ThreadingHTTPServer):
+    """Messages.json stub: per-number scripted failures, counts concurrency."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeTwilioHandler)
+        self.scripts = {}  # to-number -> list of (status, code) to return before succeeding
+        self.delay = 0.0
+        self.received = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+
+class FakeTwilioHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode()).items()}
+        with server.lock:
+            server.received.append(form)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            script = server.scripts.get(form["To"], [])
+            status, code = script.pop(0) if script else (201, None)
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+
+        if status == 201:
+            body = {"sid": f"SM{len(server.received):04d}", "status": "queued", "to": form["To"]}
+        else:
+            body = {"code": code, "message": f"error {code}", "status": status}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def fake_twilio(monkeypatch):
+    server = FakeTwilio()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(sms_module, "TWILIO_API_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setattr(sms_module, "SMS_BACKOFF_BASE_SECONDS", 0.01)
+    monkeypatch.setenv("TWILIO_ACCOUNT_SID", "ACtest")
+    monkeypatch.setenv("TWILIO_AUTH_TOKEN", "token")
+    monkeypatch.setenv("TWILIO_PHONE_NUMBER", "+15550000000")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_bulk_send_retries_rate_limits_and_reports_progress(fake_twilio):
+    recipients = [{"patient_id": f"P{i}", "name": f"Pat {i}", "phone": f"555000{i:04d}"} for i in range(12)]
+    fake_twilio.scripts["+15550000003"] = [(429, 20429), (503, 20503)]
+    fake_twilio.scripts["+15550000007"] = [(400, 21211)]  # invalid number: not retried
+    fake_twilio.delay = 0.05
+    progress = []
+
+    results = asyncio.run(SMSService().send_bulk_sms_async(
+        recipients, "Hi {name}!", messages_per_second=500, max_concurrency=3, on_progress=progress.append
+    ))
+
+    assert (results["total"], results["sent"], results["failed"]) == (12, 11, 1)
+    assert [d["patient_id"] for d in results["details"]] == [f"P{i}" for i in range(12)]
+    assert results["details"][7]["error_code"] == 21211
+    assert results["details"][3]["success"] is True
+    assert len(fake_twilio.received) == 12 + 2 + 0
+    assert fake_twilio.received[0]["Body"].startswith("Hi Pat")
+    assert fake_twilio.max_in_flight <= 3
+    assert [p["done"] for p in progress] == list(range(1, 13))
+
+
+def test_bulk_send_holds_the_account_rate(fake_twilio):
+    recipients = [{"phone": f"555100{i:04d}"} for i in range(30)]
+
+    started = time.monotonic()
+    results = asyncio.run(SMSService().send_bulk_sms_async(recipients, "Hello", messages_per_second=20))
+
+    assert results["sent"] == 30
+    assert time.monotonic() - started >= (30 - 20) / 20 * 0.9  # one second of burst, then 20/s
+
+
+def test_token_bucket_allows_burst_up_to_capacity():
+    async def scenario():
+        bucket = TokenBucket(rate=10, capacity=3)
+        started = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        burst = time.monotonic() - started
+        await bucket.acquire()
+        return burst, time.monotonic() - started
+
+    burst, total = asyncio.run(scenario())
+    assert burst < 0.05
+    assert total >= 0.08
+
+
+def test_only_unsent_requests_are_retried(monkeypatch):
+    import httpx
+
+    monkeypatch.setattr(sms_module, "SMS_BACKOFF_BASE_SECONDS", 0.01)
+    monkeypatch.setenv("TWILIO_ACCOUNT_SID", "ACtest")
+    monkeypatch.setenv("TWILIO_AUTH_TOKEN", "token")
+    monkeypatch.setenv("TWILIO_PHONE_NUMBER", "+15550000000")
+    attempts = {}
+
+    def handler(request):
+        to = parse_qs(request.content.decode())["To"][0]
+        attempts[to] = attempts.get(to, 0) + 1
+        if to == "+15550000001" and attempts[to] == 1:
+            raise httpx.ConnectError("refused", request=request)
+        if to == "+15550000002":
+            raise httpx.ReadTimeout("no reply", request=request)
+        if to == "+15550000003":
+            return httpx.Response(201, text="<html>accepted</html>")
+        return httpx.Response(201, json={"sid": "SM1", "status": "queued"})
+
+    async def send(number):
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            return await SMSService()._send_sms_async(http, "http://twilio.test", TokenBucket(100), number, "Hi")
+
+    assert asyncio.run(send("5550000001"))["success"] is True  # connect error: resent
+    timed_out = asyncio.run(send("5550000002"))
+    assert timed_out["success"] is False and "not resent" in timed_out["error_message"]
+    assert asyncio.run(send("5550000003"))["success"] is True  # 2xx without JSON still counts
+    assert attempts == {"+15550000001": 2, "+15550000002": 1, "+15550000003": 1}
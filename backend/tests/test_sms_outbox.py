@@ -0,0 +1,152 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta
+
+from database import SMSCampaign, SMSMessage
+from services import sms_outbox
+from services.sms_outbox import (
+    campaign_progress,
+    claim_batch,
+    drain_outbox,
+    enqueue_sms_campaign,
+    heartbeat_claim,
+    record_results,
+    release_stale_claims,
+)
+from services.sms_service import TokenBucket
+
+
+class FakeSender:
+    def __init__(self, fail_numbers=()):
+        self.sent = []
+        self.fail_numbers = set(fail_numbers)
+
+    async def send_messages_async(self, messages, status_callback=None, bucket=None, **kwargs):
+        results = []
+        for m in messages:
+            self.sent.append(m["to"])
+            ok = m["to"] not in self.fail_numbers
+            results.append({"success": ok, "sid": f"SM-{m['to']}" if ok else None,
+                            "status": "queued" if ok else "failed", "to": m["to"],
+                            "error_code": None if ok else 21211, "error_message": None if ok else "invalid"})
+        return results
+
+
+class CrashingSender:
+    """Reports each send as it finishes, then dies after `crash_after` messages."""
+
+    def __init__(self, crash_after):
+        self.crash_after = crash_after
+
+    async def send_messages_async(self, messages, status_callback=None, bucket=None, on_result=None, **kwargs):
+        for i, m in enumerate(messages[:self.crash_after]):
+            on_result(i, {"success": True, "sid": f"SM-{m['to']}", "status": "queued", "to": m["to"]})
+        raise RuntimeError("worker died")
+
+
+def _recipients(n):
+    return [{"patient_id": f"P{i}", "name": f"Pat {i}", "phone": f"555000{i:04d}"} for i in range(n)]
+
+
+def test_enqueue_is_idempotent_per_campaign_and_recipient(session_factory):
+    db = session_factory()
+
+    first = enqueue_sms_campaign(db, "c1", "Hi {name}", _recipients(5))
+    again = enqueue_sms_campaign(db, "c1", "Hi {name}", _recipients(7) + _recipients(2))
+
+    assert (first["queued"], again["queued"], again["duplicates"]) == (5, 2, 7)
+    assert db.query(SMSMessage).filter(SMSMessage.campaign_id == "c1").count() == 7
+    assert db.get(SMSCampaign, "c1").total_recipients == 7
+    assert db.query(SMSMessage).filter(SMSMessage.patient_id == "P0").one().message_body == "Hi Pat"
+
+
+def test_drain_sends_in_batches_and_updates_statuses(session_factory):
+    db = session_factory()
+    enqueue_sms_campaign(db, "c1", "Hello {name}", _recipients(8))
+    sender = FakeSender(fail_numbers={"5550000004"})
+
+    totals = asyncio.run(drain_outbox(campaign_id="c1", batch_size=3, session_factory=session_factory,
+                                      sender=sender, bucket=TokenBucket(1000)))
+
+    assert totals == {"sent": 7, "failed": 1}
+    assert sorted(sender.sent) == sorted(r["phone"] for r in _recipients(8))
+    check = session_factory()
+    campaign = check.get(SMSCampaign, "c1")
+    assert (campaign.status, campaign.sent_count, campaign.failed_count) == ("done", 7, 1)
+    assert campaign_progress(check, "c1")["sent"] == 7
+    failed = check.query(SMSMessage).filter(SMSMessage.status == "failed").one()
+    assert (failed.patient_id, failed.error_code, failed.attempts) == ("P4", "21211", 1)
+
+
+def test_stale_claims_are_resumed_without_resending_finished_rows(session_factory):
+    db = session_factory()
+    enqueue_sms_campaign(db, "c1", "Hello", _recipients(6))
+    sender = FakeSender()
+
+    # A worker claims a batch and dies before recording results
+    crashed = claim_batch(db, 2, campaign_id="c1")
+    assert len(crashed) == 2
+    asyncio.run(drain_outbox(campaign_id="c1", batch_size=10, session_factory=session_factory,
+                             sender=sender, bucket=TokenBucket(1000)))
+    assert len(sender.sent) == 4
+    assert session_factory().get(SMSCampaign, "c1").status == "sending"
+
+    assert release_stale_claims(session_factory(), timeout_seconds=0) == 2
+    asyncio.run(drain_outbox(campaign_id="c1", batch_size=10, session_factory=session_factory,
+                             sender=sender, bucket=TokenBucket(1000)))
+
+    assert sorted(sender.sent) == sorted(r["phone"] for r in _recipients(6))
+    campaign = session_factory().get(SMSCampaign, "c1")
+    assert (campaign.status, campaign.sent_count) == ("done", 6)
+
+
+def test_results_are_persisted_as_sends_finish(session_factory, monkeypatch):
+    monkeypatch.setattr(sms_outbox, "SMS_OUTBOX_RECORD_EVERY", 2)
+    enqueue_sms_campaign(session_factory(), "c1", "Hello", _recipients(6))
+
+    try:
+        asyncio.run(drain_outbox(campaign_id="c1", batch_size=10, session_factory=session_factory,
+                                 sender=CrashingSender(crash_after=3), bucket=TokenBucket(1000)))
+    except RuntimeError:
+        pass
+
+    progress = campaign_progress(session_factory(), "c1")
+    assert (progress["sent"], progress["sending"]) == (3, 3)  # nothing already sent is left to be re-queued
+
+
+def test_database_steps_run_off_the_event_loop(session_factory, monkeypatch):
+    monkeypatch.setattr(sms_outbox, "SMS_OUTBOX_RECORD_EVERY", 2)
+    enqueue_sms_campaign(session_factory(), "c1", "Hello", _recipients(5))
+    threads = []
+    for name in ("claim_batch", "record_results"):
+        step = getattr(sms_outbox, name)
+        monkeypatch.setattr(sms_outbox, name, lambda *a, _step=step, **k: threads.append(
+            threading.current_thread()) or _step(*a, **k))
+
+    totals = asyncio.run(drain_outbox(campaign_id="c1", batch_size=10, session_factory=session_factory,
+                                      sender=FakeSender(), bucket=TokenBucket(1000)))
+
+    assert totals == {"sent": 5, "failed": 0}
+    assert threads and threading.main_thread() not in threads
+
+
+def test_live_claims_are_kept_and_released_claims_not_overwritten(session_factory):
+    db = session_factory()
+    enqueue_sms_campaign(db, "c1", "Hello", _recipients(2))
+    rows = claim_batch(db, 2, campaign_id="c1")
+    token = rows[0].dispatch_token
+
+    # Claimed long ago, but the worker is still heartbeating
+    long_ago = datetime.utcnow() - timedelta(hours=1)
+    db.query(SMSMessage).update({"claimed_at": long_ago, "heartbeat_at": long_ago})
+    db.commit()
+    assert heartbeat_claim(db, token) == 2
+    assert release_stale_claims(db, timeout_seconds=60) == 0
+
+    assert release_stale_claims(db, timeout_seconds=0) == 2
+    reclaimed = claim_batch(db, 2, campaign_id="c1")
+    record_results(db, rows, [{"success": False, "error_code": 30001}] * 2, token)  # the old worker reports late
+
+    assert {r.status for r in db.query(SMSMessage)} == {"sending"}
+    assert {r.dispatch_token for r in db.query(SMSMessage)} == {reclaimed[0].dispatch_token}
+    assert db.get(SMSCampaign, "c1").failed_count == 0
@@ -0,0 +1,59 @@
+import asyncio
+
+from database import SMSCampaign, SMSMessage
+from services.sms_outbox import drain_outbox, enqueue_sms_campaign
+from services.sms_service import TokenBucket
+from services.sms_status import SMSStatusBuffer, flush_status_buffer
+
+
+class FakeSender:
+    async def send_messages_async(self, messages, status_callback=None, bucket=None, **kwargs):
+        return [{"success": True, "sid": f"SM-{m['to']}", "status": "queued", "to": m["to"]} for m in messages]
+
+
+def _sent_campaign(session_factory, n):
+    db = session_factory()
+    recipients = [{"patient_id": f"P{i}", "name": f"Pat {i}", "phone": f"555000{i:04d}"} for i in range(n)]
+    enqueue_sms_campaign(db, "c1", "Hi {name}", recipients)
+    asyncio.run(drain_outbox(campaign_id="c1", session_factory=session_factory, sender=FakeSender(), bucket=TokenBucket(1000)))
+    return db
+
+
+def test_buffer_keeps_highest_ranked_status_per_sid():
+    buffer = SMSStatusBuffer(max_size=2)
+
+    assert buffer.add("SM1", "delivered") is False
+    buffer.add("SM1", "sent")  # late, out-of-order callback
+    buffer.add("SM1", "bogus")
+    assert buffer.add("SM2", "queued") is True
+
+    pending = buffer.drain()
+    assert {sid: entry["status"] for sid, entry in pending.items()} == {"SM1": "delivered", "SM2": "queued"}
+    assert len(buffer) == 0
+
+
+def test_flush_updates_messages_and_counters_incrementally(session_factory):
+    db = _sent_campaign(session_factory, 4)
+    buffer = SMSStatusBuffer()
+    buffer.add("SM-5550000000", "delivered")
+    buffer.add("SM-5550000001", "undelivered", error_code="30003")
+    buffer.add("SM-5550000002", "sent")
+    buffer.add("SM-unknown", "delivered")
+
+    result = flush_status_buffer(session_factory=session_factory, buffer=buffer)
+    assert (result["updated"], result["ignored"]) == (2, 1)
+    assert list(buffer.drain()) == ["SM-unknown"]  # kept: the SID may not be written back yet
+
+    # Replayed and regressing callbacks don't move counters again
+    buffer.add("SM-5550000000", "delivered")
+    buffer.add("SM-5550000001", "sent")
+    buffer.add("SM-5550000002", "delivered")
+    assert flush_status_buffer(session_factory=session_factory, buffer=buffer)["updated"] == 1
+
+    db.expire_all()
+    campaign = db.get(SMSCampaign, "c1")
+    assert (campaign.sent_count, campaign.delivered_count, campaign.failed_count) == (4, 2, 1)
+    rows = {m.twilio_sid: m for m in db.query(SMSMessage)}
+    assert rows["SM-5550000000"].delivered_at is not None
+    assert (rows["SM-5550000001"].status, rows["SM-5550000001"].error_code) == ("undelivered", "30003")
+    assert rows["SM-5550000003"].status == "sent"
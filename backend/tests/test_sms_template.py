@@ -0,0 +1,39 @@
+import pandas as pd
+
+from services.sms_template import preview_sms_campaign, render_messages, segment_messages
+
+
+def test_render_fills_first_names_and_leaves_other_placeholders():
+    recipients = [{"name": "Ana Maria"}, {"name": ""}, {"name": "Zoë"}, {"phone": "5550001"}]
+    template = "Hi {name}! {offer} ends Friday, {name}."
+
+    rendered = render_messages(template, recipients).tolist()
+
+    assert rendered == [
+        "Hi Ana! {offer} ends Friday, Ana.",
+        "Hi there! {offer} ends Friday, there.",
+        "Hi Zoë! {offer} ends Friday, Zoë.",
+        "Hi there! {offer} ends Friday, there.",
+    ]
+
+
+def test_segment_counts_for_gsm7_and_ucs2():
+    stats = segment_messages(pd.Series(["a" * 160, "a" * 161, "€" * 80, "€" * 81, "é" * 160, "ž" * 70, "ž" * 71, "😀" * 35]))
+
+    assert stats["encoding"].tolist() == ["GSM-7"] * 5 + ["UCS-2"] * 3
+    assert stats["segments"].tolist() == [1, 2, 1, 2, 1, 1, 2, 1]
+
+
+def test_preview_estimates_cost_for_large_lists():
+    names = [f"Pat{i} Smith" for i in range(99_998)] + ["Renée Smith", "Łukasz Nowak"]
+    recipients = pd.DataFrame({"name": names, "phone": "5550000"})
+
+    preview = preview_sms_campaign("Hi {name}, your visit is due. Reply STOP to opt out.", recipients,
+                                   cost_per_segment=0.01)
+
+    assert preview["total_recipients"] == 100_000
+    assert preview["encoding"] == {"GSM-7": 99_999, "UCS-2": 1}  # é is in GSM-7, Ł is not
+    assert preview["segments_per_message"] == {"1": 100_000}
+    assert preview["estimated_cost"] == 1000.0
+    assert any("recipient names" in w for w in preview["warnings"])
+    assert preview["sample"][0]["message"].startswith("Hi Pat0, ")
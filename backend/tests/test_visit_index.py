@@ -0,0 +1,34 @@
+import pandas as pd
+from services.churn_scoring import calculate_procedure_intervals
+from services.visit_index import build_visit_index
+
+
+def _visits():
+    return pd.DataFrame({
+        'patient_id': ['b', 'a', 'a', 'a', 'b', 'c'],
+        'visit_date': ['2025-02-01', '2025-03-01', '2025-01-01', '2025-02-10', '2025-01-01', 'not a date'],
+        'treatment': ['Filler', 'Botox ', 'Botox', None, 'Botox', 'Botox'],
+        'revenue': [800, 400, 400, 100, 400, 400],
+    })
+
+
+def test_index_sorts_once_and_derives_sequence_columns():
+    index = build_visit_index(_visits())
+
+    assert index['patient_id'].tolist() == ['a', 'a', 'a', 'b', 'b']
+    assert index['visit_seq'].tolist() == [1, 2, 3, 1, 2]
+    assert index['visit_count'].tolist() == [3, 3, 3, 2, 2]
+    assert index['next_visit_gap'].tolist()[:2] == [40, 19]
+
+    # Service sequence skips the visit without a treatment
+    serviced = index[index['service'].notna()]
+    assert serviced['service'].tolist() == ['Botox', 'Botox', 'Botox', 'Filler']
+    assert serviced['next_service_gap'].tolist()[0] == 59
+    assert serviced['next_service'].tolist()[2] == 'Filler'
+    assert serviced['first_service'].tolist() == ['Botox', 'Botox', 'Botox', 'Botox']
+    assert serviced['patient_ltv'].tolist() == [800, 800, 1200, 1200]
+
+
+def test_procedure_intervals_from_visit_gaps():
+    intervals = calculate_procedure_intervals(pd.DataFrame(), visit_index=build_visit_index(_visits()))
+    assert intervals == {'Botox': 59.0, 'Filler': 31.0, 'default': 45.0}